@@ -1,6 +1,19 @@
-import json, random, getpass, os, pandas as pd, matplotlib.pyplot as plt
+import json, random, getpass, os, sys, csv, gzip, copy, time, calendar, atexit, sqlite3, threading, asyncio, mmap, struct, zlib, uuid, math
+from collections import OrderedDict
+from collections.abc import MutableSequence, MutableMapping
+from array import array
 from termcolor import colored
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from itertools import islice, chain
+from contextlib import contextmanager, ExitStack
+from functools import lru_cache, wraps
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError:
+    fcntl=None
+    import msvcrt
 
 #Shows colored text in system terminal
 os.system('color')
@@ -13,43 +26,1860 @@ CURRENCY_RATES={
     'JPY': 150 
 }
 
+#Digits of each currency's minor unit (cents, paise), the yen has none. Money is added and subtracted
+#as a whole number of minor units, so balances never pick up float drift. They are still stored as floats,
+#each one rounded to a whole number of minor units.
+CURRENCY_DECIMALS={
+    'USD': 2,
+    'INR': 2,
+    'EUR': 2,
+    'JPY': 0
+}
+MINOR_UNITS={currency: 10**decimals for currency, decimals in CURRENCY_DECIMALS.items()}
+
+#Pairwise conversion factors built once from CURRENCY_RATES: CONVERSION_MATRIX[i][j] turns an amount in
+#CURRENCY_CODES[i] into CURRENCY_CODES[j], so a conversion is a lookup and one multiply.
+CURRENCY_CODES=list(CURRENCY_RATES)
+CURRENCY_INDEX={currency: i for i, currency in enumerate(CURRENCY_CODES)}
+CONVERSION_MATRIX=[[CURRENCY_RATES[to_currency]/CURRENCY_RATES[from_currency] for to_currency in CURRENCY_CODES] for from_currency in CURRENCY_CODES]
+CONVERSION_RATES={(from_currency, to_currency): CONVERSION_MATRIX[i][j] for from_currency, i in CURRENCY_INDEX.items() for to_currency, j in CURRENCY_INDEX.items()}
+#The same factors scaled to the target's minor unit: round(amount*factor) is the converted amount in minor units.
+MINOR_CONVERSION={(from_currency, to_currency): rate*MINOR_UNITS[to_currency] for (from_currency, to_currency), rate in CONVERSION_RATES.items()}
+
 #'directory=os.path.join(os.path.expanduser('~'), 'BankData')' for different systems
-directory=r'C:\Users\pc\Desktop\my_folder\Python'
+directory=os.environ.get('BANK_DATA_DIR', r'C:\Users\pc\Desktop\my_folder\Python')
 os.makedirs(directory, exist_ok=True)
 file_path=os.path.join(directory, 'accounts.json')
 
-#Utitlity functions to load and save accounts
+#The files of the unsharded json store, the data directory (see json_store)
+journal_path=os.path.join(directory, 'accounts.journal')
+index_path=os.path.join(directory, 'accounts.idx')
+binary_path=os.path.join(directory, 'accounts.bin')
+lock_path=os.path.join(directory, 'accounts.lock')
+db_path=os.path.join(directory, 'accounts.db')
+#Kept in the data directory whatever the layout: the shard directories, the last account ID handed out,
+#the decisions of transfers between shards, and the account event stream
+shards_path=os.path.join(directory, 'shards.json')
+ids_path=os.path.join(directory, 'accounts.ids')
+transfers_path=os.path.join(directory, 'transfers.log')
+events_path=os.path.join(directory, 'events.log')
+
+#Where accounts are stored: 'json' (accounts.json plus a journal) or 'sqlite' (accounts.db)
+STORAGE_BACKEND=os.environ.get('BANK_STORAGE_BACKEND', 'json')
+#The json backend's snapshot: 'json' (accounts.json) or 'binary' (accounts.bin), the journal is the same for both
+SNAPSHOT_FORMAT=os.environ.get('BANK_SNAPSHOT_FORMAT', 'json')
+
+#BANK_EVENTS=0 turns the account event stream off (see publish_events)
+EVENTS_ENABLED=os.environ.get('BANK_EVENTS', '1')!='0'
+
+#Journal tuning: fsync once every N appended records, fold into a new snapshot after M records
+JOURNAL_SYNC_EVERY=32
+JOURNAL_COMPACT_AT=1000
+
+#A json store is one directory with its snapshot, journal and lock file, plus where this process is in the journal.
+#Unsharded there is one, the data directory itself; 'reshard' spreads the accounts over several, listed in shards.json.
+def json_store(path, number=0):
+    os.makedirs(path, exist_ok=True)
+    return {
+        'number': number,
+        'file_path': os.path.join(path, 'accounts.json'),
+        'journal_path': os.path.join(path, 'accounts.journal'),
+        'index_path': os.path.join(path, 'accounts.idx'),
+        'binary_path': os.path.join(path, 'accounts.bin'),
+        'lock_path': os.path.join(path, 'accounts.lock'),
+        'journal': {'file': None, 'unsynced': 0, 'records': 0, 'offset': 0, 'generation': None, 'prepared': {}},
+        'lock': {'lock': threading.RLock(), 'depth': 0, 'file': None}
+    }
+
+#Shard directories may be relative to the data directory or anywhere else, e.g. on other disks.
+def open_shards(paths=None):
+    if paths is None:
+        try:
+            with open(shards_path) as f:
+                paths=json.load(f)['shards']
+        except FileNotFoundError:
+            return [json_store(directory)]
+    return [json_store(os.path.normpath(os.path.join(directory, path)), number) for number, path in enumerate(paths)]
+
+SHARDS=open_shards()
+
+#Accounts are spread over the shards by a hash of their ID; crc32 rather than hash(), which differs between processes.
+def shard_number(account_id):
+    return zlib.crc32(account_id.encode())%len(SHARDS) if len(SHARDS)>1 else 0
+
+#The stores holding these accounts, in shard order.
+def stores_of(account_ids):
+    return [SHARDS[number] for number in sorted({shard_number(account_id) for account_id in account_ids})]
+
+#Raised when an operation breaks a banking rule, the message is meant for the user
+class BankingError(Exception):
+    pass
+
+#Raised when an account was changed by another client after this one read it
+class ConflictError(BankingError):
+    def __init__(self, account_id):
+        super().__init__(f'Account {account_id} was changed by another session. Please try again.')
+        self.account_id=account_id
+        count('bank_conflicts_total')
+
+#Raised when an account ID, PIN or OTP does not check out
+class AuthenticationError(BankingError):
+    pass
+
+#Instrumentation. Counters and timing histograms are kept in memory and written out at exit to
+#BANK_METRICS_FILE (metrics.prom in the data directory by default) as Prometheus text, or as JSON when
+#the name ends in .json. The service also answers GET /metrics. With BANK_PROFILE=<file> set, the
+#whole run is profiled with cProfile and its stats saved there.
+METRICS_FILE=os.environ.get('BANK_METRICS_FILE', os.path.join(directory, 'metrics.prom'))
+PROFILE_FILE=os.environ.get('BANK_PROFILE')
+METRIC_BUCKETS=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, float('inf'))
+METRIC_HELP={
+    'bank_load_data_seconds': 'Time to load the accounts from the store',
+    'bank_save_accounts_seconds': 'Time to store changes or a full snapshot',
+    'bank_compact_storage_seconds': 'Time to fold the journal into a snapshot',
+    'bank_currency_conversion_seconds': 'Time per currency_converter call, sampled 1 in 100',
+    'bank_accounts_table_seconds': 'Time to export the accounts and transactions CSV files',
+    'bank_operation_seconds': 'Time per banking operation, including its save',
+    'bank_service_request_seconds': 'Time per service request',
+    'bank_service_requests_total': 'Service requests by method and HTTP status',
+    'bank_operations_total': 'Banking operations by type and outcome',
+    'bank_menu_selections_total': 'Main menu options chosen',
+    'bank_bytes_written_total': 'Bytes written, by file',
+    'bank_failed_authentications_total': 'Rejected PINs, OTPs and sessions',
+    'bank_otp_sent_total': 'OTPs issued',
+    'bank_sessions_total': 'Sessions started after a PIN check',
+    'bank_conflicts_total': 'Saves refused because another client changed the account',
+    'bank_cross_shard_commits_total': 'Saves committed across shards with two-phase commit',
+    'bank_events_total': 'Account events appended to the event stream'
+}
+
+_metrics={'counters': {}, 'histograms': {}, 'lock': threading.Lock()}
+
+def metric_key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def count(name, amount=1, **labels):
+    key=metric_key(name, labels)
+    with _metrics['lock']:
+        _metrics['counters'][key]=_metrics['counters'].get(key, 0)+amount
+
+#Histograms keep a count per bucket (made cumulative on export), the sum and the number of observations.
+def observe(key, seconds):
+    with _metrics['lock']:
+        histogram=_metrics['histograms'].get(key)
+        if histogram is None:
+            histogram=_metrics['histograms'][key]=[[0]*len(METRIC_BUCKETS), 0.0, 0]
+        histogram[0][bisect_left(METRIC_BUCKETS, seconds)]+=1
+        histogram[1]+=seconds
+        histogram[2]+=1
+
+#Times calls of the decorated function into the named histogram. Functions that take well under a
+#microsecond, like currency_converter, pass sample=N so only every Nth call pays for the timing.
+def instrumented(name, sample=1, **labels):
+    key=metric_key(name, labels)
+    def decorate(function):
+        skip=0
+        @wraps(function)
+        def timed(*args, **kwargs):
+            nonlocal skip
+            if skip:
+                skip-=1
+                return function(*args, **kwargs)
+            skip=sample-1
+            started=time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(key, time.perf_counter()-started)
+        return timed
+    return decorate
+
+#Like instrumented, and counts the operation as 'ok' or 'rejected' (BankingError) in bank_operations_total.
+def operation(name):
+    key=metric_key('bank_operation_seconds', {'operation': name})
+    def decorate(function):
+        @wraps(function)
+        def timed(*args, **kwargs):
+            started=time.perf_counter()
+            status='ok'
+            try:
+                return function(*args, **kwargs)
+            except BankingError:
+                status='rejected'
+                raise
+            finally:
+                observe(key, time.perf_counter()-started)
+                count('bank_operations_total', operation=name, status=status)
+        return timed
+    return decorate
+
+def format_labels(labels, **extra):
+    pairs=list(labels)+list(extra.items())
+    return '{'+','.join(f'{k}="{v}"' for k, v in pairs)+'}' if pairs else ''
+
+def metrics_text():
+    with _metrics['lock']:
+        counters=dict(_metrics['counters'])
+        histograms={key: [list(value[0]), value[1], value[2]] for key, value in _metrics['histograms'].items()}
+    lines=[]
+    for kind, metrics in (('counter', counters), ('histogram', histograms)):
+        for name in sorted({name for name, _ in metrics}):
+            lines.append(f'# HELP {name} {METRIC_HELP.get(name, name)}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(metrics.items()):
+                if metric!=name:
+                    continue
+                if kind=='counter':
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+                    continue
+                buckets, total, observations=value
+                cumulative=0
+                for bound, bucket in zip(METRIC_BUCKETS, buckets):
+                    cumulative+=bucket
+                    lines.append(f"{name}_bucket{format_labels(labels, le='+Inf' if bound==float('inf') else bound)} {cumulative}")
+                lines.append(f'{name}_sum{format_labels(labels)} {total:.6f}')
+                lines.append(f'{name}_count{format_labels(labels)} {observations}')
+    return '\n'.join(lines)+'\n'
+
+def metrics_json():
+    with _metrics['lock']:
+        return {
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(_metrics['counters'].items())],
+            'histograms': [{'name': name, 'labels': dict(labels), 'buckets': dict(zip(map(str, METRIC_BUCKETS), value[0])), 'sum': value[1], 'count': value[2]}
+                           for (name, labels), value in sorted(_metrics['histograms'].items())]
+        }
+
+def write_metrics(path=None):
+    path=path or METRICS_FILE
+    if not path or not (_metrics['counters'] or _metrics['histograms']):
+        return
+    try:
+        with open(path+'.tmp', 'w') as f:
+            if path.endswith('.json'):
+                json.dump(metrics_json(), f, indent=2)
+            else:
+                f.write(metrics_text())
+        os.replace(path+'.tmp', path)
+    except OSError as e:
+        print(colored(f'Error writing metrics: {e}', 'light_red'))
+
+atexit.register(write_metrics)
+
+#Runs the block under cProfile when BANK_PROFILE is set.
+@contextmanager
+def profiling():
+    if not PROFILE_FILE:
+        yield
+        return
+    import cProfile
+    profiler=cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(PROFILE_FILE)
+        print(colored(f'Profile written to {PROFILE_FILE}', 'cyan'))
+
+#Utitlity functions to load and save accounts, through the selected storage backend
+@instrumented('bank_load_data_seconds')
 def load_data():
+    with store_lock():
+        accounts=STORAGE_BACKENDS[STORAGE_BACKEND]['load']()
+    index_accounts(accounts)
+    return accounts
+
+#With journal entries (see journal_entry) only those changes are stored,
+#without any the whole accounts dict is written out. The changes' events are published before the
+#accounts' store locks are let go (see publish_events).
+@instrumented('bank_save_accounts_seconds')
+def save_accounts(accounts, *changes):
     try:
-        with open(file_path, "r") as f:
-            return json.load(f)
+        with store_lock(*stores_of({change['id'] for change in changes})):
+            STORAGE_BACKENDS[STORAGE_BACKEND]['save'](accounts, *changes)
+            if changes and EVENTS_ENABLED:
+                publish_events(accounts, changes)
+    except (IOError, sqlite3.Error) as e:
+        print(colored(f'Error saving accounts data: {e}', 'light_red'))
+
+#Folds pending changes into the backend's main storage, run on exit.
+@instrumented('bank_compact_storage_seconds')
+def compact_storage(accounts):
+    try:
+        STORAGE_BACKENDS[STORAGE_BACKEND]['compact'](accounts)
+    except (IOError, sqlite3.Error) as e:
+        print(colored(f'Error saving accounts data: {e}', 'light_red'))
+
+#Brings the given accounts up to date with changes other clients have stored.
+def refresh_accounts(accounts, account_ids):
+    STORAGE_BACKENDS[STORAGE_BACKEND]['refresh'](accounts, account_ids)
+
+#Locking. Threads lock the accounts they change (see account_transaction), and each store is locked
+#by a thread lock plus an OS file lock on its accounts.lock, so other processes wait while it is read or written.
+_locks={'guard': threading.Lock(), 'accounts': {}, 'deferred': {}, 'active': 0}
+_local=threading.local()
+
+def lock_file(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+def unlock_file(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+#Re-entrant within a thread, only the outermost level takes the file lock.
+@contextmanager
+def lock_store(store):
+    state=store['lock']
+    with state['lock']:
+        if state['depth']==0:
+            if state['file'] is None:
+                state['file']=open(store['lock_path'], 'a+b')
+            lock_file(state['file'])
+        state['depth']+=1
+        try:
+            yield
+        finally:
+            state['depth']-=1
+            if state['depth']==0:
+                unlock_file(state['file'])
+
+#Locks the given stores, or every shard, always in shard order so two writers cannot deadlock.
+@contextmanager
+def store_lock(*stores):
+    with ExitStack() as stack:
+        for store in sorted(stores or SHARDS, key=lambda store: store['number']):
+            stack.enter_context(lock_store(store))
+        yield
+
+def account_lock(account_id):
+    lock=_locks['accounts'].get(account_id)
+    if lock is None:
+        with _locks['guard']:
+            lock=_locks['accounts'].setdefault(account_id, threading.Lock())
+    return lock
+
+#Loan schedules are never changed in place (only a loan's 'next' and 'credit' move), so each loan record is copied shallowly.
+#Balance checkpoints are not copied at all, restore_account trims them to the restored history instead.
+def account_image(account):
+    if account is None:
+        return None
+    fields={k: [dict(loan) for loan in v] if k=='Loan records' else v if k=='Balances' else copy.deepcopy(v) for k, v in account.items() if k!='Transactions'}
+    return fields, len(account['Transactions'])
+
+def restore_account(accounts, account_id, image):
+    if image is None:
+        account=accounts.pop(account_id, None)
+        if account is not None and account_index.get(account['Account number'])==account_id:
+            del account_index[account['Account number']]
+        loan_due_index.pop(account_id, None)
+        return
+    fields, count=image
+    account=accounts[account_id]
+    transactions=account['Transactions']
+    account.clear()
+    account.update(fields)
+    account['Transactions']=transactions
+    if isinstance(transactions, LazyTransactions) and transactions.items is None:
+        del transactions.tail[max(0, count-transactions.stored):]
+    else:
+        del transactions[count:]
+    trim_balances(account)
+    reindex_account(account_id, account)
+
+#Locks the given accounts, always in sorted ID order so two transfers between the same pair of accounts
+#cannot deadlock, and brings them up to date. If the block raises, every change made to them is undone.
+#Changes another process stores meanwhile are held back until the block ends; saving one of these
+#accounts in the meantime raises ConflictError instead of overwriting them.
+@contextmanager
+def account_transaction(accounts, *account_ids):
+    ids=sorted(set(account_ids))
+    locks=[account_lock(account_id) for account_id in ids]
+    for lock in locks:
+        lock.acquire()
+    with _locks['guard']:
+        _locks['active']+=1
+    _local.held=set(ids)
+    _local.dirty=False
+    try:
+        refresh_accounts(accounts, ids)
+        with _locks['guard']:
+            apply_deferred(accounts, ids)
+        before={account_id: account_image(accounts.get(account_id)) for account_id in ids}
+        _local.dirty=True
+        try:
+            yield
+        except BaseException:
+            for account_id in ids:
+                restore_account(accounts, account_id, before[account_id])
+            raise
+    finally:
+        with _locks['guard']:
+            apply_deferred(accounts, ids)
+            _local.held=set()
+            _local.dirty=False
+            _locks['active']-=1
+            for lock in reversed(locks):
+                lock.release()
+        if _locks['active']==0 and STORAGE_BACKEND=='json':
+            compact_full_journals(accounts)
+
+#Transaction histories are held in memory column by column instead of one dict per transaction.
+#The type and the name of its timestamp field ('timestamp', or legacy 'date'/'time') are interned as a small kind
+#code, the timestamp is kept as epoch seconds and anything else ('to', 'from') goes into a sparse side table.
+#Reading a transaction still gives a plain dict, so nothing else has to know.
+TRANSACTION_KINDS=[(None, None)]  # kind 0: stored whole in the side table
+TRANSACTION_KIND_CODES={(None, None): 0}
+STAMP_SEPARATORS={'date': '-', 'time': '/'}
+_kinds_lock=threading.Lock()
+
+def transaction_kind(ttype, stamp_key):
+    code=TRANSACTION_KIND_CODES.get((ttype, stamp_key))
+    if code is None:
+        with _kinds_lock:
+            code=TRANSACTION_KIND_CODES.get((ttype, stamp_key))
+            if code is None:
+                TRANSACTION_KINDS.append((ttype, stamp_key))
+                code=TRANSACTION_KIND_CODES[(ttype, stamp_key)]=len(TRANSACTION_KINDS)-1
+    return code
+
+#Formatting is cached by day and by second of the day, histories share both heavily.
+@lru_cache(maxsize=4096)
+def stamp_day(day, separator):
+    t=time.gmtime(day*86400)
+    return f'{t.tm_mday:02d}{separator}{t.tm_mon:02d}{separator}{t.tm_year:04d} '
+
+@lru_cache(maxsize=None)
+def stamp_clock(seconds):
+    return f'{seconds//3600:02d}:{seconds//60%60:02d}:{seconds%60:02d}'
+
+def epoch_to_stamp(seconds, separator):
+    day, clock=divmod(seconds, 86400)
+    return stamp_day(day, separator)+stamp_clock(clock)
+
+#Parsing goes through the same caches. Each part must format back to exactly the same text,
+#otherwise ValueError, so a stamp that is stored as a number always reads back unchanged.
+@lru_cache(maxsize=4096)
+def parse_stamp_day(text):
+    day=calendar.timegm((int(text[6:10]), int(text[3:5]), int(text[0:2]), 0, 0, 0))//86400
+    if stamp_day(day, text[2])!=text+' ':
+        raise ValueError(f'Unexpected date {text!r}')
+    return day
+
+@lru_cache(maxsize=None)
+def parse_stamp_clock(text):
+    seconds=int(text[0:2])*3600+int(text[3:5])*60+int(text[6:8])
+    if seconds>=86400 or stamp_clock(seconds)!=text:
+        raise ValueError(f'Unexpected time {text!r}')
+    return seconds
+
+#dd-mm-YYYY HH:MM:SS (or with '/') to seconds since 1970, the wall-clock time is taken as is.
+def stamp_to_epoch(stamp):
+    if len(stamp)!=19 or stamp[10]!=' ':
+        raise ValueError(f'Unexpected timestamp {stamp!r}')
+    return parse_stamp_day(stamp[:10])*86400+parse_stamp_clock(stamp[11:])
+
+class TransactionColumns(MutableSequence):
+    __slots__=('kinds', 'amounts', 'stamps', 'extras')
+
+    def __init__(self, transactions=()):
+        self.kinds=array('H')
+        self.amounts=array('d')
+        self.stamps=array('q')
+        self.extras={}
+        for txn in transactions:
+            self.append(txn)
+
+    #A transaction as (kind, amount, stamp, extra fields). Ones that do not fit the columns
+    #(no type, a non-numeric amount, a timestamp that would not read back the same) are kept whole.
+    @staticmethod
+    def encode(txn):
+        ttype, amount=txn.get('type'), txn.get('amount')
+        stamp_key='timestamp' if 'timestamp' in txn else 'date' if 'date' in txn else 'time' if 'time' in txn else None
+        try:
+            if not isinstance(ttype, str) or type(amount) not in (int, float):
+                raise ValueError
+            stamp=0
+            if stamp_key=='timestamp':
+                if type(txn['timestamp']) is not int:
+                    raise ValueError
+                stamp=txn['timestamp']
+            elif stamp_key is not None:
+                if txn[stamp_key][2:3]!=STAMP_SEPARATORS[stamp_key]:
+                    raise ValueError
+                stamp=stamp_to_epoch(txn[stamp_key])
+        except (TypeError, ValueError, OverflowError):
+            return 0, 0.0, 0, dict(txn)
+        extra={k: v for k, v in txn.items() if k!='type' and k!='amount' and k!=stamp_key} if len(txn)>2+(stamp_key is not None) else None
+        return transaction_kind(ttype, stamp_key), amount, stamp, extra
+
+    def transaction(self, i):
+        kind=self.kinds[i]
+        if kind==0:
+            return dict(self.extras[i])
+        ttype, stamp_key=TRANSACTION_KINDS[kind]
+        txn={'type': ttype, 'amount': self.amounts[i]}
+        if i in self.extras:
+            txn.update(self.extras[i])
+        if stamp_key=='timestamp':
+            txn['timestamp']=self.stamps[i]
+        elif stamp_key is not None:
+            txn[stamp_key]=epoch_to_stamp(self.stamps[i], STAMP_SEPARATORS[stamp_key])
+        return txn
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.transaction(i) for i in range(*index.indices(len(self)))]
+        if index<0:
+            index+=len(self)
+        if not 0<=index<len(self):
+            raise IndexError('transaction index out of range')
+        return self.transaction(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.transaction(i)
+
+    def append(self, txn):
+        kind, amount, stamp, extra=self.encode(txn)
+        if extra:
+            self.extras[len(self.kinds)]=extra
+        self.kinds.append(kind)
+        self.amounts.append(amount)
+        self.stamps.append(stamp)
+
+    #Cutting the tail off (restore_account, journal replay) or the head (archive_account) is done in place,
+    #anything else rebuilds the columns.
+    def __delitem__(self, index):
+        if isinstance(index, slice) and index.step in (None, 1) and index.indices(len(self))[1]==len(self):
+            start=index.indices(len(self))[0]
+            del self.kinds[start:], self.amounts[start:], self.stamps[start:]
+            for i in [i for i in self.extras if i>=start]:
+                del self.extras[i]
+            return
+        if isinstance(index, slice) and index.step in (None, 1) and index.indices(len(self))[0]==0:
+            stop=index.indices(len(self))[1]
+            del self.kinds[:stop], self.amounts[:stop], self.stamps[:stop]
+            self.extras={i-stop: extra for i, extra in self.extras.items() if i>=stop}
+            return
+        transactions=list(self)
+        del transactions[index]
+        self.rebuild(transactions)
+
+    def __setitem__(self, index, value):
+        transactions=list(self)
+        transactions[index]=value
+        self.rebuild(transactions)
+
+    def insert(self, index, value):
+        if index>=len(self):
+            self.append(value)
+            return
+        transactions=list(self)
+        transactions.insert(index, value)
+        self.rebuild(transactions)
+
+    def rebuild(self, transactions):
+        self.__init__(transactions)
+
+    @classmethod
+    def from_columns(cls, kinds, amounts, stamps, extras):
+        columns=cls()
+        columns.kinds, columns.amounts, columns.stamps, columns.extras=kinds, amounts, stamps, extras
+        return columns
+
+    def __repr__(self):
+        return repr(list(self))
+
+#json.load object_hook: swaps each account's list of transaction dicts for columns as soon as it is parsed.
+def compact_transactions(obj):
+    if type(obj.get('Transactions')) is list:
+        obj['Transactions']=TransactionColumns(obj['Transactions'])
+    return obj
+
+#json.dumps default: transaction columns (and SQLite's lazy histories) are written out as plain lists.
+def json_default(obj):
+    if isinstance(obj, MutableSequence):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+#Accounts of a snapshot are only parsed when first used. accounts.idx, written with every snapshot, holds columns
+#with the byte range of each account's line plus the account numbers, inactive IDs and next loan installments
+#(all account_index and loan_due_index need),
+#and the snapshot itself is memory-mapped. Accounts never touched are written back to the next snapshot byte for byte.
+class LazyAccounts(MutableMapping):
+    def __init__(self, data, index, spans):
+        self.data=data
+        self.spans=dict(zip(index['ids'], spans))
+        self.numbers=dict(zip(index['ids'], index['numbers']))
+        self.inactive=set(index['inactive'])
+        self.loans_due=index.get('loans_due', {})
+        self.loaded={}
+
+    def parse(self, span):
+        return json.loads(self.data[span[0]:span[1]], object_hook=compact_transactions)
+
+    def __getitem__(self, account_id):
+        account=self.loaded.get(account_id)
+        if account is None:
+            account=self.loaded.setdefault(account_id, self.parse(self.spans[account_id]))
+        return account
+
+    #Like accounts[account_id], without keeping the parsed account around. For writing out a whole snapshot.
+    def peek(self, account_id):
+        account=self.loaded.get(account_id)
+        return account if account is not None else self.parse(self.spans[account_id])
+
+    def __setitem__(self, account_id, account):
+        self.spans.setdefault(account_id, None)
+        self.loaded[account_id]=account
+
+    def __delitem__(self, account_id):
+        del self.spans[account_id]
+        self.loaded.pop(account_id, None)
+        self.numbers.pop(account_id, None)
+        self.inactive.discard(account_id)
+        self.loans_due.pop(account_id, None)
+
+    def __contains__(self, account_id):
+        return account_id in self.spans
+
+    def __iter__(self):
+        return iter(self.spans)
+
+    def __len__(self):
+        return len(self.spans)
+
+    #The stored line of an account that has not been parsed, otherwise None.
+    def raw(self, account_id):
+        if account_id in self.loaded:
+            return None
+        start, end=self.spans[account_id]
+        return self.data[start:end]
+
+#Maps a snapshot file read-only. Windows cannot replace a file that is mapped, so there it is read into memory instead.
+def map_snapshot(f):
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if fcntl else f.read()
+
+#The snapshot opened through its index, or None when there is no index or it belongs to another snapshot.
+def open_snapshot(store):
+    try:
+        with open(store['index_path']) as f:
+            index=json.load(f)
+        with open(store['file_path'], 'rb') as f:
+            stat=os.fstat(f.fileno())
+            if [stat.st_size, stat.st_mtime_ns]!=index['snapshot']:
+                return None
+            data=map_snapshot(f)
+        return LazyAccounts(data, index, zip(index['starts'], index['ends']))
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, ValueError):
+        return None
+
+#Binary snapshot (accounts.bin), all numbers little-endian:
+#  header          magic, number of accounts, offset of the account records, offset of the table
+#  account records one fixed-width ACCOUNT_RECORD per account, in table order
+#  account data    per account its transaction columns (amounts, stamps, kinds, padded to 8 bytes),
+#                  then a JSON blob with its other fields and any transaction extras
+#  table           JSON with the account IDs, numbers, inactive IDs and next loan installments (as in
+#                  accounts.idx) and the transaction kinds the stored kind codes stand for
+#Balance, USD amount, Loans, Version and Active are repeated in the record, so they can be read straight
+#from the mapped file (see BinaryAccounts.record) without decoding the account.
+BINARY_MAGIC=b'BANKSNP1'
+BINARY_HEADER=struct.Struct('<8sIQQ')
+ACCOUNT_RECORD=struct.Struct('<QIIdddqB7x')
+RECORD_FIELDS=('Balance', 'USD amount', 'Loans')
+
+def record_number(value):
+    return float(value) if type(value) in (int, float) else float('nan')
+
+def column_bytes(column):
+    if sys.byteorder!='little':
+        column=array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+def read_column(typecode, data):
+    column=array(typecode)
+    column.frombytes(data)
+    if sys.byteorder!='little':
+        column.byteswap()
+    return column
+
+class BinaryAccounts(LazyAccounts):
+    def __init__(self, data, index, records_at):
+        super().__init__(data, index, range(len(index['ids'])))
+        self.records_at=records_at
+        #Kind codes are interned per process, so the file's codes are mapped onto ours.
+        self.kind_map=array('H', [transaction_kind(ttype, stamp_key) if code else 0 for code, (ttype, stamp_key) in enumerate(index['kinds'])])
+        self.same_kinds=self.kind_map==array('H', range(len(self.kind_map)))
+
+    def parse(self, position):
+        data_at, length, blob_length=ACCOUNT_RECORD.unpack_from(self.data, self.records_at+position*ACCOUNT_RECORD.size)[:3]
+        amounts=read_column('d', self.data[data_at:data_at+8*length])
+        stamps=read_column('q', self.data[data_at+8*length:data_at+16*length])
+        kinds=read_column('H', self.data[data_at+16*length:data_at+18*length])
+        if not self.same_kinds:
+            kinds=array('H', [self.kind_map[kind] for kind in kinds])
+        blob_at=data_at+(18*length+7)//8*8
+        account, extras=json.loads(self.data[blob_at:blob_at+blob_length])
+        account['Transactions']=TransactionColumns.from_columns(kinds, amounts, stamps, {position: extra for position, extra in extras})
+        return account
+
+    def raw(self, account_id):
+        return None
+
+    #Balance, USD amount, Loans, Version and Active of an account, read from its record without decoding it.
+    def record(self, account_id):
+        account=self.loaded.get(account_id)
+        if account is not None:
+            return {field: account.get(field) for field in (*RECORD_FIELDS, 'Version', 'Active')}
+        fields=ACCOUNT_RECORD.unpack_from(self.data, self.records_at+self.spans[account_id]*ACCOUNT_RECORD.size)[3:]
+        return dict(zip((*RECORD_FIELDS, 'Version', 'Active'), (*fields[:4], bool(fields[4]))))
+
+def open_binary_snapshot(store):
+    with open(store['binary_path'], 'rb') as f:
+        data=map_snapshot(f)
+    magic, count, records_at, table_at=BINARY_HEADER.unpack_from(data)
+    if magic!=BINARY_MAGIC:
+        raise ValueError(f"{store['binary_path']} is not a binary accounts snapshot.")
+    return BinaryAccounts(data, json.loads(data[table_at:]), records_at)
+
+def write_binary_snapshot(accounts, store):
+    tmp_path=store['binary_path']+'.tmp'
+    lazy=isinstance(accounts, LazyAccounts)
+    ids=list(accounts)
+    numbers, inactive, loans_due=[], [], {}
+    records=bytearray(len(ids)*ACCOUNT_RECORD.size)
+    offset=BINARY_HEADER.size+len(records)
+    with open(tmp_path, 'wb', buffering=1<<20) as file:
+        file.write(bytes(offset))
+        for position, account_id in enumerate(ids):
+            account=accounts.peek(account_id) if lazy else accounts[account_id]
+            transactions=account['Transactions']
+            if not isinstance(transactions, TransactionColumns):
+                transactions=TransactionColumns(transactions)
+            columns=column_bytes(transactions.amounts)+column_bytes(transactions.stamps)+column_bytes(transactions.kinds)
+            columns+=bytes(-len(columns)%8)
+            fields={key: (None if key=='Transactions' else value) for key, value in account.items()}
+            blob=json.dumps([fields, sorted(transactions.extras.items())], default=json_default).encode()
+            file.write(columns)
+            file.write(blob)
+            active=account.get('Active', True)
+            ACCOUNT_RECORD.pack_into(records, position*ACCOUNT_RECORD.size, offset, len(transactions), len(blob),
+                                     *(record_number(account.get(field)) for field in RECORD_FIELDS), account.get('Version', 0), bool(active))
+            offset+=len(columns)+len(blob)
+            numbers.append(account['Account number'])
+            if not active:
+                inactive.append(account_id)
+            due=next_loan_due(account)
+            if due is not None:
+                loans_due[account_id]=due
+        file.write(json.dumps({'ids': ids, 'numbers': numbers, 'inactive': inactive, 'loans_due': loans_due, 'kinds': TRANSACTION_KINDS}).encode())
+        count('bank_bytes_written_total', file.tell(), file='snapshot')
+        file.seek(0)
+        file.write(BINARY_HEADER.pack(BINARY_MAGIC, len(ids), BINARY_HEADER.size, offset))
+        file.write(records)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, store['binary_path'])
+
+#Every shard is loaded on its own; with more than one they are put together behind a ShardedAccounts.
+def json_load_data():
+    if len(SHARDS)==1:
+        return load_store(SHARDS[0])
+    return ShardedAccounts([load_store(store) for store in SHARDS])
+
+#The configured snapshot format is read if that file exists, otherwise the other one, so switching
+#BANK_SNAPSHOT_FORMAT converts the store at its next snapshot (see write_snapshot).
+def load_store(store):
+    accounts=None
+    try:
+        if SNAPSHOT_FORMAT=='binary' or not os.path.exists(store['file_path']):
+            accounts=open_binary_snapshot(store)
     except FileNotFoundError:
-        print(colored(f"{file_path} not found. Creating a new file.", "yellow"))
-        return {}  
+        pass
+    except ValueError as e:
+        print(colored(f'Error: {e}', 'light_red'))
+        return {}
+    if accounts is None:
+        accounts=open_snapshot(store)
+    if accounts is not None:
+        replay_journal(accounts, store)
+        return accounts
+    try:
+        with open(store['file_path'], "r") as f:
+            accounts=json.load(f, object_hook=compact_transactions)
+    except FileNotFoundError:
+        print(colored(f"{store['binary_path'] if SNAPSHOT_FORMAT=='binary' else store['file_path']} not found. Creating a new file.", "yellow"))
+        accounts={}
     except json.JSONDecodeError:
         print(colored("Error: accounts.json is not in a valid JSON format.", "light_red"))
         return {} 
-    
-def save_accounts(accounts):
+    replay_journal(accounts, store)
+    return accounts
+
+#All shards behind one mapping, each account ID is looked up in the accounts of its own shard.
+class ShardedAccounts(MutableMapping):
+    def __init__(self, parts):
+        self.parts=parts
+
+    def __getitem__(self, account_id):
+        return self.parts[shard_number(account_id)][account_id]
+
+    def __setitem__(self, account_id, account):
+        self.parts[shard_number(account_id)][account_id]=account
+
+    def __delitem__(self, account_id):
+        del self.parts[shard_number(account_id)][account_id]
+
+    def __contains__(self, account_id):
+        return account_id in self.parts[shard_number(account_id)]
+
+    def __iter__(self):
+        return chain.from_iterable(self.parts)
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+#The accounts of one store: its part of a ShardedAccounts, or those of a plain mapping that belong in it.
+def shard_accounts(accounts, store):
+    if isinstance(accounts, ShardedAccounts):
+        return accounts.parts[store['number']]
+    if len(SHARDS)==1:
+        return accounts
+    return {account_id: account for account_id, account in accounts.items() if shard_number(account_id)==store['number']}
+
+#The journal starts with a header line naming its generation, which changes whenever it is compacted,
+#so other processes can tell their view of the journal is gone.
+def journal_generation(header):
     try:
-        with open(file_path, 'w') as file:
-            json.dump(accounts, file, indent=4)
-    except IOError as e:
-        print(colored(f'Error saving accounts data: {e}', 'light_red'))
+        return json.loads(header).get('generation')
+    except (json.JSONDecodeError, AttributeError):
+        return None
+
+#Re-applies every journal record written since the last snapshot. A torn last line left by a crash is cut off.
+def replay_journal(accounts, store):
+    store['journal']['prepared'].clear()
+    records=0
+    good_offset=0
+    generation=None
+    try:
+        with open(store['journal_path'], 'rb+') as f:
+            for line in f:
+                try:
+                    record=json.loads(line)
+                except json.JSONDecodeError:
+                    f.truncate(good_offset)
+                    print(colored('Warning: discarded an incomplete journal record.', 'yellow'))
+                    break
+                if good_offset==0 and 'generation' in record:
+                    generation=record['generation']
+                else:
+                    apply_journal_record(accounts, record, store)
+                    records+=1
+                good_offset+=len(line)
+    except FileNotFoundError:
+        pass
+    store['journal'].update(records=records, offset=good_offset, generation=generation)
+    resolve_prepared(accounts, store, apply_change)
+
+#Records are idempotent ('put' replaces, 'set' and 'loans' overwrite, 'txns' are written at a fixed offset),
+#so replaying a journal over a snapshot that already contains it gives the same result.
+def apply_journal_record(accounts, record, store):
+    for change in journal_changes(record, store):
+        apply_change(accounts, change)
+
+#Changes that span shards come in two steps: a 'prepare' record holds them back until the 'commit' record
+#of the same transfer, an 'abort' drops them (see commit_across_shards).
+def journal_changes(record, store):
+    prepared=store['journal']['prepared']
+    if 'prepare' in record:
+        prepared[record['prepare']]=record['changes']
+        return ()
+    if 'commit' in record:
+        return prepared.pop(record['commit'], ())
+    if 'abort' in record:
+        prepared.pop(record['abort'], None)
+        return ()
+    return record.get('changes', ())
+
+#Prepared changes still waiting for their commit when the journal ends were left by a process that stopped half
+#way through a transfer. They are committed if its decision made it to transfers.log and rolled back otherwise,
+#and the outcome is added to the journal. Runs under the store's lock, so no transfer can be in progress.
+def resolve_prepared(accounts, store, apply):
+    prepared=store['journal']['prepared']
+    if not prepared:
+        return
+    decisions=transfer_decisions()
+    for txid, changes in list(prepared.items()):
+        if txid in decisions:
+            for change in changes:
+                apply(accounts, change)
+        append_journal({'commit' if txid in decisions else 'abort': txid}, store)
+    prepared.clear()
+
+def transfer_decisions():
+    decisions=set()
+    try:
+        with open(transfers_path, 'rb') as f:
+            for line in f:
+                try:
+                    decisions.add(json.loads(line)['commit'])
+                except (json.JSONDecodeError, KeyError):
+                    pass
+    except FileNotFoundError:
+        pass
+    return decisions
+
+def record_decision(txid):
+    line=json.dumps({'commit': txid}).encode()+b'\n'
+    with open(transfers_path, 'ab') as f:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+    count('bank_bytes_written_total', len(line), file='transfers')
+
+#Accounts are updated in place, so references held elsewhere stay valid. A change's 'at' counts archived transactions
+#too (see journal_entry), so whatever of its transactions the account has archived since is already in place.
+def apply_change(accounts, change):
+    if 'put' in change:
+        compact_transactions(change['put'])
+        if change['id'] in accounts:
+            accounts[change['id']].clear()
+            accounts[change['id']].update(change['put'])
+        else:
+            accounts[change['id']]=change['put']
+        return
+    account=accounts[change['id']]
+    account.update(change.get('set', {}))
+    for i, next_installment, credit in change.get('loans', ()):
+        account['Loan records'][i].update(next=next_installment, credit=credit)
+    if 'txns' in change:
+        start=change['at']-archived_count(account)
+        del account['Transactions'][max(start, 0):]
+        account['Transactions'].extend(change['txns'][max(-start, 0):])
+
+#A change stored by another process. It is applied straight away unless the account is locked by a
+#transaction that may already have changed it, in which case it waits in _locks['deferred'].
+def apply_foreign_change(accounts, change):
+    account_id=change['id']
+    with _locks['guard']:
+        held=account_id in getattr(_local, 'held', ())
+        lock=_locks['accounts'].setdefault(account_id, threading.Lock())
+        if held and not _local.dirty:
+            apply_deferred(accounts, [account_id])
+            apply_change(accounts, change)
+        elif not held and lock.acquire(False):
+            try:
+                apply_change(accounts, change)
+            finally:
+                lock.release()
+        else:
+            _locks['deferred'].setdefault(account_id, []).append(change)
+            return
+    reindex_account(account_id, accounts[account_id])
+
+#Applies the foreign changes held back for these accounts, oldest first. Must be called under _locks['guard'].
+def apply_deferred(accounts, account_ids):
+    for account_id in account_ids:
+        for change in _locks['deferred'].pop(account_id, []):
+            apply_change(accounts, change)
+            reindex_account(account_id, accounts[account_id])
+
+#Reads journal records other processes appended to the store since we last looked. Must be called under its store_lock.
+def catch_up(accounts, store):
+    journal=store['journal']
+    try:
+        with open(store['journal_path'], 'rb') as f:
+            generation=journal_generation(f.readline())
+            size=f.seek(0, 2)
+            if generation!=journal['generation'] or size<journal['offset']:
+                fresh=load_store(store)
+                for account_id, account in fresh.items():
+                    apply_foreign_change(accounts, {'id': account_id, 'put': account})
+                return
+            f.seek(journal['offset'])
+            data=f.read()
+    except FileNotFoundError:
+        return
+    lines=data.split(b'\n')
+    for line in lines[:-1]:
+        for change in journal_changes(json.loads(line), store):
+            apply_foreign_change(accounts, change)
+        journal['offset']+=len(line)+1
+        journal['records']+=1
+    if lines[-1]:
+        with open(store['journal_path'], 'rb+') as f:
+            f.truncate(journal['offset'])
+    resolve_prepared(accounts, store, apply_foreign_change)
+
+def json_refresh_accounts(accounts, account_ids):
+    stores=stores_of(account_ids)
+    with store_lock(*stores):
+        for store in stores:
+            catch_up(accounts, store)
+
+#An account number says nothing about the shard it lives on, so every shard is caught up before the number index is asked.
+def json_find_account(accounts, number):
+    with store_lock():
+        for store in SHARDS:
+            catch_up(accounts, store)
+    return account_index.get(number)
+
+#Describes what an operation changed on one account, for save_accounts.
+#'loans' are the positions of the loans that moved along their schedule: only their 'next' and 'credit' are stored,
+#never the schedules, so an installment costs the same whatever the size of the loan book.
+#'at' is the position of the first new transaction in the whole history, archived ones included, so it stays right
+#when the live list is shortened by archive_account: a journal written before it can still be replayed over the
+#archived snapshot if the process stops between writing that snapshot and starting the next journal.
+def journal_entry(accounts, account_id, *fields, new_txns=0, put=False, loans=()):
+    account=accounts[account_id]
+    if put:
+        return {'id': account_id, 'put': account}
+    entry={'id': account_id, 'set': {field: account[field] for field in fields}}
+    if loans:
+        entry['loans']=[[i, account['Loan records'][i]['next'], account['Loan records'][i]['credit']] for i in sorted(loans)]
+    if new_txns:
+        entry['at']=transaction_count(account)-new_txns
+        entry['txns']=account['Transactions'][-new_txns:]
+    return entry
+
+#Every stored change bumps the account's 'Version'. A change to an account that another client changed
+#since we last saw it (its newer version is waiting in _locks['deferred']) is refused with ConflictError.
+def bump_versions(accounts, changes):
+    for change in changes:
+        account=accounts[change['id']]
+        account['Version']=account.get('Version', 0)+1
+        if 'set' in change:
+            change['set']['Version']=account['Version']
+
+def check_conflicts(changes):
+    for change in changes:
+        if _locks['deferred'].get(change['id']):
+            raise ConflictError(change['id'])
+
+#Journal entries are appended to their shard's journal as one atomic record. Without any, or with more than a
+#compaction's worth, a new snapshot is written instead. Changes to accounts in different shards go through
+#commit_across_shards, so a save only touches the shards it changes.
+def json_save_accounts(accounts, *changes):
+    if not changes:
+        compact_journal(accounts)
+        return
+    groups={}
+    for change in changes:
+        groups.setdefault(shard_number(change['id']), []).append(change)
+    if len(groups)>1:
+        commit_across_shards(accounts, groups)
+        return
+    store=SHARDS[next(iter(groups))]
+    with store_lock(store):
+        catch_up(accounts, store)
+        check_conflicts(changes)
+        bump_versions(accounts, changes)
+        if len(changes)>=JOURNAL_COMPACT_AT and _locks['active']==0:
+            compact_store(accounts, store)
+            return
+        append_journal({'changes': list(changes)}, store)
+        if store['journal']['records']>=JOURNAL_COMPACT_AT and _locks['active']==0:
+            compact_store(accounts, store)
+
+#Two-phase commit. Every shard involved is locked (in shard order), brought up to date and checked for conflicts.
+#Each then gets its changes in a 'prepare' record, synced to disk, which is not applied on its own. Once all are
+#prepared the decision goes to transfers.log, and only then the 'commit' records to the journals. A process that
+#stops before the decision leaves prepared changes that are rolled back when the shard is next read, after it they
+#are rolled forward (see resolve_prepared). If a shard cannot be prepared nothing is stored and BankingError is
+#raised, so account_transaction undoes the changes in memory.
+def commit_across_shards(accounts, groups):
+    stores=[SHARDS[number] for number in sorted(groups)]
+    txid=uuid.uuid4().hex
+    with store_lock(*stores):
+        for store in stores:
+            catch_up(accounts, store)
+        for changes in groups.values():
+            check_conflicts(changes)
+        bump_versions(accounts, [change for changes in groups.values() for change in changes])
+        prepared=[]
+        try:
+            for store in stores:
+                append_journal({'prepare': txid, 'shards': sorted(groups), 'changes': groups[store['number']]}, store)
+                prepared.append(store)
+                sync_journal(store)
+            record_decision(txid)
+        except OSError as e:
+            for store in prepared:
+                try:
+                    append_journal({'abort': txid}, store)
+                except OSError:
+                    pass
+            raise BankingError(f'Could not store the changes: {e}') from e
+        for store in stores:
+            append_journal({'commit': txid}, store)
+        count('bank_cross_shard_commits_total')
+        for store in stores:
+            if (sum(map(len, groups.values()))>=JOURNAL_COMPACT_AT or store['journal']['records']>=JOURNAL_COMPACT_AT) and _locks['active']==0:
+                compact_store(accounts, store)
+
+def append_journal(record, store):
+    journal=store['journal']
+    if journal['file'] is None:
+        journal['file']=open(store['journal_path'], 'ab')
+    f=journal['file']
+    if journal['offset']==0:
+        journal['generation']=time.time_ns()
+        f.write(json.dumps({'generation': journal['generation']}).encode()+b'\n')
+        journal['offset']=f.tell()
+    data=json.dumps(record, default=json_default).encode()+b'\n'
+    f.write(data)
+    count('bank_bytes_written_total', len(data), file='journal')
+    f.flush()
+    journal['offset']+=len(data)
+    journal['records']+=1
+    journal['unsynced']+=1
+    if journal['unsynced']>=JOURNAL_SYNC_EVERY:
+        sync_journal(store)
+
+def sync_journal(store):
+    journal=store['journal']
+    f=journal['file']
+    if f is not None and journal['unsynced']:
+        f.flush()
+        os.fsync(f.fileno())
+    journal['unsynced']=0
+
+#Writes the snapshot to a temporary file and renames it over accounts.json, so a crash never leaves a half-written file.
+#One account per line: each is encoded by json's C encoder, which json.dump(indent=...) never uses.
+#Snapshots keep the plain list-of-dicts layout, the columns only exist in memory.
+#The index for lazy loading (see LazyAccounts) is written after it; an index left over from an older snapshot is ignored.
+def write_json_snapshot(accounts, store):
+    file_path, index_path=store['file_path'], store['index_path']
+    tmp_path=file_path+'.tmp'
+    lazy=isinstance(accounts, LazyAccounts)
+    ids=list(accounts)
+    starts, ends, numbers, inactive, loans_due=[], [], [], [], {}
+    offset=1
+    with open(tmp_path, 'wb', buffering=1<<20) as file:
+        file.write(b'{')
+        separator=b'\n'
+        for account_id in ids:
+            line=accounts.raw(account_id) if lazy else None
+            if line is None:
+                account=accounts.peek(account_id) if lazy else accounts[account_id]
+                line=json.dumps(account, default=json_default).encode()
+                number, active, due=account['Account number'], account.get('Active', True), next_loan_due(account)
+            else:
+                number, active, due=accounts.numbers[account_id], account_id not in accounts.inactive, accounts.loans_due.get(account_id)
+            key=separator+json.dumps(account_id).encode()+b': '
+            file.write(key)
+            file.write(line)
+            offset+=len(key)
+            starts.append(offset)
+            offset+=len(line)
+            ends.append(offset)
+            numbers.append(number)
+            if not active:
+                inactive.append(account_id)
+            if due is not None:
+                loans_due[account_id]=due
+            separator=b',\n'
+        file.write(b'\n}\n')
+        file.flush()
+        count('bank_bytes_written_total', file.tell(), file='snapshot')
+        os.fsync(file.fileno())
+    os.replace(tmp_path, file_path)
+    stat=os.stat(file_path)
+    index={'snapshot': [stat.st_size, stat.st_mtime_ns], 'ids': ids, 'starts': starts, 'ends': ends, 'numbers': numbers, 'inactive': inactive, 'loans_due': loans_due}
+    with open(index_path+'.tmp', 'w') as f:
+        f.write(json.dumps(index, separators=(',', ':')))
+    os.replace(index_path+'.tmp', index_path)
+
+#Writes the snapshot in the configured format (or the one given) and removes the other format's files,
+#so a store never has two snapshots that could disagree. Without a store every shard gets its accounts written.
+def write_snapshot(accounts, snapshot_format=None, store=None):
+    if store is None:
+        for store in SHARDS:
+            write_snapshot(shard_accounts(accounts, store), snapshot_format, store)
+        return
+    if (snapshot_format or SNAPSHOT_FORMAT)=='binary':
+        write_binary_snapshot(accounts, store)
+        stale=[store['file_path'], store['index_path']]
+    else:
+        write_json_snapshot(accounts, store)
+        stale=[store['binary_path']]
+    for path in stale:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+#Folds a store's journal into a fresh snapshot and starts a new journal generation. The in-memory accounts are
+#only a faithful copy of the store while no transaction is running, so otherwise this is left for later.
+def compact_store(accounts, store, snapshot_format=None):
+    journal=store['journal']
+    with store_lock(store):
+        catch_up(accounts, store)
+        if _locks['active'] or _locks['deferred']:
+            return
+        write_snapshot(shard_accounts(accounts, store), snapshot_format, store)
+        sync_journal(store)
+        if journal['file'] is not None:
+            journal['file'].close()
+        journal['generation']=time.time_ns()
+        with open(store['journal_path'], 'wb') as f:
+            f.write(json.dumps({'generation': journal['generation']}).encode()+b'\n')
+            journal['offset']=f.tell()
+        journal['file']=open(store['journal_path'], 'ab')
+        journal['records']=0
+
+#Compacts every shard whose journal has at least 'at' records (all of them by default), and any shard without a
+#snapshot that can be opened lazily yet. Every shard is caught up under its lock, which resolves any prepared
+#change left behind (see resolve_prepared), so afterwards the transfer decisions are no longer needed.
+def compact_journal(accounts, snapshot_format=None, at=0):
+    with store_lock():
+        for store in SHARDS:
+            catch_up(accounts, store)
+            if store['journal']['records']>=at or not (os.path.exists(store['index_path']) or os.path.exists(store['binary_path'])):
+                compact_store(accounts, store, snapshot_format)
+        if os.path.exists(transfers_path):
+            open(transfers_path, 'wb').close()
+
+#Compacts only the shards whose journal reached JOURNAL_COMPACT_AT, locking each on its own, so one busy shard
+#does not hold up or rewrite the others. The transfer decisions are left for compact_journal to clear.
+def compact_full_journals(accounts):
+    for store in SHARDS:
+        if store['journal']['records']>=JOURNAL_COMPACT_AT:
+            try:
+                compact_store(accounts, store)
+            except IOError as e:
+                print(colored(f'Error saving accounts data: {e}', 'light_red'))
+
+#The json backend's compaction on exit, only for shards with journal records.
+def json_compact(accounts):
+    compact_journal(accounts, at=1)
+
+def close_journal():
+    for store in SHARDS:
+        journal=store['journal']
+        if journal['file'] is not None:
+            sync_journal(store)
+            journal['file'].close()
+            journal['file']=None
+
+atexit.register(close_journal)
+
+#Change data capture. Every stored change (see journal_entry) is also appended to events.log as one JSON line,
+#for ledger, fraud and reporting systems to follow instead of re-reading the whole book. Events are numbered by
+#'seq' across all processes and shards, and a consumer resumes from the byte offset after the last line it read
+#(read_events, or the 'events' command with a named consumer). An event carries the account ID, its version after
+#the change, the kind of change ('opened', 'transactions', 'deactivated' or 'updated'), the fields that changed
+#with their new values, and new transactions with the logical position of the first. PINs and security answers
+#are never written out, only their names under 'changed'; internal aggregates ('Stats', 'Balances') are left out.
+#Events are appended once the save has gone through, so a change that is refused never shows up, and while the
+#changed accounts' store locks are still held, so each account's events come in the order of its versions.
+#A crash in between loses the save's events; the account's 'version' lets a consumer notice the gap.
+EVENT_HIDDEN_FIELDS=('PIN', 'Security question', 'Security answer', 'OTP')
+EVENT_INTERNAL_FIELDS=('Transactions', 'Stats', 'Balances', 'Version')
+EVENTS_POLL_SECONDS=0.5
+_events={'file': None, 'size': 0, 'seq': 0, 'lock': threading.Lock()}
+
+def change_event(accounts, change):
+    account=accounts[change['id']]
+    fields=change['put'] if 'put' in change else change.get('set', {})
+    event={'time': now_timestamp(), 'account': change['id'], 'version': account.get('Version', 0)}
+    if 'put' in change:
+        event['event']='opened'
+    elif fields.get('Active') is False:
+        event['event']='deactivated'
+    else:
+        event['event']='transactions' if 'txns' in change else 'updated'
+    event['fields']={k: v for k, v in fields.items() if k not in EVENT_HIDDEN_FIELDS and k not in EVENT_INTERNAL_FIELDS}
+    if 'put' not in change:
+        event['changed']=[k for k in fields if k not in EVENT_INTERNAL_FIELDS]
+    if 'loans' in change:
+        event['loans']=[{'loan': account['Loan records'][i]['id'], 'next': next_installment, 'credit': credit} for i, next_installment, credit in change['loans']]
+    if 'put' in change or 'txns' in change:
+        event['position']=change['at'] if 'at' in change else archived_count(account)
+        event['transactions']=change['txns'] if 'txns' in change else account['Transactions']
+    return event
+
+#The seq of the stream's last event. A line left half written by a crash is cut off first.
+def last_event_seq(f, size):
+    tail, start=b'', size
+    while start>0 and tail.count(b'\n')<2:
+        step=min(1<<16, start)
+        start-=step
+        f.seek(start)
+        tail=f.read(step)+tail
+    if not tail.endswith(b'\n'):
+        cut=tail.rfind(b'\n')+1
+        f.truncate(start+cut)
+        tail=tail[:cut]
+    lines=tail.rstrip(b'\n').rsplit(b'\n', 1)
+    return json.loads(lines[-1])['seq'] if lines[-1] else 0
+
+#Appends the events of one save under the stream's file lock. seq is carried on from the last line whenever
+#another process has appended since.
+def publish_events(accounts, changes):
+    events=[change_event(accounts, change) for change in changes]
+    try:
+        with _events['lock']:
+            f=_events['file']
+            if f is None:
+                f=_events['file']=open(events_path, 'ab+')
+            lock_file(f)
+            try:
+                size=f.seek(0, 2)
+                if size!=_events['size']:
+                    _events['seq']=last_event_seq(f, size)
+                    size=f.seek(0, 2)
+                seq=_events['seq']
+                data=''.join(json.dumps(dict(event, seq=seq+i+1), default=json_default)+'\n' for i, event in enumerate(events)).encode()
+                f.write(data)
+                f.flush()
+                _events['seq'], _events['size']=seq+len(events), size+len(data)
+            finally:
+                unlock_file(f)
+    except OSError as e:
+        print(colored(f'Error writing account events: {e}', 'light_red'))
+        return
+    count('bank_events_total', len(events))
+    count('bank_bytes_written_total', len(data), file='events')
+
+def close_events():
+    with _events['lock']:
+        if _events['file'] is not None:
+            _events['file'].close()
+            _events['file'], _events['size'], _events['seq']=None, 0, 0
+
+atexit.register(close_events)
+
+#Complete events from offset on, each with the offset to resume from after it. A line still being written is left
+#for the next read. Raises ValueError for an offset that is not where an event starts.
+def read_events(offset=0):
+    try:
+        with open(events_path, 'rb') as f:
+            if offset:
+                f.seek(offset-1)
+                if f.read(1)!=b'\n':
+                    raise ValueError(f'Offset {offset} is not the start of an event.')
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    return
+                offset+=len(line)
+                yield json.loads(line), offset
+    except FileNotFoundError:
+        return
+
+def consumer_offset_path(consumer):
+    return os.path.join(directory, f'events-{consumer}.offset')
+
+#'events [offset] [--follow] [--consumer <name>]' command: prints the events from offset (0 by default) as JSON
+#lines with a 'next' offset added. A named consumer starts where it last stopped and has its offset saved after
+#every event printed, so a restart repeats at most one. --follow keeps polling for new events.
+def events_command(*options):
+    options=list(options)
+    follow='--follow' in options
+    consumer=None
+    if '--consumer' in options:
+        consumer=options.pop(options.index('--consumer')+1)
+    offsets=[option for option in options if option.isdigit()]
+    offset=int(offsets[0]) if offsets else 0
+    if consumer and not offsets and os.path.exists(consumer_offset_path(consumer)):
+        with open(consumer_offset_path(consumer)) as f:
+            offset=int(f.read() or 0)
+    try:
+        while True:
+            for event, offset in read_events(offset):
+                print(json.dumps(dict(event, next=offset), default=json_default), flush=True)
+                if consumer:
+                    with open(consumer_offset_path(consumer)+'.tmp', 'w') as f:
+                        f.write(str(offset))
+                    os.replace(consumer_offset_path(consumer)+'.tmp', consumer_offset_path(consumer))
+            if not follow:
+                break
+            time.sleep(EVENTS_POLL_SECONDS)
+    except ValueError as e:
+        print(colored(str(e), 'light_red'))
+    except KeyboardInterrupt:
+        pass
+
+#SQLite backend: one row per account, and one row per transaction keyed by (account ID, position)
+ACCOUNT_COLUMNS={
+    'Account number': 'account_number',
+    'Name': 'name',
+    'Currency': 'currency',
+    'Account type': 'account_type',
+    'Balance': 'balance',
+    'PIN': 'pin',
+    'USD amount': 'usd_amount',
+    'Loans': 'loans',
+    'Created at': 'created_at',
+    'Security question': 'security_question',
+    'Security answer': 'security_answer',
+    'OTP': 'otp',
+    'Active': 'active',
+    'Version': 'version'
+}
+
+SQLITE_SCHEMA='''
+CREATE TABLE IF NOT EXISTS accounts (
+    account_id TEXT PRIMARY KEY,
+    account_number TEXT,
+    name TEXT,
+    currency TEXT,
+    account_type TEXT,
+    balance REAL,
+    pin TEXT,
+    usd_amount REAL,
+    loans REAL,
+    created_at TEXT,
+    security_question TEXT,
+    security_answer TEXT,
+    otp INTEGER,
+    active INTEGER,
+    extra TEXT NOT NULL DEFAULT '{}',
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_accounts_number ON accounts(account_number);
+CREATE TABLE IF NOT EXISTS transactions (
+    account_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    type TEXT,
+    amount REAL,
+    date TEXT,
+    extra TEXT,
+    timestamp INTEGER,
+    PRIMARY KEY (account_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_account_date ON transactions(account_id, date);
+'''
+
+#Databases created before transactions had a numeric 'timestamp' get the column and its index added.
+def sqlite_upgrade(conn):
+    if 'timestamp' not in [row[1] for row in conn.execute('PRAGMA table_info(transactions)')]:
+        try:
+            conn.execute('ALTER TABLE transactions ADD COLUMN timestamp INTEGER')
+        except sqlite3.OperationalError:
+            pass  # added by another client meanwhile
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_account_timestamp ON transactions(account_id, timestamp)')
+
+#One connection per thread, SQLite connections cannot be shared between threads
+_sqlite=threading.local()
+
+def sqlite_connect():
+    conn=getattr(_sqlite, 'conn', None)
+    if conn is None:
+        conn=sqlite3.connect(db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SQLITE_SCHEMA)
+        sqlite_upgrade(conn)
+        if 'version' not in [column[1] for column in conn.execute('PRAGMA table_info(accounts)')]:
+            conn.execute('ALTER TABLE accounts ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        _sqlite.conn=conn
+    return conn
+
+#Transactions of one account in the SQLite store. Rows are only fetched when the history is actually read,
+#new transactions are kept in memory until then.
+class LazyTransactions(MutableSequence):
+    def __init__(self, account_id, stored):
+        self.account_id=account_id
+        self.stored=stored
+        self.items=None
+        self.tail=[]
+
+    def load(self):
+        if self.items is None:
+            self.items=TransactionColumns(sqlite_fetch_transactions(self.account_id, self.stored)+self.tail)
+        return self.items
+
+    def __len__(self):
+        return len(self.items) if self.items is not None else self.stored+len(self.tail)
+
+    def __getitem__(self, index):
+        if self.items is None and self.tail:
+            if isinstance(index, slice):
+                start, stop, step=index.indices(len(self))
+                if step==1 and start>=self.stored:
+                    return self.tail[start-self.stored:stop-self.stored]
+            elif -len(self.tail)<=index<0:
+                return self.tail[index]
+        return self.load()[index]
+
+    def __setitem__(self, index, value):
+        self.load()[index]=value
+
+    def __delitem__(self, index):
+        del self.load()[index]
+
+    def insert(self, index, value):
+        self.load().insert(index, value)
+
+    def append(self, value):
+        if self.items is None:
+            self.tail.append(value)
+        else:
+            self.items.append(value)
+
+    def __repr__(self):
+        return repr(list(self))
+
+TRANSACTION_COLUMNS='type, amount, date, timestamp, extra'
+
+def transaction_to_row(account_id, seq, txn):
+    extra={k: v for k, v in txn.items() if k not in ('type', 'amount', 'date', 'timestamp')}
+    return (account_id, seq, txn.get('type'), txn.get('amount'), txn.get('date'), txn.get('timestamp'), json.dumps(extra) if extra else None)
+
+def row_to_transaction(ttype, amount, date, timestamp, extra):
+    txn={'type': ttype, 'amount': amount}
+    if extra:
+        txn.update(json.loads(extra))
+    if date is not None:
+        txn['date']=date
+    if timestamp is not None:
+        txn['timestamp']=timestamp
+    return txn
+
+def sqlite_fetch_transactions(account_id, limit):
+    rows=sqlite_connect().execute(f'SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE account_id=? AND seq<? ORDER BY seq', (account_id, limit))
+    return [row_to_transaction(*row) for row in rows]
+
+#Streams stored transactions newest first without loading the whole history.
+def sqlite_iter_transactions(account_id, below):
+    rows=sqlite_connect().execute(f'SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE account_id=? AND seq<? ORDER BY seq DESC', (account_id, below))
+    for row in rows:
+        yield row_to_transaction(*row)
+
+def sqlite_iter_transactions_from(account_id, start, below):
+    rows=sqlite_connect().execute(f'SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE account_id=? AND seq>=? AND seq<? ORDER BY seq', (account_id, start, below))
+    for row in rows:
+        yield row_to_transaction(*row)
+
+#Account rows and their transaction counts must come from the same snapshot, otherwise a commit landing between
+#the two reads leaves a version whose stored count is short and the next save overwrites the missing rows.
+@contextmanager
+def sqlite_snapshot(conn):
+    if conn.in_transaction:
+        yield
+        return
+    conn.execute('BEGIN')
+    try:
+        yield
+    finally:
+        conn.commit()
+
+def sqlite_row_to_account(row, count):
+    account=dict(zip(ACCOUNT_COLUMNS, row[1:-1]))
+    account['Active']=bool(account['Active'])
+    account['Transactions']=LazyTransactions(row[0], count)
+    account.update(json.loads(row[-1]))
+    return account
+
+def sqlite_load_data():
+    conn=sqlite_connect()
+    columns=', '.join(ACCOUNT_COLUMNS.values())
+    accounts={}
+    with sqlite_snapshot(conn):
+        counts=dict(conn.execute('SELECT account_id, COUNT(*) FROM transactions GROUP BY account_id'))
+        for row in conn.execute(f'SELECT account_id, {columns}, extra FROM accounts ORDER BY account_id'):
+            accounts[row[0]]=sqlite_row_to_account(row, counts.get(row[0], 0))
+    return accounts
+
+#Re-reads the given accounts if another client stored a newer version of them.
+def sqlite_refresh_accounts(accounts, account_ids):
+    conn=sqlite_connect()
+    columns=', '.join(ACCOUNT_COLUMNS.values())
+    for account_id in account_ids:
+        with sqlite_snapshot(conn):
+            row=conn.execute(f'SELECT account_id, {columns}, extra FROM accounts WHERE account_id=?', (account_id,)).fetchone()
+            if row is None or (account_id in accounts and accounts[account_id].get('Version', 0)==row[-2]):
+                continue
+            count=conn.execute('SELECT COUNT(*) FROM transactions WHERE account_id=?', (account_id,)).fetchone()[0]
+        apply_change(accounts, {'id': account_id, 'put': sqlite_row_to_account(row, count)})
+        reindex_account(account_id, accounts[account_id])
+
+def sqlite_find_account(accounts, number):
+    row=sqlite_connect().execute('SELECT account_id FROM accounts WHERE account_number=?', (number,)).fetchone()
+    if row is None:
+        return None
+    sqlite_refresh_accounts(accounts, [row[0]])
+    return account_index.get(number)
+
+def sqlite_write_account(conn, account_id, account, replace=True):
+    extra={k: v for k, v in account.items() if k not in ACCOUNT_COLUMNS and k!='Transactions'}
+    columns=['account_id', *ACCOUNT_COLUMNS.values(), 'extra']
+    values=[account_id, *[account.get(key) for key in ACCOUNT_COLUMNS], json.dumps(extra)]
+    values[columns.index('version')]=account.get('Version', 0)
+    try:
+        conn.execute(f"INSERT {'OR REPLACE ' if replace else ''}INTO accounts ({', '.join(columns)}) VALUES ({', '.join('?'*len(values))})", values)
+    except sqlite3.IntegrityError:
+        raise ConflictError(account_id)
+    transactions=account['Transactions']
+    if isinstance(transactions, LazyTransactions) and transactions.items is None:
+        start, txns=transactions.stored, transactions.tail
+    else:
+        start, txns=0, transactions
+    sqlite_write_transactions(conn, account_id, start, txns)
+
+def sqlite_write_transactions(conn, account_id, start, txns):
+    conn.execute('DELETE FROM transactions WHERE account_id=? AND seq>=?', (account_id, start))
+    conn.executemany(f'INSERT INTO transactions (account_id, seq, {TRANSACTION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)', (transaction_to_row(account_id, start+i, t) for i, t in enumerate(txns)))
+
+#Each journal entry becomes an UPDATE of the account row plus INSERTs for its new transactions, all in one SQL transaction.
+#The UPDATE only matches the version this client last saw, otherwise the whole SQL transaction is rolled back with ConflictError.
+def sqlite_save_accounts(accounts, *changes):
+    conn=sqlite_connect()
+    with conn:
+        if not changes:
+            for account_id, account in accounts.items():
+                sqlite_write_account(conn, account_id, account)
+            return
+        for change in changes:
+            if 'put' in change:
+                sqlite_write_account(conn, change['id'], change['put'], replace=False)
+                continue
+            version=accounts[change['id']].get('Version', 0)
+            assignments=['version=?']
+            params=[version+1]
+            #Fields kept in the extra JSON column are all set by one json_set, SQLite only applies the last
+            #of several assignments to the same column.
+            paths, values=[], []
+            for field, value in change['set'].items():
+                if field=='Version':
+                    continue
+                if field in ACCOUNT_COLUMNS:
+                    assignments.append(f'{ACCOUNT_COLUMNS[field]}=?')
+                    params.append(value)
+                else:
+                    paths.append(f"'$.\"{field}\"', json(?)")
+                    values.append(json.dumps(value))
+            for i, next_installment, credit in change.get('loans', ()):
+                paths+=[f"'$.\"Loan records\"[{int(i)}].next', ?", f"'$.\"Loan records\"[{int(i)}].credit', ?"]
+                values+=[next_installment, credit]
+            if paths:
+                assignments.append(f"extra=json_set(extra, {', '.join(paths)})")
+                params+=values
+            if conn.execute(f"UPDATE accounts SET {', '.join(assignments)} WHERE account_id=? AND version=?", [*params, change['id'], version]).rowcount==0:
+                raise ConflictError(change['id'])
+            if 'txns' in change:
+                sqlite_write_transactions(conn, change['id'], change['at']-archived_count(accounts[change['id']]), change['txns'])
+    bump_versions(accounts, [change for change in changes if 'put' not in change])
+
+def sqlite_checkpoint(accounts):
+    sqlite_connect().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+#One-shot migration of accounts.json (and any pending journal) into accounts.db.
+def migrate_json_to_sqlite():
+    accounts=json_load_data()
+    sqlite_save_accounts(accounts)
+    print(colored(f'Migrated {len(accounts)} accounts from {file_path} to {db_path}.', 'light_green'))
+    print(colored("Set BANK_STORAGE_BACKEND=sqlite to use it.", 'cyan'))
+
+#'convert-snapshot <json|binary>': rewrites the json backend's snapshot in the given format, with the journal folded in.
+def convert_snapshot(snapshot_format='binary'):
+    if STORAGE_BACKEND!='json' or snapshot_format not in ('json', 'binary'):
+        print(colored("Usage: convert-snapshot json|binary (for BANK_STORAGE_BACKEND=json)", 'light_red'))
+        return
+    accounts=load_data()
+    compact_journal(accounts, snapshot_format)
+    paths=[store['binary_path'] if snapshot_format=='binary' else store['file_path'] for store in SHARDS]
+    print(colored(f"Wrote {len(accounts)} accounts to {', '.join(paths)}.", 'light_green'))
+    print(colored(f"Set BANK_SNAPSHOT_FORMAT={snapshot_format} to keep using it.", 'cyan'))
+
+#'reshard <count> [directory ...]': spreads the json store over that many shards, in the directories given (one per
+#shard, anywhere, e.g. on other disks) or in shards-<count>/00, 01, ... under the data directory. 'reshard 1' goes
+#back to a single store in the data directory. The new shards are written before shards.json points to them, and
+#the old files are removed after. Run it while nothing else uses the store.
+def reshard_command(shards='1', *paths):
+    shards=int(shards)
+    paths=list(paths) or ([os.curdir] if shards==1 else [os.path.join(f'shards-{shards}', f'{number:02}') for number in range(shards)])
+    if STORAGE_BACKEND!='json' or shards<1 or len(paths)!=shards:
+        print(colored("Usage: reshard <shards> [one directory per shard] (for BANK_STORAGE_BACKEND=json)", 'light_red'))
+        return
+    old=list(SHARDS)
+    new=open_shards(paths)
+    if {os.path.realpath(store['file_path']) for store in old} & {os.path.realpath(store['file_path']) for store in new}:
+        print(colored("The new shards need directories the store does not use yet.", 'light_red'))
+        return
+    with store_lock():
+        accounts=load_data()
+        moved=[(account_id, accounts[account_id]) for account_id in accounts]
+        SHARDS[:]=new
+        resharded=ShardedAccounts([{} for store in new])
+        for account_id, account in moved:
+            resharded[account_id]=account
+        for store in new:
+            compact_store(resharded, store)
+        if len(new)==1 and os.path.realpath(new[0]['file_path'])==os.path.realpath(file_path):
+            os.remove(shards_path)
+        else:
+            with open(shards_path+'.tmp', 'w') as f:
+                json.dump({'shards': paths}, f)
+            os.replace(shards_path+'.tmp', shards_path)
+        for store in old:
+            if store['journal']['file'] is not None:
+                store['journal']['file'].close()
+            for key in ('file_path', 'index_path', 'binary_path', 'journal_path'):
+                try:
+                    os.remove(store[key])
+                except FileNotFoundError:
+                    pass
+    print(colored(f"Moved {len(moved)} accounts into {shards} shard(s): {', '.join(os.path.dirname(store['file_path']) for store in new)}.", 'light_green'))
+
+STORAGE_BACKENDS={
+    'json': {'load': json_load_data, 'save': json_save_accounts, 'compact': json_compact, 'refresh': json_refresh_accounts, 'find': json_find_account},
+    'sqlite': {'load': sqlite_load_data, 'save': sqlite_save_accounts, 'compact': sqlite_checkpoint, 'refresh': sqlite_refresh_accounts, 'find': sqlite_find_account}
+}
+
+#Account number -> account ID of every active account, and the numbers of deactivated accounts,
+#which are never handed out again. Built by load_data, kept up to date by create_account and deactivate_account.
+account_index={}
+retired_account_numbers=set()
+#Account ID -> when its next loan installment falls due, for accounts with installments left (see post_due_installments)
+loan_due_index={}
+
+def index_accounts(accounts):
+    account_index.clear()
+    retired_account_numbers.clear()
+    loan_due_index.clear()
+    for part in accounts.parts if isinstance(accounts, ShardedAccounts) else [accounts]:
+        if isinstance(part, LazyAccounts):
+            account_index.update(zip(part.numbers.values(), part.numbers))
+            loan_due_index.update(part.loans_due)
+            for account_id in part.inactive:
+                account_index.pop(part.numbers[account_id], None)
+                retired_account_numbers.add(part.numbers[account_id])
+            part=part.loaded
+        for account_id, account in part.items():
+            reindex_account(account_id, account)
+
+def reindex_account(account_id, account):
+    if account.get('Active', True):
+        account_index[account['Account number']]=account_id
+    else:
+        account_index.pop(account['Account number'], None)
+        retired_account_numbers.add(account['Account number'])
+    index_loan_due(account_id, account)
+
+#Accepts either an account ID or an account number (as recorded in transfer 'to'/'from' fields).
+#The account is refreshed first, so accounts other clients opened, closed or changed are seen as they are stored.
+def resolve_account(accounts, key):
+    refresh_accounts(accounts, [key])
+    if key in accounts:
+        return key
+    account_id=account_index.get(key)
+    if account_id is None:
+        return STORAGE_BACKENDS[STORAGE_BACKEND]['find'](accounts, key)
+    refresh_accounts(accounts, [account_id])
+    return account_index.get(key)
+
+#Account IDs come from a counter in accounts.ids shared by every process and shard, so an ID is never handed out
+#twice whatever was deactivated or wherever it is stored. A store without the file continues after its highest ID.
+def allocate_account_id(accounts):
+    with open(ids_path, 'a+') as f:
+        lock_file(f)
+        try:
+            f.seek(0)
+            last=f.read().strip()
+            last=int(last) if last else max((int(account_id) for account_id in accounts if account_id.isdigit()), default=0)
+            f.seek(0)
+            f.truncate()
+            f.write(str(last+1))
+            f.flush()
+        finally:
+            unlock_file(f)
+    return str(last+1).zfill(4)
 
 def generate_account_number():
-    return str(random.randint(10000000000, 99999999999))
+    while True:
+        number=str(random.randint(10000000000, 99999999999))
+        if number not in account_index and number not in retired_account_numbers:
+            return number
 
+#Converts to the target currency, rounded to its minor unit. Rounding to a whole number of minor units is
+#several times cheaper than round(x, 2).
+@instrumented('bank_currency_conversion_seconds', sample=100)
 def currency_converter(amount, from_currency, to_currency):
     try:
         if from_currency==to_currency:
             return amount
-        usd_amount=amount*CURRENCY_RATES[to_currency]
-        return round(usd_amount/CURRENCY_RATES[from_currency], 2)
+        return round(amount*MINOR_CONVERSION[from_currency, to_currency])/MINOR_UNITS[to_currency]
     except KeyError:
         print(colored('Unsupported currency type.', 'light_red'))
         return None
 
+#Amounts in whole minor units. 'inf' and 'nan' parse as floats but are no amount of money.
+def to_minor(amount, currency):
+    if not math.isfinite(amount):
+        raise BankingError('Amount must be a finite number.')
+    return round(amount*MINOR_UNITS.get(currency, 100))
+
+def from_minor(units, currency):
+    return units/MINOR_UNITS.get(currency, 100)
+
+#Rounds an amount to the currency's minor unit, e.g. 10.005 USD to 10.0 and 99.6 JPY to 100.0
+def round_money(amount, currency):
+    return from_minor(to_minor(amount, currency), currency)
+
+#amount+delta, worked out in minor units
+def add_money(amount, delta, currency):
+    return from_minor(to_minor(amount, currency)+to_minor(delta, currency), currency)
+
+MAX_INITIAL_DEPOSIT=10000  # in USD
+
+#Non-interactive account creation, checks the inputs and saves the new account. Returns its account ID.
+@operation('create_account')
+def open_account(accounts, name, currency, account_type, initial_balance, pin, security_question, security_answer):
+    currency=currency.upper()
+    if currency not in CURRENCY_RATES:
+        raise BankingError('Unsupported currency type.')
+    initial_balance=round_money(initial_balance, currency)
+    max_initial_deposit=currency_converter(MAX_INITIAL_DEPOSIT, 'USD', currency)
+    if initial_balance < 0:
+        raise BankingError("Initial balance amount can't be below zero.")
+    if initial_balance > max_initial_deposit:
+        raise BankingError(f"Initial balance amount can't be above the threshold value ({max_initial_deposit} {currency}).")
+    if not (pin.isdigit() and len(pin) == 4):
+        raise BankingError('Invalid PIN. PIN must be a 4-digit number')
+    account_id = allocate_account_id(accounts)
+
+    with account_transaction(accounts, account_id):
+        if account_id in accounts:
+            raise ConflictError(account_id)
+        accounts[account_id] = {
+            'Account number': generate_account_number(),
+            'Name': name,
+            'Currency': currency,
+            'Account type': account_type.lower(),
+            'Balance': initial_balance,
+            'PIN': pin,
+            'USD amount': currency_converter(initial_balance, currency, 'USD'),
+            'Transactions': TransactionColumns([{'type': 'Deposit', 'amount': initial_balance, 'timestamp': now_timestamp()}]),
+            'Loans': 0,
+            'Created at': str(datetime.now().strftime('%A, %B %d, %Y at %I:%M %p')),
+            'Security question': security_question,
+            'Security answer': security_answer,
+            'Active': True
+        }
+    
+        rebuild_stats(accounts[account_id])
+        reindex_account(account_id, accounts[account_id])
+        save_accounts(accounts, journal_entry(accounts, account_id, put=True))
+    return account_id
+
 #User account creation, and saving accounts data.     
 def create_account(accounts):
     print(colored('\n----- Create an Account -----', 'green'))
@@ -62,8 +1892,7 @@ def create_account(accounts):
             return currency
         account_type = input('Enter account type (Savings/Checking): ').lower()
         
-        max_amount=10000
-        max_initial_deposit=currency_converter(max_amount, 'USD', currency)
+        max_initial_deposit=currency_converter(MAX_INITIAL_DEPOSIT, 'USD', currency)
         while True:
             initial_balance = float(input('Enter initial deposit amount: '))
             if initial_balance < 0:
@@ -82,228 +1911,773 @@ def create_account(accounts):
                     
         security_question = input('Set a security question for account recovery: ')
         security_answer = getpass.getpass('Set an answer to the security question: XXXX...XXXX')
-        account_id = str(len(accounts) + 1).zfill(4)
-
-        accounts[account_id] = {
-            'Account number': generate_account_number(),
-            'Name': name,
-            'Currency': currency,
-            'Account type': account_type,
-            'Balance': initial_balance,
-            'PIN': pin,
-            'USD amount': currency_converter(initial_balance, currency, 'USD'),
-            'Transactions': [{'type': 'Deposit', 'amount': initial_balance, 'date': str(datetime.now().strftime('%d-%m-%Y %H:%M:%S'))}],
-            'Loans': 0,
-            'Created at': str(datetime.now().strftime('%A, %B %d, %Y at %I:%M %p')),
-            'Security question': security_question,
-            'Security answer': security_answer,
-            'OTP': None,
-            'Active': True
-        }
-        
-        save_accounts(accounts)
+        account_id = open_account(accounts, name, currency, account_type, initial_balance, pin, security_question, security_answer)
         print(colored(f'\nAccount created successfully! Your account number is', "light_green"), colored(f'{accounts[account_id]["Account number"]}', "light_blue"), colored('and your account ID is', 'green'), colored(f'{account_id}', "light_blue"))
     except ValueError:
         print(colored('\nInvalid input for initial balance. Please enter a numerical value.', 'light_red'))
+    except BankingError as e:
+        print(colored(str(e), 'light_red'))
 
-def suggest_actions(account_id, accounts):
-    account=accounts.get(account_id)
-    
-    if len(account['Transactions'])<3:
-        print(colored('\nTip: Increase your savings by depositing regularly!', 'cyan'))
-    if sum(1 for t in account['Transactions'][-1::-3] if t['type']=='Withdrawal')>3:
-        print(colored('\nWarning: Frequent withdrawals detected. Consider limiting withdrawals to save more', 'yellow'))
+#Running per-account aggregates, kept in account['Stats'] and updated as transactions are recorded,
+#so suggest_actions and predict_balance never rescan the history.
+STATS_RECENT_WINDOW=12
+
+def add_to_stats(stats, txn):
+    ttype=txn['type']
+    stats['Count'][ttype]=stats['Count'].get(ttype, 0)+1
+    stats['Total'][ttype]=stats['Total'].get(ttype, 0)+txn['amount']
+    stats['Recent'].append(ttype)
+    del stats['Recent'][:-STATS_RECENT_WINDOW]
+    stats['Last activity']=transaction_timestamp(txn)
+
+def rebuild_stats(account):
+    stats={'Count': {}, 'Total': {}, 'Recent': [], 'Last activity': None}
+    for txn in transactions_from(account, 0):
+        add_to_stats(stats, txn)
+    account['Stats']=stats
+    return stats
+
+def account_stats(account):
+    return account.get('Stats') or rebuild_stats(account)
+
+#Appends a transaction to the account's history, its running aggregates and its balance checkpoints.
+def record_transaction(account, txn):
+    stats=account_stats(account)
+    account['Transactions'].append(txn)
+    add_to_stats(stats, txn)
+    checkpoint_balance(account, txn)
+
+#'rebuild-stats' command, recomputes the aggregates of every account from its history
+def rebuild_all_stats():
+    with store_lock():
+        accounts=load_data()
+        for account in accounts.values():
+            rebuild_stats(account)
+        save_accounts(accounts)
+    print(colored(f'Rebuilt aggregates for {len(accounts)} accounts.', 'light_green'))
+
+#A legacy text stamp ('date' or 'time') replaced by 'timestamp'. Stamps that cannot be read are left as they are.
+def normalize_transaction(txn):
+    if 'timestamp' in txn or ('date' not in txn and 'time' not in txn):
+        return txn
+    timestamp=legacy_timestamp(txn.get('date') or txn.get('time'))
+    if timestamp is None:
+        return txn
+    txn={k: v for k, v in txn.items() if k!='date' and k!='time'}
+    txn['timestamp']=timestamp
+    return txn
+
+#'migrate-timestamps' command, converts every legacy stamp in the live histories to 'timestamp' and rebuilds the
+#aggregates. Archived transactions are read as they were written.
+def migrate_timestamps():
+    with store_lock():
+        accounts=load_data()
+        migrated=0
+        for account in accounts.values():
+            transactions=list(transactions_from(account, archived_count(account)))
+            normalized=[normalize_transaction(txn) for txn in transactions]
+            changed=sum(1 for old, new in zip(transactions, normalized) if old is not new)
+            if changed:
+                account['Transactions']=TransactionColumns(normalized)
+                rebuild_stats(account)
+                migrated+=changed
+        save_accounts(accounts)
+    print(colored(f'Converted {migrated} transaction timestamps in {len(accounts)} accounts.', 'light_green'))
+
+ACCOUNT_WARNINGS={
+    'save_regularly': ('Tip: Increase your savings by depositing regularly!', 'cyan'),
+    'frequent_withdrawals': ('Warning: Frequent withdrawals detected. Consider limiting withdrawals to save more', 'yellow'),
+    'empty_balance': ('Suggestion: You may want to deposit funds to avoid overdraft or low balance issues.', 'light_red'),
+    'loans_due': ('Alert: You have due loans to pay as soon as possible.', 'light_yellow')
+}
+LOW_BALANCE=500
+
+#The warnings (keys of ACCOUNT_WARNINGS) that apply to an account, shared by suggest_actions and the portfolio report.
+def account_warnings(account):
+    stats=account_stats(account)
+    warnings=[]
+    if transaction_count(account)<3:
+        warnings.append('save_regularly')
+    if stats['Recent'][-1::-3].count('Withdrawal')>3:
+        warnings.append('frequent_withdrawals')
     if account['Balance']==0:
-        print(colored('\nSuggestion: You may want to deposit funds to avoid overdraft or low balance issues.', 'light_red'))
+        warnings.append('empty_balance')
     if account["Loans"]>0:
-        print(colored("\nAlert: You have due loans to pay as soon as possible.", "light_yellow"))
-    else:
+        warnings.append('loans_due')
+    return warnings
+
+def suggest_actions(account_id, accounts):
+    account=accounts.get(account_id)
+    warnings=account_warnings(account)
+    for warning in warnings:
+        message, color=ACCOUNT_WARNINGS[warning]
+        print(colored('\n'+message, color))
+    if 'loans_due' not in warnings:
         return (colored('\nKeep managing your money wisely. You are doing great!', 'light_blue'))
 
 def check_low_balance(account_id, accounts):
     account=accounts.get(account_id)
-    if account['Balance']==0:
-        account['USD amount']=0  
-    if account['Balance']<500:
+    if account['Balance']==0 and account['USD amount']!=0:
+        with account_transaction(accounts, account_id):
+            account['USD amount']=0  
+            save_accounts(accounts, journal_entry(accounts, account_id, 'USD amount'))
+    if account['Balance']<LOW_BALANCE:
         print(colored('\nAlert: Your balance is running low!', 'light_red'))
-    save_accounts(accounts)
+
+#Balance in 6 months if the average deposit and withdrawal keep coming, None without any history.
+def predicted_balance(account):
+    if account["Balance"]==0:
+        return 0
+    if not transaction_count(account):
+        return None
+    stats=account_stats(account)
+    avg_deposit=stats['Total'].get('Deposit', 0)/max(1, stats['Count'].get('Deposit', 0))
+    avg_withdrawal=stats['Total'].get('Withdrawal', 0)/max(1, stats['Count'].get('Withdrawal', 0))
+    return account['Balance']+(avg_deposit-avg_withdrawal)*6
 
 def predict_balance(account_id, accounts):
     account=accounts.get(account_id)
-    
-    try:
-        if account["Balance"]==0:
-            predicted_balance=0
-            print(colored("\nPredicted balance in 6 months:", "blue"), colored(f"{predicted_balance} {account['Currency']}", "light_yellow"))
-        elif account['Transactions']:
-            avg_deposit=sum(t['amount'] for t in account['Transactions'] if t['type']=='Deposit')/max(1, len([t for t in account['Transactions'] if t['type']=='Deposit']))
-            avg_withdrawal=sum(t['amount'] for t in account['Transactions'] if t['type']=='Withdrawal')/max(1, len([t for t in account['Transactions'] if t['type']=='Withdrawal']))
-            predicted_balance=account['Balance']+(avg_deposit-avg_withdrawal)*6
-            print(colored("\nPredicted balance in 6 months:", "blue"), colored(f"{predicted_balance:.2f} {account['Currency']}", "light_yellow"))
-        else:
-            return (colored('\nNot enough data to predict balance.', 'yellow')) 
-    except ZeroDivisionError:
-        print(colored('\nError in calculating average transaction amount.', 'light_red'))
+    
+    prediction=predicted_balance(account)
+    if prediction is None:
+        return (colored('\nNot enough data to predict balance.', 'yellow'))
+    print(colored("\nPredicted balance in 6 months:", "blue"), colored(f"{prediction:.2f} {account['Currency']}" if prediction else f"0 {account['Currency']}", "light_yellow"))
+
+MAX_DEPOSIT=1000000
+
+#Non-interactive money movements. Each one checks the banking rules, raising BankingError when one is broken,
+#applies the change to accounts and returns the journal entries for save_accounts.
+@operation('deposit')
+def post_deposit(accounts, account_id, amount):
+    account=accounts[account_id]
+    amount=round_money(amount, account['Currency'])
+    if amount<=0:
+        raise BankingError('Deposit amount must be greater than zero.')
+    if amount>MAX_DEPOSIT:
+        raise BankingError(f"Exceeding normal deposit threshold. Please make a deposit under {MAX_DEPOSIT} {account['Currency']}")
+    account['Balance']=add_money(account['Balance'], amount, account['Currency'])
+    account['USD amount']=add_money(account['USD amount'], currency_converter(amount, account['Currency'], 'USD'), 'USD')
+    record_transaction(account, {'type': 'Deposit', 'amount': amount, 'timestamp': now_timestamp()})
+    return [journal_entry(accounts, account_id, 'Balance', 'USD amount', 'Stats', new_txns=1)]
+
+@operation('withdraw')
+def post_withdrawal(accounts, account_id, amount):
+    account=accounts[account_id]
+    amount=round_money(amount, account['Currency'])
+    if amount<=0:
+        raise BankingError('Withdrawal amount must be greater than zero.')
+    if amount>account['Balance']:
+        raise BankingError('Insufficient balance')
+    account['Balance']=add_money(account['Balance'], -amount, account['Currency'])
+    account['USD amount']=add_money(account['USD amount'], -currency_converter(amount, account['Currency'], 'USD'), 'USD')
+    record_transaction(account, {'type': 'Withdrawal', 'amount': amount, 'timestamp': now_timestamp()})
+    return [journal_entry(accounts, account_id, 'Balance', 'USD amount', 'Stats', new_txns=1)]
 
 def deposit(account_id, accounts):
     print(colored('\n----- Deposit Money -----', 'yellow'))
-                    
-    account=accounts.get(account_id)
     
     try:
         amount=float(input('Enter deposit amount: '))
-        if amount>1000000:
-            print(colored(f"Exceeding normal deposit threshold. Please make a deposit under 1000000 {account['Currency']}", "yellow"))
-            return None
-        account['Balance']+=amount
-        account['USD amount']+=currency_converter(amount, account['Currency'], 'USD')
-        account['Transactions'].append({'type': 'Deposit', 'amount': amount, 'date': str(datetime.now().strftime('%d-%m-%Y %H:%M:%S'))})
-        
-        save_accounts(accounts)
+        with account_transaction(accounts, account_id):
+            save_accounts(accounts, *post_deposit(accounts, account_id, amount))
         print(colored('Deposit successful!', 'yellow'))
         suggest_actions(account_id, accounts)
     except ValueError:
         print(colored('Invalid deposit amount. Amount must be a numerical value.', 'light_red'))
+    except BankingError as e:
+        print(colored(str(e), "yellow"))
 
 def withdraw(account_id, accounts):
     print(colored('\n----- Withdraw Money -----', 'yellow'))
-                    
-    account=accounts.get(account_id)
     
     try:
         amount=float(input('Enter withdrawal amount: '))
-        if amount<= account['Balance']:
-            currency=account['Currency']
-            account['Balance']-=amount
-            account['USD amount']-= currency_converter(amount, currency, 'USD')
-            account['Transactions'].append({'type': 'Withdrawal', 'amount': amount, 'date': str(datetime.now().strftime('%d-%m-%Y %H:%M:%S'))})
-            
-            save_accounts(accounts)
-            print(colored('Withdrawal successful!', 'yellow'))
-            check_low_balance(account_id, accounts)
-            suggest_actions(account_id, accounts)
-            predict_balance(account_id, accounts)
-        else:
-            print(colored("Insufficient balance", 'light_red'))
-            check_low_balance(account_id, accounts)
-            suggest_actions(account_id, accounts)
+        with account_transaction(accounts, account_id):
+            save_accounts(accounts, *post_withdrawal(accounts, account_id, amount))
+        print(colored('Withdrawal successful!', 'yellow'))
+        check_low_balance(account_id, accounts)
+        suggest_actions(account_id, accounts)
+        predict_balance(account_id, accounts)
     except ValueError:
         print(colored('Invalid withdrawal amount. Amount must be a numerical value.', 'light_red'))
+    except BankingError as e:
+        print(colored(str(e), 'light_red'))
+        check_low_balance(account_id, accounts)
+        suggest_actions(account_id, accounts)
 
 def check_balance(account_id, accounts):
     print(colored('\n----- Check Balance -----', 'light_blue'))
                     
     account=accounts.get(account_id)
-    print('Your balance is:', colored(f'{account['Balance']} {account['Currency']}', "yellow"))
+    print('Your balance is:', colored(f"{account['Balance']} {account['Currency']}", "yellow"))
     
     check_low_balance(account_id, accounts)
 
+TRANSACTIONS_PAGE_SIZE=20
+
+#Transaction types that add money to the account, everything else takes it out
+INFLOW_TYPES=('Deposit', 'Transfer In', 'Loan', 'Interest')
+
+#Transactions are stamped with 'timestamp', whole seconds since the epoch, which is what range queries compare.
+#Older data has local-time text instead: under 'date' as dd-mm-YYYY HH:MM:SS (deposits, withdrawals, transfers)
+#or under 'time' as dd/mm/YYYY HH:MM:SS (interest, loans). It is still read, and 'migrate-timestamps' converts it.
+TIMESTAMP_FORMAT='%d-%m-%Y %H:%M:%S'
+
+def now_timestamp():
+    return int(time.time())
+
+#Both legacy formats are fixed width, so slicing is enough and much cheaper than strptime.
+def legacy_timestamp(stamp):
+    try:
+        return int(datetime(int(stamp[6:10]), int(stamp[3:5]), int(stamp[0:2]), int(stamp[11:13]), int(stamp[14:16]), int(stamp[17:19])).timestamp())
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+def transaction_timestamp(txn):
+    timestamp=txn.get('timestamp')
+    if timestamp is None:
+        return legacy_timestamp(txn.get('date') or txn.get('time'))
+    return timestamp
+
+def format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime(TIMESTAMP_FORMAT) if timestamp is not None else None
+
+def transaction_stamp(txn):
+    if 'timestamp' in txn:
+        return format_timestamp(txn['timestamp'])
+    return txn.get('date', txn.get('time'))
+
+#Range bounds may be datetimes (local time) or epoch seconds.
+def as_timestamp(value):
+    return value.timestamp() if isinstance(value, datetime) else value
+
+#The archive is only read once the live history is used up, and not at all when nothing from before since is wanted.
+def newest_transactions(account, since=None):
+    transactions=account['Transactions']
+    if isinstance(transactions, LazyTransactions) and transactions.items is None:
+        yield from reversed(transactions.tail)
+        yield from sqlite_iter_transactions(transactions.account_id, transactions.stored)
+    else:
+        for i in range(len(transactions)-1, -1, -1):
+            yield transactions[i]
+    archived=account.get('Archived')
+    if archived and (since is None or since<=archived['Until']):
+        for month, offset, length, count in reversed(archived['Blocks']):
+            yield from reversed(read_archive_block(month, offset, length))
+
+#Transactions are appended in time order, so once one is older than start nothing further back can match.
+def transactions_between(transactions, start, end):
+    start, end=as_timestamp(start), as_timestamp(end)
+    for txn in transactions:
+        when=transaction_timestamp(txn)
+        if when is None or (end is not None and when>end):
+            continue
+        if start is not None and when<start:
+            return
+        yield txn
+
+#Pages through an account's transactions newest first, optionally limited to the start..end date range.
+def iter_transactions(account, offset=0, limit=None, start=None, end=None):
+    transactions=newest_transactions(account, as_timestamp(start))
+    if start is not None or end is not None:
+        transactions=transactions_between(transactions, start, end)
+    return islice(transactions, offset, None if limit is None else offset+limit)
+
 def view_transactions(account_id, accounts):
     account=accounts.get(account_id)
-    print('\nTransaction History:')
+    print('\nTransaction History (newest first):')
     
-    for transaction in account['Transactions']:
-        if transaction['amount']!=0:
-            print(f"\t\n{colored(transaction['type'], 'light_magenta')} of {colored(transaction['amount'], 'light_magenta')} on {colored(transaction['date'], 'light_magenta')}")
+    offset=0
+    while True:
+        page=list(iter_transactions(account, offset, TRANSACTIONS_PAGE_SIZE))
+        for transaction in page:
+            if transaction['amount']!=0:
+                print(f"\t\n{colored(transaction['type'], 'light_magenta')} of {colored(transaction['amount'], 'light_magenta')} on {colored(transaction_stamp(transaction), 'light_magenta')}")
+        offset+=len(page)
+        if len(page)<TRANSACTIONS_PAGE_SIZE or input('\nShow older transactions (yes/no)? ').lower()!='yes':
+            break
 
-def accounts_table():
-    data=load_data()
-    df=pd.DataFrame.from_dict(data, orient='index')
-    selected_df=df[['Name', 'Account number', 'Currency', 'Account type', 'Balance']]
-    filtered_df=selected_df[df['Active']== True]
+BANK_CSV_COLUMNS=['Account ID', 'Name', 'Account number', 'Currency', 'Account type', 'Balance']
+TRANSACTIONS_CSV_COLUMNS=['Account ID', 'Date', 'Type', 'Amount', 'Transfered to', 'Transfered from']
 
-    filename=os.path.join(directory, 'bank.csv')
-    filtered_df.to_csv(filename, index_label='Account ID')
+#Oldest-first transactions of an account from position start on. Positions count archived transactions first.
+def transactions_from(account, start):
+    archived=account.get('Archived')
+    if archived:
+        for month, offset, length, count in archived['Blocks']:
+            if start<count:
+                yield from read_archive_block(month, offset, length)[start:]
+            start=max(0, start-count)
+    transactions=account['Transactions']
+    if isinstance(transactions, LazyTransactions) and transactions.items is None:
+        yield from sqlite_iter_transactions_from(transactions.account_id, start, transactions.stored)
+        yield from transactions.tail[max(0, start-transactions.stored):]
+    else:
+        for i in range(start, len(transactions)):
+            yield transactions[i]
 
-    transaction_records=[]
-    for account_id, details in load_data().items():
-        transactions=details.get('Transactions', [])
-        for txn in transactions:
-            txn_record={
-                'Account ID': account_id,
-                'Date': txn.get('date'),
-                'Type': txn.get('type'),
-                'Amount': txn.get('amount'),
-                'Transfered to': txn.get('to'),
-                'Transfered from': txn.get('from')
-            }
-            transaction_records.append(txn_record)
-    transaction_df=pd.DataFrame(transaction_records)
+#Transaction archive. 'archive' moves transactions older than ARCHIVE_AFTER_DAYS out of the live history into one
+#compressed segment per month (archive/YYYY-MM.gz, UTC months as in the analytics export). Segments are only ever
+#appended to: each run adds one gzip member per account and month with its account number and transactions, oldest
+#first. The account keeps a summary under 'Archived': how many transactions were moved, the newest one's timestamp,
+#their net amount, and its blocks as [month, offset, length, count], oldest first. Reading goes straight to the
+#blocks, and only when a query reaches back that far (see newest_transactions and transactions_from).
+ARCHIVE_AFTER_DAYS=365
+archive_directory=os.path.join(directory, 'archive')
+
+def archived_count(account):
+    archived=account.get('Archived')
+    return archived['Count'] if archived else 0
+
+#Live and archived transactions together.
+def transaction_count(account):
+    return archived_count(account)+len(account['Transactions'])
+
+def read_archive_block(month, offset, length):
+    with open(os.path.join(archive_directory, month+'.gz'), 'rb') as f:
+        f.seek(offset)
+        return json.loads(gzip.decompress(f.read(length)))['txns']
+
+#Moves the account's transactions from before cutoff to the archive, segments being the month -> open file of this
+#run. The history is in time order, so only a leading run moves, and one without a readable timestamp ends it.
+def archive_account(account, cutoff, segments):
+    months={}
+    moved, until=0, None
+    for txn in transactions_from(account, archived_count(account)):
+        when=transaction_timestamp(txn)
+        if when is None or when>=cutoff:
+            break
+        months.setdefault(timestamp_month(when//86400), []).append(txn)
+        moved, until=moved+1, when
+    if not moved:
+        return 0
+    currency=account['Currency']
+    archived=account.setdefault('Archived', {'Count': 0, 'Until': None, 'Net': 0, 'Blocks': []})
+    for month, txns in months.items():
+        f=segments.get(month)
+        if f is None:
+            f=segments[month]=open(os.path.join(archive_directory, month+'.gz'), 'ab')
+        data=gzip.compress(json.dumps({'account': account['Account number'], 'txns': txns}, default=json_default).encode())
+        archived['Blocks'].append([month, f.tell(), len(data), len(txns)])
+        f.write(data)
+        count('bank_bytes_written_total', len(data), file='archive')
+        net=sum(signed_minor(txn, currency) for txn in txns)
+        archived['Net']=add_money(archived['Net'], from_minor(net, currency), currency)
+    archived['Count']+=moved
+    archived['Until']=until
+    del account['Transactions'][:moved]
+    return moved
+
+#Archives every account and stores the shortened histories in one full save. The segments are synced first, so
+#a crash in between only leaves blocks nothing points to. Returns the transactions moved and accounts changed.
+def archive_transactions(accounts, cutoff):
+    os.makedirs(archive_directory, exist_ok=True)
+    segments={}
+    moved, changed=0, 0
+    try:
+        for account in accounts.values():
+            account_moved=archive_account(account, cutoff, segments)
+            moved+=account_moved
+            changed+=account_moved>0
+        for f in segments.values():
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        for f in segments.values():
+            f.close()
+    if changed:
+        save_accounts(accounts)
+    return moved, changed
+
+#'archive [days]' command, run as a scheduled job while the store is otherwise idle
+def archive_command(days=None):
+    days=int(days) if days else ARCHIVE_AFTER_DAYS
+    with store_lock():
+        accounts=load_data()
+        moved, changed=archive_transactions(accounts, now_timestamp()-days*86400)
+    print(colored(f'Archived {moved} transactions older than {days} days from {changed} accounts to {archive_directory}.', 'light_green'))
+
+#Balance checkpoints. Each account keeps its closing balance per day under 'Balances', as parallel lists: 'Days'
+#(UTC days since the epoch, ascending), 'Closing' (the balance at the end of that day, in minor units) and 'Through'
+#(the logical position just past that day's last transaction), plus the 'Opening' balance before the first one.
+#A balance at any moment is then a bisection plus at most one day of transactions, archived ones included.
+#record_transaction keeps the last day current. The checkpoints are not journaled: they are stored with the next
+#full snapshot, and an index behind the history (changes replayed from the journal or another process) is caught
+#up from its last day when next used.
+def signed_minor(txn, currency):
+    units=to_minor(txn['amount'], currency)
+    return units if txn['type'] in INFLOW_TYPES else -units
+
+#A transaction without a readable timestamp, or one older than the day before it, counts towards that day.
+def checkpoint_day(txn, days):
+    when=transaction_timestamp(txn)
+    day=0 if when is None else when//86400
+    return max(day, days[-1]) if days else day
+
+def add_checkpoint(index, day, units, position):
+    if index['Days'] and index['Days'][-1]==day:
+        index['Closing'][-1], index['Through'][-1]=units, position
+    else:
+        index['Days'].append(day)
+        index['Closing'].append(units)
+        index['Through'].append(position)
+
+def extend_balances(account, index, start):
+    currency=account['Currency']
+    units=index['Closing'][-1] if index['Closing'] else index['Opening']
+    for position, txn in enumerate(transactions_from(account, start), start+1):
+        units+=signed_minor(txn, currency)
+        add_checkpoint(index, checkpoint_day(txn, index['Days']), units, position)
+
+#Worked back from the current balance, so a history that does not start from zero still ends where the account is.
+def rebuild_balances(account):
+    index={'Opening': 0, 'Days': [], 'Closing': [], 'Through': []}
+    extend_balances(account, index, 0)
+    shift=to_minor(account['Balance'], account['Currency'])-(index['Closing'][-1] if index['Closing'] else 0)
+    index['Opening']=shift
+    index['Closing']=[units+shift for units in index['Closing']]
+    account['Balances']=index
+    return index
+
+#The account's checkpoints, brought up to date with its history first.
+def balance_checkpoints(account):
+    index=account.get('Balances')
+    count=transaction_count(account)
+    if index is None or (index['Through'] and index['Through'][-1]>count):
+        return rebuild_balances(account)
+    start=index['Through'][-1] if index['Through'] else 0
+    if start<count:
+        extend_balances(account, index, start)
+    return index
+
+#Called by record_transaction once the transaction is appended and the balance updated. Accounts that have no
+#checkpoints yet get them on first use.
+def checkpoint_balance(account, txn):
+    index=account.get('Balances')
+    if index is None:
+        return
+    count=transaction_count(account)
+    if (index['Through'][-1] if index['Through'] else 0)!=count-1:
+        balance_checkpoints(account)
+        return
+    add_checkpoint(index, checkpoint_day(txn, index['Days']), to_minor(account['Balance'], account['Currency']), count)
+
+#restore_account undoes transactions, so the days they touched are dropped and worked out again when next used.
+def trim_balances(account):
+    index=account.get('Balances')
+    if index is None:
+        return
+    count=transaction_count(account)
+    while index['Through'] and index['Through'][-1]>count:
+        del index['Days'][-1], index['Closing'][-1], index['Through'][-1]
+
+#The closing balance (minor units) and logical position at the end of the last day before day.
+def closing_before(index, day):
+    i=bisect_left(index['Days'], day)
+    return (index['Closing'][i-1], index['Through'][i-1]) if i else (index['Opening'], 0)
+
+#The balance at the given moment (a datetime, or epoch seconds), transactions stamped at that second included.
+def balance_at(account, moment):
+    moment=as_timestamp(moment)
+    index=balance_checkpoints(account)
+    day=int(moment)//86400
+    units, start=closing_before(index, day)
+    i=bisect_left(index['Days'], day)
+    if i<len(index['Days']) and index['Days'][i]==day:
+        for txn in islice(transactions_from(account, start), index['Through'][i]-start):
+            when=transaction_timestamp(txn)
+            if when is not None and when>moment:
+                break
+            units+=signed_minor(txn, account['Currency'])
+    return from_minor(units, account['Currency'])
+
+#'rebuild-balances' command, recomputes the balance checkpoints of every account from its whole history
+def rebuild_all_balances():
+    with store_lock():
+        accounts=load_data()
+        for account in accounts.values():
+            rebuild_balances(account)
+        save_accounts(accounts)
+    print(colored(f'Rebuilt balance checkpoints for {len(accounts)} accounts.', 'light_green'))
+
+STATEMENT_COLUMNS=['Account ID', 'Account number', 'Currency', 'Opening balance', 'Closing balance', 'Net change', 'Transactions']
+
+#First day of the month ('YYYY-MM') and of the one after, as UTC days since the epoch.
+def month_days(month):
+    year, number=int(month[:4]), int(month[5:7])
+    first=calendar.timegm((year, number, 1, 0, 0, 0))//86400
+    return first, first+calendar.monthrange(year, number)[1]
+
+#Month-end statement lines, read off the checkpoints without going through the transactions. Inactive accounts
+#are left out unless they moved money that month.
+def statement_rows(accounts, month):
+    first, end=month_days(month)
+    for account_id, account in accounts.items():
+        index=balance_checkpoints(account)
+        opening, start=closing_before(index, first)
+        closing, stop=closing_before(index, end)
+        if not account.get('Active', True) and start==stop:
+            continue
+        currency=account['Currency']
+        yield {'Account ID': account_id, 'Account number': account['Account number'], 'Currency': currency,
+               'Opening balance': from_minor(opening, currency), 'Closing balance': from_minor(closing, currency),
+               'Net change': from_minor(closing-opening, currency), 'Transactions': stop-start}
+
+#'statements [YYYY-MM] [output]' command, for the last complete month by default
+def statements_command(month=None, output=None):
+    month=month or timestamp_month(now_timestamp()//86400-time.gmtime().tm_mday)
+    output=output or os.path.join(directory, f'statements-{month}.csv')
+    accounts=load_data()
+    started=time.perf_counter()
+    with open(output, 'w', newline='') as f:
+        writer=csv.DictWriter(f, STATEMENT_COLUMNS)
+        writer.writeheader()
+        rows=0
+        for row in statement_rows(accounts, month):
+            writer.writerow(row)
+            rows+=1
+    print(colored(f'Wrote {rows} statements for {month} to {output} in {time.perf_counter()-started:.1f} s.', 'light_green'))
+
+def open_csv(filename, mode, compress):
+    if compress:
+        return gzip.open(filename+'.gz', mode+'t', newline='')
+    return open(filename, mode, newline='', buffering=1<<20)
+
+#Exports active accounts to bank.csv and every transaction to transactions.csv in one streaming pass.
+#With incremental=True only transactions added since the last export (per the watermark file) are appended.
+@instrumented('bank_accounts_table_seconds')
+def accounts_table(accounts=None, compress=False, incremental=False):
+    if accounts is None:
+        accounts=load_data()
+    
+    filename=os.path.join(directory, 'bank.csv')
     txn_filename=os.path.join(directory, 'transactions.csv')
-    transaction_df.to_csv(txn_filename, index=False, date_format="Y%-m%-d% H%=i%-s%")
+    watermark_path=txn_filename+'.watermark'
+    suffix='.gz' if compress else ''
+    
+    watermark={}
+    previous_size=0
+    if incremental and os.path.exists(txn_filename+suffix):
+        try:
+            with open(watermark_path) as f:
+                watermark=json.load(f)
+            previous_size=os.path.getsize(txn_filename+suffix)
+        except (FileNotFoundError, json.JSONDecodeError):
+            incremental=False
+    else:
+        incremental=False
+    
+    with open_csv(filename+'.tmp', 'w', compress) as bank_file, open_csv(txn_filename+('' if incremental else '.tmp'), 'a' if incremental else 'w', compress) as txn_file:
+        bank_writer=csv.writer(bank_file)
+        txn_writer=csv.writer(txn_file)
+        bank_writer.writerow(BANK_CSV_COLUMNS)
+        if not incremental:
+            txn_writer.writerow(TRANSACTIONS_CSV_COLUMNS)
+        
+        for account_id, details in accounts.items():
+            if details.get('Active') == True:
+                bank_writer.writerow([account_id, details['Name'], details['Account number'], details['Currency'], details['Account type'], details['Balance']])
+            exported=watermark.get(account_id, 0)
+            for txn in transactions_from(details, exported):
+                txn_writer.writerow([account_id, transaction_stamp(txn), txn.get('type'), txn.get('amount'), txn.get('to'), txn.get('from')])
+            watermark[account_id]=transaction_count(details) if 'Transactions' in details else 0
+    
+    os.replace(filename+'.tmp'+suffix, filename+suffix)
+    if not incremental:
+        os.replace(txn_filename+'.tmp'+suffix, txn_filename+suffix)
+    count('bank_bytes_written_total', os.path.getsize(filename+suffix), file='csv')
+    count('bank_bytes_written_total', os.path.getsize(txn_filename+suffix)-previous_size, file='csv')
+    with open(watermark_path+'.tmp', 'w') as f:
+        json.dump(watermark, f)
+    os.replace(watermark_path+'.tmp', watermark_path)
+
+#'export-csv [--gzip] [--incremental]' command
+def export_csv(*options):
+    accounts_table(compress='--gzip' in options, incremental='--incremental' in options)
+    print(colored(f'Exported accounts and transactions to {directory}.', 'light_green'))
+
+#Typed columnar export for reporting. pyarrow is only needed for this, so it is imported on use.
+ANALYTICS_BATCH_SIZE=100000
+
+def analytics_schemas(pa):
+    accounts_schema=pa.schema([
+        ('Account ID', pa.string()),
+        ('Account number', pa.string()),
+        ('Name', pa.string()),
+        ('Currency', pa.dictionary(pa.int8(), pa.string())),
+        ('Account type', pa.dictionary(pa.int8(), pa.string())),
+        ('Balance', pa.float64()),
+        ('USD amount', pa.float64()),
+        ('Loans', pa.float64()),
+        ('Active', pa.bool_())
+    ])
+    transactions_schema=pa.schema([
+        ('Account ID', pa.string()),
+        ('Date', pa.timestamp('s', tz='UTC')),
+        ('Type', pa.string()),
+        ('Amount', pa.float64()),
+        ('Currency', pa.string()),
+        ('Transfered to', pa.string()),
+        ('Transfered from', pa.string()),
+        ('Month', pa.string())
+    ])
+    return accounts_schema, transactions_schema
+
+@lru_cache(maxsize=4096)
+def timestamp_month(day):
+    return time.strftime('%Y-%m', time.gmtime(day*86400))
+
+def transaction_batches(pa, accounts, schema):
+    columns={name: [] for name in schema.names}
+    for account_id, details in accounts.items():
+        for txn in transactions_from(details, 0):
+            when=transaction_timestamp(txn)
+            columns['Account ID'].append(account_id)
+            columns['Date'].append(when)
+            columns['Type'].append(txn.get('type'))
+            columns['Amount'].append(txn.get('amount'))
+            columns['Currency'].append(details['Currency'])
+            columns['Transfered to'].append(txn.get('to'))
+            columns['Transfered from'].append(txn.get('from'))
+            columns['Month'].append(timestamp_month(when//86400) if when is not None else 'unknown')
+            if len(columns['Account ID'])>=ANALYTICS_BATCH_SIZE:
+                yield pa.record_batch(list(columns.values()), schema=schema)
+                columns={name: [] for name in schema.names}
+    if columns['Account ID']:
+        yield pa.record_batch(list(columns.values()), schema=schema)
+
+#Writes accounts.<parquet|arrow> and a transactions dataset partitioned by month (Month=YYYY-MM directories) under analytics/.
+#file_format is 'parquet', or 'arrow' for Arrow IPC files that readers can memory-map.
+def export_analytics(accounts=None, file_format='parquet'):
+    try:
+        import pyarrow as pa, pyarrow.dataset as ds, pyarrow.parquet as pq, pyarrow.feather as feather
+    except ImportError:
+        print(colored('The analytics export needs pyarrow (pip install pyarrow).', 'light_red'))
+        return None
+    if accounts is None:
+        accounts=load_data()
+    
+    output=os.path.join(directory, 'analytics')
+    os.makedirs(output, exist_ok=True)
+    accounts_schema, transactions_schema=analytics_schemas(pa)
+    
+    rows=[{'Account ID': account_id, **{name: details.get(name) for name in accounts_schema.names[1:]}} for account_id, details in accounts.items()]
+    accounts_data=pa.Table.from_pylist(rows, schema=accounts_schema)
+    if file_format=='parquet':
+        pq.write_table(accounts_data, os.path.join(output, 'accounts.parquet'))
+    else:
+        feather.write_feather(accounts_data, os.path.join(output, 'accounts.arrow'), compression='uncompressed')
+    
+    ds.write_dataset(transaction_batches(pa, accounts, transactions_schema), os.path.join(output, 'transactions'),
+                     schema=transactions_schema, format='parquet' if file_format=='parquet' else 'ipc',
+                     partitioning=['Month'], partitioning_flavor='hive',
+                     basename_template='part-{i}.'+file_format, existing_data_behavior='delete_matching')
+    return output
+
+#'export-analytics [--arrow]' command
+def export_analytics_command(*options):
+    output=export_analytics(file_format='arrow' if '--arrow' in options else 'parquet')
+    if output:
+        print(colored(f'Exported analytics snapshot to {output}.', 'light_green'))
+
+#Plotting cost is bounded by these, however long the history is
+PLOT_MAX_POINTS=120
+PLOT_ANNOTATE_MAX=30
+
+#Net flow per day, merged into wider buckets of whole days when there would be more than max_points of them.
+#Returns the bucket dates, net amounts and a label per bucket.
+def transaction_flow(account, start=None, end=None, max_points=PLOT_MAX_POINTS):
+    daily={}
+    for t in iter_transactions(account, start=start, end=end):
+        when=transaction_timestamp(t)
+        if when is None:
+            continue
+        day=date.fromtimestamp(when)
+        amount=t['amount'] if t['type'] in INFLOW_TYPES else -t['amount']
+        net, count, ttype=daily.get(day, (0, 0, t['type']))
+        daily[day]=(net+amount, count+1, ttype)
+    
+    days=sorted(daily)
+    if len(days)>max_points:
+        width=-(-((days[-1]-days[0]).days+1)//max_points)
+        buckets={}
+        for day in days:
+            key=days[0]+timedelta(days=(day-days[0]).days//width*width)
+            net, count, ttype=buckets.get(key, (0, 0, None))
+            buckets[key]=(net+daily[day][0], count+daily[day][1], ttype)
+        daily=buckets
+        days=sorted(daily)
+    
+    amounts=[daily[day][0] for day in days]
+    labels=[daily[day][2] if daily[day][1]==1 else f"{daily[day][1]} transactions" for day in days]
+    return days, amounts, labels
 
-def plot_transaction_history(account_id, accounts): 
+def plot_transaction_history(account_id, accounts, start=None, end=None): 
     account = accounts.get(account_id)
     
     if not account or 'Transactions' not in account:
         print("No transaction data found.")
         return
     
-    dates = []
-    amounts = []
-    ttypes = []
-    
-    for t in account['Transactions']:
-        try:
-            date_obj = datetime.strptime(t['date'], '%d-%m-%Y %H:%M:%S')
-            dates.append(date_obj)
-            amount = t['amount'] if t['type'] in ['Deposit', 'Transfer In', 'Loan'] else -t['amount']
-            amounts.append(amount)
-            ttypes.append(t['type'])
-        except KeyError:
-            continue
+    dates, amounts, labels = transaction_flow(account, start, end)
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(10, 5))
-    plt.plot(dates, amounts, marker='o', linestyle='-', color='royalblue')
-    for i, (x, y, label) in enumerate(zip(dates, amounts, ttypes)):
-        plt.annotate(label,
-                     (x, y),
-                     textcoords='offset points',
-                     xytext=(0, 10),
-                     ha='center',
-                     fontsize=8,
-                     color='green')
-
-    plt.title(f"Transaction History for Account ID {account_id}")
+    plt.plot(dates, amounts, marker='o' if len(dates)<=PLOT_ANNOTATE_MAX else None, linestyle='-', color='royalblue')
+    if len(dates)<=PLOT_ANNOTATE_MAX:
+        for x, y, label in zip(dates, amounts, labels):
+            plt.annotate(label,
+                         (x, y),
+                         textcoords='offset points',
+                         xytext=(0, 10),
+                         ha='center',
+                         fontsize=8,
+                         color='green')
+
+    plt.title(f"Net Transaction Flow for Account ID {account_id}")
     plt.xlabel("Date")
-    plt.ylabel("Amount")
+    plt.ylabel("Net amount")
     plt.grid(True)
     plt.xticks(rotation=45)
     plt.tight_layout()
     plt.show()
 
+#Non-interactive transfer posting: moves the money between the two accounts and returns the journal entries for save_accounts.
+@operation('transfer')
+def post_transfer(accounts, account_id, recipient_account_id, amount):
+    sender_account = accounts[account_id]
+    recipient_account = accounts[recipient_account_id]
+    amount = round_money(amount, sender_account['Currency'])
+    if amount <= 0:
+        raise BankingError("Transfer amount must be greater than zero.")
+    if sender_account["Balance"] < amount:
+        raise BankingError("Insufficient balance.")
+    converted_amount=currency_converter(amount, sender_account['Currency'], recipient_account['Currency'])
+    if converted_amount is None:
+        raise BankingError("Currency conversion failed. Transfer aborted.")
+    
+    sender_account["Balance"] = add_money(sender_account["Balance"], -amount, sender_account['Currency'])
+    recipient_account["Balance"] = add_money(recipient_account["Balance"], converted_amount, recipient_account['Currency'])
+    # Record transactions for both accounts
+    record_transaction(sender_account, {"type": "Transfer Out", "amount": amount, "to": recipient_account["Account number"], "timestamp": now_timestamp()})
+    record_transaction(recipient_account, {"type": "Transfer In", "amount": converted_amount, "from": sender_account["Account number"], "timestamp": now_timestamp()})
+    if account_id==recipient_account_id:
+        return [journal_entry(accounts, account_id, 'Balance', 'Stats', new_txns=2)]
+    return [journal_entry(accounts, account_id, 'Balance', 'Stats', new_txns=1), journal_entry(accounts, recipient_account_id, 'Balance', 'Stats', new_txns=1)]
+
 # Function to transfer money
 def transfer_money(account_id, accounts, recipient_account_id):
     print(colored('\n----- Transfer Money -----', 'light_blue'))
     
-    sender_account = accounts.get(account_id)
-    recipient_account = accounts.get(recipient_account_id)
-    sender_currency=sender_account['Currency']
-    recipient_currency=recipient_account['Currency']
-    
     try:
         amount = float(input("Enter the amount to transfer: "))
-        if amount <= 0:
-            print(colored("Transfer amount must be greater than zero.", "light_red"))
-            return
-        
-        if sender_account["Balance"] >= amount:
-            sender_account["Balance"] -= amount
-            converted_amount=currency_converter(amount, sender_currency, recipient_currency)
-            recipient_account["Balance"] += converted_amount
-            if converted_amount is None:
-                print(colored("Currency conversion failed. Transfer aborted.", "light_red"))
-                return
-            # Record transactions for both accounts
-            sender_account["Transactions"].append({"type": "Transfer Out", "amount": amount, "to": recipient_account["Account number"], "date": str(datetime.now().strftime('%d-%m-%Y %H:%M:%S'))})
-            recipient_account["Transactions"].append({"type": "Transfer In", "amount": converted_amount, "from": sender_account["Account number"], "date": str(datetime.now().strftime('%d-%m-%Y %H:%M:%S'))})
-
-            save_accounts(accounts)
-            check_low_balance(account_id, accounts)
-            print(colored("\nSuccessfully transferred", "light_green"), colored(f"{amount} {sender_account['Currency']}", 'yellow'), colored("to account number", "light_green"), colored(recipient_account['Account number'], 'light_blue'))
-        else:
-            print(colored("Insufficient balance.", "light_red"))
+        with account_transaction(accounts, account_id, recipient_account_id):
+            save_accounts(accounts, *post_transfer(accounts, account_id, recipient_account_id, amount))
+        check_low_balance(account_id, accounts)
+        print(colored("\nSuccessfully transferred", "light_green"), colored(f"{amount} {accounts[account_id]['Currency']}", 'yellow'), colored("to account number", "light_green"), colored(accounts[recipient_account_id]['Account number'], 'light_blue'))
     except ValueError:
         print(colored("Invalid input. Please enter a valid number for the amount.", "light_red"))
+    except BankingError as e:
+        print(colored(str(e), "light_red"))
 
 
 #AI assistant, answer user's request with pre-coded statements.
@@ -361,53 +2735,440 @@ def ai_assistant(account_id, accounts):
         else:
             print("AI: Sorry, I couldn't understand that query. Please try again.")
 
+#OTPs and sessions live in memory only, in the process that issued them, and are never stored with the accounts.
+OTP_TTL=300  # seconds
+SESSION_TTL=900  # seconds
+OTP_CACHE_SIZE=10000
+SESSION_CACHE_SIZE=10000
+OTP_MAX_FAILURES=3  # wrong OTPs before the account's OTPs are locked
+OTP_LOCKOUT=900  # seconds, counted from the last wrong OTP
+#OTPs leave through this outbox, one JSON line each, for the SMS or e-mail gateway to pick up. Only its owner may read it.
+OTP_OUTBOX=os.environ.get('BANK_OTP_OUTBOX', os.path.join(directory, 'otp.outbox'))
+
+#Bounded mapping whose entries expire ttl seconds after they were set. When full, the least recently used entry goes.
+class ExpiringCache:
+    def __init__(self, ttl, size):
+        self.ttl=ttl
+        self.size=size
+        self.entries=OrderedDict()
+        self.lock=threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry=self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0]<=time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key]=(time.monotonic()+self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries)>self.size:
+                self.entries.popitem(last=False)
+
+    #Adds to a counter kept in the cache, restarting its ttl. Returns the new count.
+    def increment(self, key):
+        with self.lock:
+            entry=self.entries.pop(key, None)
+            value=(entry[1] if entry is not None and entry[0]>time.monotonic() else 0)+1
+            self.entries[key]=(time.monotonic()+self.ttl, value)
+            while len(self.entries)>self.size:
+                self.entries.popitem(last=False)
+        return value
+
+    def pop(self, key):
+        with self.lock:
+            entry=self.entries.pop(key, None)
+        return entry[1] if entry is not None and entry[0]>time.monotonic() else None
+
+    def __len__(self):
+        return len(self.entries)
+
+otp_cache=ExpiringCache(OTP_TTL, OTP_CACHE_SIZE)
+otp_failures=ExpiringCache(OTP_LOCKOUT, OTP_CACHE_SIZE)
+reset_cache=ExpiringCache(OTP_TTL, OTP_CACHE_SIZE)
+session_cache=ExpiringCache(SESSION_TTL, SESSION_CACHE_SIZE)
+
+#Appends the OTP to OTP_OUTBOX, where the gateway reads it from. The OTP is never printed or logged on its way out.
+def deliver_otp(account_id, account, otp):
+    message={'time': now_timestamp(), 'account_id': account_id, 'account_number': account['Account number'], 'name': account['Name'], 'otp': otp}
+    with open(os.open(OTP_OUTBOX, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600), 'ab') as f:
+        lock_file(f)
+        try:
+            f.write((json.dumps(message)+'\n').encode())
+            f.flush()
+        finally:
+            unlock_file(f)
+
+#Non-interactive OTP flow. issue_otp replaces any earlier OTP of the account with a fresh one; redeem_otp checks one
+#and returns the account ID. An OTP is used up by the first attempt, right or wrong, and after OTP_MAX_FAILURES
+#wrong ones no OTP is issued or accepted for the account for OTP_LOCKOUT, so new OTPs cannot be guessed at either.
+def check_otp_lockout(account_id):
+    if (otp_failures.get(account_id) or 0)>=OTP_MAX_FAILURES:
+        count('bank_failed_authentications_total', method='otp_locked')
+        raise AuthenticationError(f'Too many invalid OTPs. Try again in {OTP_LOCKOUT//60} minutes.')
+
+@operation('send_otp')
+def issue_otp(accounts, account_id):
+    check_otp_lockout(account_id)
+    otp = random.randint(100000, 999999)
+    otp_cache.set(account_id, otp)
+    try:
+        deliver_otp(account_id, accounts[account_id], otp)
+    except OSError as e:
+        otp_cache.pop(account_id)
+        raise BankingError(f'Could not send the OTP: {e.strerror}')
+    count('bank_otp_sent_total')
+    return otp
+
+@operation('verify_otp')
+def redeem_otp(accounts, account_id, otp):
+    check_otp_lockout(account_id)
+    if not otp or otp_cache.pop(account_id)!=otp:
+        otp_failures.increment(account_id)
+        count('bank_failed_authentications_total', method='otp')
+        raise AuthenticationError('Access denied. Invalid OTP.')
+    otp_failures.pop(account_id)
+    refresh_accounts(accounts, [account_id])
+    return account_id
+
+#A redeemed OTP is traded for a one-time reset token, which lets its holder set a new PIN within OTP_TTL.
+def issue_reset_token(account_id):
+    token=uuid.uuid4().hex
+    reset_cache.set(token, account_id)
+    return token
+
+@operation('reset_pin')
+def reset_pin(accounts, token, new_pin):
+    account_id=reset_cache.pop(token)
+    if account_id is None:
+        count('bank_failed_authentications_total', method='reset_token')
+        raise AuthenticationError('Reset token expired, request a new OTP.')
+    if not (new_pin.isdigit() and len(new_pin) == 4):
+        reset_cache.set(token, account_id)
+        raise BankingError('Invalid PIN. PIN must be a 4-digit number')
+    with account_transaction(accounts, account_id):
+        accounts[account_id]['PIN']=new_pin
+        save_accounts(accounts, journal_entry(accounts, account_id, 'PIN'))
+    return account_id
+
+#A session remembers the PIN it was opened with, so changing the PIN ends it.
+def open_session(key, account_id, pin):
+    session_cache.set(key, (account_id, pin))
+    count('bank_sessions_total')
+
+def session_account(accounts, key):
+    session=session_cache.get(key)
+    if session is None:
+        return None
+    account_id, pin=session
+    account=accounts.get(account_id)
+    if account is None or not account['Active'] or account['PIN']!=pin:
+        session_cache.pop(key)
+        return None
+    return account_id
+
 def send_otp(account_id, accounts):
     print(colored('\n----- OTP Request -----', 'light_magenta'))
     
-    account=accounts.get(account_id)
-    otp = random.randint(100000, 999999)
-    account['OTP']=otp
-    print(colored(f"OTP sent to your accounts file.", "cyan"))  
-    
-    save_accounts(accounts)
+    try:
+        issue_otp(accounts, account_id)
+    except BankingError as e:
+        print(colored(str(e), 'red'))
+        return
+    print(colored(f"OTP sent to your registered contact. It is valid for {OTP_TTL//60} minutes and for one attempt.", "cyan"))
 
 def verify_otp(account_id, accounts):
     print(colored('\n----- OTP Verification -----', 'light_magenta'))
                     
-    account=accounts.get(account_id)
-    
     try:
         entered_otp=int(input("Enter the OTP: "))
-        if entered_otp==account['OTP']:
-            print(colored("Access granted.", 'light_green'))
-            print(f"Your account PIN: {account['PIN']}")
-            account['OTP']=0
-            save_accounts(accounts)
-        else:
-            print(colored('Access denied. Invalid OTP.', 'red'))
-            otp = random.randint(100000, 999999)
-            account['OTP']=otp
-            save_accounts(accounts)
-        return False
+        redeem_otp(accounts, account_id, entered_otp)
     except ValueError:
         print('Invalid input. Please enter a numeric value.')
+        return
+    except AuthenticationError as e:
+        print(colored(str(e), 'red'))
+        return False
+    print(colored("Access granted.", 'light_green'))
+    
+    # The PIN is never shown, a verified OTP only lets a new one be set (see reset_pin).
+    token=issue_reset_token(account_id)
+    while True:
+        try:
+            reset_pin(accounts, token, getpass.getpass("Enter your new PIN: XXXX"))
+            break
+        except AuthenticationError as e:
+            print(colored(str(e), 'red'))
+            return False
+        except BankingError as e:
+            print(str(e))
+    print(colored("PIN reset successfully!", "green"))
+    return False
     
+INTEREST_RATES={'savings': 0.04}  # 4% annual interest for savings
+DEFAULT_INTEREST_RATE=0.02  # 2% for other account types
+INTEREST_PERIODS_PER_YEAR=12  # apply_interest_to_all credits a twelfth of the annual rate, once a month
+
+#The accrual period a moment falls in, e.g. '2026-10'. Each account keeps the last period it was credited
+#interest for in 'Interest period', so running the job again in the same month credits nothing.
+def interest_period(moment=None):
+    return (moment or datetime.now()).strftime('%Y-%m')
+
+#Interest due for the period on every active account not yet credited for it, computed in one vectorized pass.
+#Returns the account IDs, their interest amounts and currencies as NumPy arrays.
+def interest_batch(accounts, period=None):
+    import numpy as np
+    period=period or interest_period()
+    ids=[account_id for account_id, account in accounts.items() if account['Active'] and account.get('Interest period')!=period]
+    balances=np.fromiter((accounts[account_id]['Balance'] for account_id in ids), dtype=np.float64, count=len(ids))
+    rates=np.fromiter((INTEREST_RATES.get(accounts[account_id]['Account type'].lower(), DEFAULT_INTEREST_RATE) for account_id in ids), dtype=np.float64, count=len(ids))
+    currencies=np.array([accounts[account_id]['Currency'] for account_id in ids])
+    units=np.fromiter((MINOR_UNITS.get(currency, 100) for currency in currencies.tolist()), dtype=np.float64, count=len(ids))
+    return np.array(ids), np.rint(balances*rates/INTEREST_PERIODS_PER_YEAR*units)/units, currencies
+
+def interest_totals(interest, currencies):
+    import numpy as np
+    names, inverse=np.unique(currencies, return_inverse=True)
+    totals=np.bincount(inverse, weights=interest, minlength=len(names)).tolist()
+    return {name: round_money(total, name) for name, total in zip(names.tolist(), totals)}
+
+#Credits the computed interest (accounts with nothing due are skipped), marks the accounts as credited for the
+#period and returns the journal entries to commit.
+def post_interest(accounts, ids, interest, period=None):
+    period=period or interest_period()
+    stamp=now_timestamp()
+    changes=[]
+    for account_id, amount in zip(ids.tolist(), interest.tolist()):
+        if amount==0:
+            continue
+        account=accounts[account_id]
+        account['Balance']=add_money(account['Balance'], amount, account['Currency'])
+        account['Interest period']=period
+        record_transaction(account, {"type": "Interest", "amount": amount, "timestamp": stamp})
+        changes.append(journal_entry(accounts, account_id, 'Balance', 'Stats', 'Interest period', new_txns=1))
+    return changes
+
+#Month-end interest for the whole book, committed with a single save. Returns the interest totals per currency,
+#empty when every account was already credited this month.
+@operation('apply_interest_to_all')
+def apply_interest_to_all(accounts, dry_run=False):
+    period=interest_period()
+    ids, interest, currencies=interest_batch(accounts, period)
+    totals=interest_totals(interest, currencies)
+    if not dry_run:
+        save_accounts(accounts, *post_interest(accounts, ids, interest, period))
+    return totals
+
+#'apply-interest [--dry-run]' command
+def apply_interest_command(*options):
+    dry_run='--dry-run' in options
+    with store_lock():
+        accounts=load_data()
+        totals=apply_interest_to_all(accounts, dry_run)
+    print(colored('\n----- Interest Totals (dry run) -----' if dry_run else '\n----- Interest Credited -----', 'light_green'))
+    for currency, total in totals.items():
+        print(f"{currency}: {colored(total, 'green')}")
+
+#Portfolio report: per active account the 6-month prediction, the low-balance flag, outstanding loans in USD
+#and the suggest_actions warnings. Accounts are split into shards for a process pool. On Linux the workers are
+#forked after load_data, so each one only decodes its own shard from the snapshot the parent opened (see
+#LazyAccounts); elsewhere they are spawned and every worker loads the store itself.
+REPORT_COLUMNS=['Account ID', 'Account number', 'Currency', 'Balance', 'Predicted balance', 'Low balance', 'Loans', 'Loans (USD)', 'Warnings']
+REPORT_SHARDS_PER_WORKER=4
+_report={'accounts': None}
+
+def account_report(account_id, account):
+    currency=account['Currency']
+    prediction=predicted_balance(account)
+    loans=account.get('Loans', 0)
+    return {
+        'Account ID': account_id,
+        'Account number': account['Account number'],
+        'Currency': currency,
+        'Balance': account['Balance'],
+        'Predicted balance': None if prediction is None else round_money(prediction, currency),
+        'Low balance': account['Balance']<LOW_BALANCE,
+        'Loans': loans,
+        'Loans (USD)': currency_converter(loans, currency, 'USD') if loans else 0,
+        'Warnings': ';'.join(account_warnings(account))
+    }
+
+def report_shard(account_ids):
+    accounts=_report['accounts']
+    if accounts is None:
+        accounts=_report['accounts']=load_data()
+    rows=[]
+    for account_id in account_ids:
+        account=accounts[account_id]
+        if account.get('Active', True):
+            rows.append(account_report(account_id, account))
+    return rows
+
+#A forked worker must not use the SQLite connection it inherited from the parent.
+def report_worker_init():
+    _sqlite.__dict__.pop('conn', None)
+
+def portfolio_report(accounts, workers=None):
+    import multiprocessing
+    workers=workers or os.cpu_count() or 1
+    ids=list(accounts)
+    size=max(1, -(-len(ids)//(workers*REPORT_SHARDS_PER_WORKER)))
+    shards=[ids[i:i+size] for i in range(0, len(ids), size)]
+    _report['accounts']=accounts
+    try:
+        if workers==1:
+            return [row for shard in shards for row in report_shard(shard)]
+        context=multiprocessing.get_context('fork' if sys.platform.startswith('linux') else 'spawn')
+        with context.Pool(workers, initializer=report_worker_init) as pool:
+            return [row for rows in pool.imap(report_shard, shards) for row in rows]
+    finally:
+        _report['accounts']=None
+
+def report_summary(rows):
+    warnings={warning: 0 for warning in ACCOUNT_WARNINGS}
+    for row in rows:
+        for warning in filter(None, row['Warnings'].split(';')):
+            warnings[warning]+=1
+    return {
+        'Accounts': len(rows),
+        'Low balance': sum(1 for row in rows if row['Low balance']),
+        'With loans': sum(1 for row in rows if row['Loans']),
+        'Outstanding loans (USD)': round(sum(row['Loans (USD)'] for row in rows), 2),
+        **{f'Warning: {warning}': total for warning, total in warnings.items()}
+    }
+
+#'report [output file] [workers]': writes the portfolio report as CSV and prints its totals.
+def report_command(output='portfolio-report.csv', workers=None):
+    accounts=load_data()
+    started=time.perf_counter()
+    rows=portfolio_report(accounts, int(workers) if workers else None)
+    with open(output, 'w', newline='') as f:
+        writer=csv.DictWriter(f, REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(colored(f'\n----- Portfolio Report ({time.perf_counter()-started:.1f} s) -----', 'light_green'))
+    for label, value in report_summary(rows).items():
+        print(f"{label}: {colored(value, 'yellow')}")
+    print(colored(f'Report written to {output}.', 'light_green'))
+
+#'post-installments [--dry-run]' command, run once a day or more often
+def post_installments_command(*options):
+    dry_run='--dry-run' in options
+    with store_lock():
+        accounts=load_data()
+        totals, posted, unpaid=post_due_installments(accounts, dry_run=dry_run)
+    print(colored('\n----- Installments Due (dry run) -----' if dry_run else '\n----- Installments Posted -----', 'light_green'))
+    print(f"Installments: {colored(posted, 'green')}, left unpaid for lack of funds: {colored(unpaid, 'light_red' if unpaid else 'green')}")
+    for currency, total in totals.items():
+        print(f"{currency}: {colored(total, 'green')}")
+
 def calculate_annual_interest(account_id, accounts):
     print(colored('\n----- Interest Calculation -----', 'light_green'))
                         
     account=accounts.get(account_id)
     
-    if account["Account type"].lower() == "savings":
-        rate = 0.04  # 4% annual interest for savings
+    #The same monthly share as apply_interest_to_all, and at most once per period between the two.
+    period=interest_period()
+    with account_transaction(accounts, account_id):
+        ids, interest, currencies=interest_batch({account_id: account}, period)
+        if not len(ids):
+            print(colored("Interest for this month has already been credited.", "yellow"))
+            return
+        changes=post_interest(accounts, ids, interest, period)
+        if changes:
+            save_accounts(accounts, *changes)
+    print("Interest of", colored(f"{interest[0]} {account['Currency']}", "green"), "credited.")
+
+LOAN_INTEREST_RATE=0.05  # 5% annual interest
+MAX_OUTSTANDING_LOANS=100000000  # in USD
+LOAN_LIMITS={'savings': 100000, 'checking': 10000000}  # in USD, by account type
+MAX_LOAN_YEARS=30
+
+def loan_limit_reached(account):
+    return account["Loans"]>=currency_converter(MAX_OUTSTANDING_LOANS, "USD", account["Currency"])
+
+def max_loan(account):
+    return currency_converter(LOAN_LIMITS.get(account['Account type'], LOAN_LIMITS['savings']), 'USD', account['Currency'])
+
+#Loans are repaid in monthly installments. Each loan is kept in the account's 'Loan records' with its principal,
+#rate, term and its whole amortization schedule, one [due, payment, interest, principal, remaining] row per month.
+#'next' is the first installment not posted yet and 'credit' what was paid ahead of the schedule, which covers the
+#next installments first. 'Loans' stays the total still owed (installments left minus credit, plus any loan taken
+#out before schedules existed).
+def add_months(moment, months):
+    month=moment.month-1+months
+    year, month=moment.year+month//12, month%12+1
+    return moment.replace(year=year, month=month, day=min(moment.day, calendar.monthrange(year, month)[1]))
+
+#Fixed monthly payment, worked out in minor units. Interest is charged on what is left each month and the
+#last installment absorbs the rounding.
+def amortization_schedule(amount, duration_years, currency, start, rate=LOAN_INTEREST_RATE):
+    months=duration_years*12
+    monthly_rate=rate/12
+    remaining=to_minor(amount, currency)
+    payment=round(remaining*monthly_rate/(1-(1+monthly_rate)**-months)) if monthly_rate else -(-remaining//months)
+    started=datetime.fromtimestamp(start)
+    schedule=[]
+    for month in range(1, months+1):
+        interest=round(remaining*monthly_rate)
+        installment=min(payment, remaining+interest) if month<months else remaining+interest
+        remaining-=installment-interest
+        schedule.append([int(add_months(started, month).timestamp()), *(from_minor(value, currency) for value in (installment, interest, installment-interest, remaining))])
+    return schedule
+
+def loan_outstanding(loan, currency):
+    return from_minor(sum(to_minor(row[1], currency) for row in loan['schedule'][loan['next']:])-to_minor(loan['credit'], currency), currency)
+
+def next_loan_due(account):
+    dues=[loan['schedule'][loan['next']][0] for loan in account.get('Loan records', ()) if loan['next']<len(loan['schedule'])]
+    return min(dues) if dues else None
+
+def index_loan_due(account_id, account):
+    due=next_loan_due(account)
+    if due is None:
+        loan_due_index.pop(account_id, None)
     else:
-        rate = 0.02  # 2% for other account types
-    interest = round(account["Balance"] * rate, 2)
-    account["Balance"] += interest
-    account["Transactions"].append({"type": "Interest", "amount": interest, "time": str(datetime.now().strftime("%d/%m/%Y %H:%M:%S"))})
-    
-    currency_converter(account["Balance"], account['Currency'], 'USD')
-    save_accounts(accounts)
-    print("Interest of", colored(f"{interest} {account['Currency']}", "green"), "credited.")
+        loan_due_index[account_id]=due
+
+#Non-interactive loan approval, credits the loan and returns the journal entries for save_accounts.
+@operation('apply_loan')
+def post_loan(accounts, account_id, amount, duration_years):
+    account=accounts[account_id]
+    amount=round_money(amount, account['Currency'])
+    if loan_limit_reached(account):
+        raise BankingError("Please pay off your due loan amount first. Any further loans will not be provided.")
+    if amount <= 0:
+        raise BankingError("Loan amount must be greater than zero.")
+    if amount>max_loan(account):
+        raise BankingError(f"Exceeding normal credit limit. Please make a request under {max_loan(account)} {account['Currency']}")
+    if duration_years <= 0:
+        raise BankingError("Loan duration must be at least one year.")
+    if duration_years > MAX_LOAN_YEARS:
+        raise BankingError(f"Loan duration can't be above {MAX_LOAN_YEARS} years.")
+    stamp=now_timestamp()
+    schedule=amortization_schedule(amount, duration_years, account['Currency'], stamp)
+    loans=account.setdefault('Loan records', [])
+    loans.append({'id': len(loans)+1, 'principal': amount, 'rate': LOAN_INTEREST_RATE, 'years': duration_years, 'start': stamp,
+                  'payment': schedule[0][1], 'schedule': schedule, 'next': 0, 'credit': 0})
+    account["Loans"] = add_money(account["Loans"], loan_outstanding(loans[-1], account['Currency']), account['Currency'])
+    account["Balance"] = add_money(account["Balance"], amount, account['Currency'])
+    record_transaction(account, {"type": "Loan", "amount": amount, "timestamp": stamp})
+    index_loan_due(account_id, account)
+    return [journal_entry(accounts, account_id, 'Loans', 'Balance', 'Stats', 'Loan records', new_txns=1)]
+
+#Asks again until the input parses as the given type.
+def read_number(prompt, kind):
+    while True:
+        try:
+            return kind(input(prompt))
+        except ValueError:
+            print(colored('Invalid input. Please enter a numerical value.', 'light_red'))
 
 def apply_for_loan(account_id, accounts):
     print(colored('\n----- Loan Request -----', 'light_green'))
@@ -415,46 +3176,206 @@ def apply_for_loan(account_id, accounts):
     account=accounts.get(account_id)
     currency=account["Currency"]
     
-    if account["Loans"]>=currency_converter(100000000, "USD", currency):
+    if loan_limit_reached(account):
         print(colored("Warning: Please pay off your due loan amount first. Any further loans will not be provided.", "light_red"))
         print(colored(f"Your remaining loan balance: {account['Loans']}","yellow"))
         return None
-    amount = float(input("Enter loan amount: "))
-    if account['Account type']=='savings':
-        max_amount=100000
-    elif account['Account type']=='checking':
-        max_amount=10000000
-    max_loan=currency_converter(max_amount, 'USD', currency)
-    if amount>max_loan:
-        print(colored(f"Exceeding normal credit limit. Please make a request under {max_loan} {currency}", "yellow"))
+    amount = read_number("Enter loan amount: ", float)
+    if amount>max_loan(account):
+        print(colored(f"Exceeding normal credit limit. Please make a request under {max_loan(account)} {currency}", "yellow"))
+        return None
+    duration_years = read_number("Enter loan duration in years: ", int)
+    try:
+        with account_transaction(accounts, account_id):
+            save_accounts(accounts, *post_loan(accounts, account_id, amount, duration_years))
+    except BankingError as e:
+        print(colored(str(e), "light_red"))
         return None
-    duration_years = int(input("Enter loan duration in years: "))
-    interest_rate = 0.05  # 5% annual interest
-    total_payable = round(amount * ((1 + interest_rate) ** duration_years), 2)
-    account["Loans"] += total_payable
-    account["Balance"] += amount
-    account["Transactions"].append({"type": "Loan", "amount": amount, "time": str(datetime.now().strftime("%d/%m/%Y %H:%M:%S"))})
-    
-    save_accounts(accounts)
+    loan=account['Loan records'][-1]
+    total_payable = loan_outstanding(loan, currency)
     print(colored(f"Loan of {amount} approved. Total payable amount: {total_payable} {account['Currency']} over {duration_years} year(s)", "green"))
+    print(colored(f"Monthly installment: {loan['payment']} {currency}, first due {format_timestamp(loan['schedule'][0][0])}", "cyan"))
+
+@operation('loan_payment')
+def post_loan_payment(accounts, account_id, payment_amount):
+    account=accounts[account_id]
+    payment_amount=round_money(payment_amount, account['Currency'])
+    if payment_amount <= 0:
+        raise BankingError("Loan payment amount must be greater than zero.")
+    if payment_amount > account["Loans"]:
+        raise BankingError("Amount exceeds outstanding loan balance. ")
+    if payment_amount > account['Balance']:
+        raise BankingError('Insufficient balance')
+    account["Loans"] = add_money(account["Loans"], -payment_amount, account['Currency'])
+    account["Balance"] = add_money(account["Balance"], -payment_amount, account['Currency'])
+    record_transaction(account, {"type": "Loan Payment", "amount": payment_amount, "timestamp": now_timestamp()})
+    if 'Loan records' not in account:
+        return [journal_entry(accounts, account_id, 'Loans', 'Balance', 'Stats', new_txns=1)]
+    #Paid ahead of the schedule: credited to the oldest loans first, a loan that is fully covered is closed.
+    left=payment_amount
+    changed=[]
+    for i, loan in enumerate(account['Loan records']):
+        outstanding=loan_outstanding(loan, account['Currency'])
+        if left<=0 or outstanding<=0:
+            continue
+        if left>=outstanding:
+            loan['next'], loan['credit']=len(loan['schedule']), 0
+        else:
+            loan['credit']=add_money(loan['credit'], left, account['Currency'])
+        changed.append(i)
+        left=add_money(left, -min(left, outstanding), account['Currency'])
+    index_loan_due(account_id, account)
+    return [journal_entry(accounts, account_id, 'Loans', 'Balance', 'Stats', new_txns=1, loans=changed)]
+
+#Posts every installment of the account's loans that fell due by now. Credit from early payments is used first and
+#the rest is taken from the balance; without enough balance the installment stays due for the next run.
+#Returns the amount taken from the balance, the installments posted and those left unpaid.
+def post_account_installments(account, now):
+    currency=account['Currency']
+    charged, posted, unpaid=0, 0, 0
+    for loan in account.get('Loan records', ()):
+        while loan['next']<len(loan['schedule']) and loan['schedule'][loan['next']][0]<=now:
+            payment=loan['schedule'][loan['next']][1]
+            covered=min(loan['credit'], payment)
+            charge=add_money(payment, -covered, currency)
+            if charge>account['Balance']:
+                unpaid+=1
+                break
+            loan['credit']=add_money(loan['credit'], -covered, currency)
+            loan['next']+=1
+            posted+=1
+            if charge:
+                account['Balance']=add_money(account['Balance'], -charge, currency)
+                account['Loans']=add_money(account['Loans'], -charge, currency)
+                record_transaction(account, {'type': 'Loan Installment', 'amount': charge, 'timestamp': now_timestamp(), 'loan': loan['id']})
+                charged=add_money(charged, charge, currency)
+    return charged, posted, unpaid
+
+#Loan servicing for the whole book in one pass, committed with a single save. Only accounts whose next installment
+#is due are visited (see loan_due_index), so the cost follows the installments due, not the number of accounts.
+#Returns the totals taken per currency and the numbers of installments posted and left unpaid.
+@operation('post_due_installments')
+def post_due_installments(accounts, now=None, dry_run=False):
+    now=now or now_timestamp()
+    totals, posted, unpaid, changes={}, 0, 0, []
+    for account_id in sorted(account_id for account_id, due in loan_due_index.items() if due<=now):
+        account=copy.deepcopy(accounts[account_id]) if dry_run else accounts[account_id]
+        length=len(account['Transactions'])
+        before=[(loan['next'], loan['credit']) for loan in account['Loan records']]
+        charged, account_posted, account_unpaid=post_account_installments(account, now)
+        posted+=account_posted
+        unpaid+=account_unpaid
+        if charged:
+            totals[account['Currency']]=add_money(totals.get(account['Currency'], 0), charged, account['Currency'])
+        if account_posted and not dry_run:
+            index_loan_due(account_id, account)
+            changed=[i for i, loan in enumerate(account['Loan records']) if (loan['next'], loan['credit'])!=before[i]]
+            changes.append(journal_entry(accounts, account_id, 'Loans', 'Balance', 'Stats', new_txns=len(account['Transactions'])-length, loans=changed))
+    if changes:
+        save_accounts(accounts, *changes)
+    return totals, posted, unpaid
 
 def make_loan_payment(account_id, accounts):
     print(colored('\n----- Loan Payment -----', 'light_green'))
                         
     account=accounts.get(account_id)
-    payment_amount = float(input("Enter loan payment amount: "))
+    payment_amount = read_number("Enter loan payment amount: ", float)
     
-    if payment_amount <= account["Loans"]:
-        account["Loans"] -= payment_amount
-        account["Balance"] -= payment_amount
-        account["Transactions"].append({"type": "Loan Payment", "amount": payment_amount, "time": str(datetime.now().strftime("%d/%m/%Y %H:%M:%S"))})
-              
-        save_accounts(accounts)
+    try:
+        with account_transaction(accounts, account_id):
+            save_accounts(accounts, *post_loan_payment(accounts, account_id, payment_amount))
         print(colored("Loan payment successful.", "green"))
-        print(colored(f"Your remaining loan balance: {account['Loans']}","yellow"))
-    else:
-        print(colored("Amount exceeds outstanding loan balance. ", "light_red"))
-        print(colored(f"Your remaining loan balance: {account['Loans']}","yellow"))
+    except BankingError as e:
+        print(colored(str(e), "light_red"))
+    print(colored(f"Your remaining loan balance: {account['Loans']}","yellow"))
+
+#Upcoming installments of each loan still being repaid.
+def view_loan_schedule(account_id, accounts, rows=12):
+    print(colored('\n----- Loan Schedule -----', 'light_green'))
+    account=accounts.get(account_id)
+    loans=[loan for loan in account.get('Loan records', []) if loan['next']<len(loan['schedule'])]
+    if not loans:
+        print(colored("No loan installments due.", "yellow"))
+        return
+    for loan in loans:
+        print(colored(f"\nLoan {loan['id']}: {loan['principal']} {account['Currency']} at {loan['rate']*100:g}% over {loan['years']} year(s), {loan_outstanding(loan, account['Currency'])} left", "cyan"))
+        if loan['credit']:
+            print(colored(f"Paid ahead: {loan['credit']}", "green"))
+        print(f"{'Due':<22}{'Payment':>12}{'Interest':>12}{'Principal':>12}{'Remaining':>14}")
+        for due, payment, interest, principal, remaining in loan['schedule'][loan['next']:loan['next']+rows]:
+            print(f"{format_timestamp(due):<22}{payment:>12}{interest:>12}{principal:>12}{remaining:>14}")
+
+#Bulk ingestion of money movements from a CSV (with a header row) or JSONL file. Each row has an
+#'operation' (deposit, withdraw, transfer or loan payment), an 'account' ID or number and an 'amount',
+#plus a 'recipient' for transfers and optionally the 'currency' the amount is given in.
+BATCH_OPERATIONS={
+    'deposit': post_deposit,
+    'withdraw': post_withdrawal,
+    'withdrawal': post_withdrawal,
+    'loan payment': post_loan_payment
+}
+
+def read_operations(filename):
+    with open(filename, newline='') as f:
+        if filename.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+def apply_operation(accounts, operation):
+    kind=operation['operation'].strip().lower()
+    account_id=resolve_account(accounts, str(operation['account']).strip())
+    if account_id is None or not accounts[account_id]['Active']:
+        raise BankingError('Account not found.')
+    currency=(operation.get('currency') or accounts[account_id]['Currency']).upper()
+    amount=round_money(float(operation['amount']), currency)
+    amount=currency_converter(amount, currency, accounts[account_id]['Currency'])
+    if amount is None:
+        raise BankingError('Unsupported currency type.')
+    if kind=='transfer':
+        recipient_account_id=resolve_account(accounts, str(operation.get('recipient', '')).strip())
+        if recipient_account_id is None or not accounts[recipient_account_id]['Active']:
+            raise BankingError('Recipient account not found.')
+        return account_id, post_transfer(accounts, account_id, recipient_account_id, amount)
+    if kind not in BATCH_OPERATIONS:
+        raise BankingError(f"Unknown operation '{operation['operation']}'.")
+    return account_id, BATCH_OPERATIONS[kind](accounts, account_id, amount)
+
+#Applies the operations in order and commits them with one save. Entries touching the same account
+#are merged so each account is written once. Returns one result dict per operation.
+def process_batch(accounts, operations):
+    results=[]
+    touched={}
+    for row, operation in enumerate(operations, 1):
+        try:
+            account_id, changes=apply_operation(accounts, operation)
+        except (KeyError, TypeError, ValueError, BankingError) as e:
+            results.append({'row': row, 'status': 'rejected', 'message': str(e), 'balance': None})
+            continue
+        for change in changes:
+            at, fields, loans=touched.get(change['id'], (change['at'], set(), set()))
+            touched[change['id']]=(min(at, change['at']), fields|set(change['set']), loans|{loan[0] for loan in change.get('loans', ())})
+        results.append({'row': row, 'status': 'ok', 'message': '', 'balance': accounts[account_id]['Balance']})
+    
+    if touched:
+        save_accounts(accounts, *(journal_entry(accounts, account_id, *fields, new_txns=transaction_count(accounts[account_id])-at, loans=loans) for account_id, (at, fields, loans) in touched.items()))
+    return results
+
+#'ingest <operations file> [results file]' command, results default to <operations file>.results.csv.
+#The store stays locked for the whole batch, so other clients wait instead of conflicting with it.
+def ingest_command(filename, results_filename=None):
+    results_filename=results_filename or filename+'.results.csv'
+    with store_lock():
+        accounts=load_data()
+        results=process_batch(accounts, read_operations(filename))
+    with open(results_filename, 'w', newline='') as f:
+        writer=csv.DictWriter(f, ['row', 'status', 'message', 'balance'])
+        writer.writeheader()
+        writer.writerows(results)
+    applied=sum(1 for result in results if result['status']=='ok')
+    print(colored(f'Applied {applied} of {len(results)} operations. Results written to {results_filename}.', 'light_green'))
 
 def recover_pin(account_id, accounts):
     print(colored('\n----- Account PIN Recovery -----', 'light_magenta'))
@@ -470,9 +3391,9 @@ def recover_pin(account_id, accounts):
             else:
                 print('Invalid PIN. PIN must be a 4-digit number')
                 return new_pin
-        account["PIN"] = new_pin
-        
-        save_accounts(accounts)
+        with account_transaction(accounts, account_id):
+            account["PIN"] = new_pin
+            save_accounts(accounts, journal_entry(accounts, account_id, 'PIN'))
         print(colored("PIN reset successfully!", "green"))
     else:
         print(colored("security answer is incorrect.", "red"))
@@ -485,18 +3406,21 @@ def deactivate_account(account_id, accounts):
     confirm=input('Are you sure you want to deactivate your account (yes/no)? ').lower()
         
     if confirm.lower()=='yes':
-        account['Active']=False
-            
-        save_accounts(accounts)
+        with account_transaction(accounts, account_id):
+            account['Active']=False
+            reindex_account(account_id, account)
+            save_accounts(accounts, journal_entry(accounts, account_id, 'Active'))
         print(colored('Account deactivated successfully!', 'light_blue'))
         print(colored(f'Withdrew {round(account["Balance"], 2)} successfully!', 'yellow'))
     
     else:
         print(colored('Account deactivation cancelled.', 'light_red'))
 
-#User authentication, for security purpose.
+#User authentication, for security purpose. The console asks for the PIN every time: whoever sits at it next
+#may not be the person who logged in, so sessions are only handed out as service tokens (see service_login).
 def authenticate(accounts):
     account_id=input('Enter your account ID: ')
+    refresh_accounts(accounts, [account_id])
     
     if account_id not in accounts:
         print(colored('Account not found!', 'light_red'))
@@ -509,6 +3433,7 @@ def authenticate(accounts):
     attempts=3
     while attempts>=0:
         pin=getpass.getpass('Enter your PIN: XXXX')
+        refresh_accounts(accounts, [account_id])
         
         # Validate the PIN input.
         if pin == accounts[account_id]['PIN']:
@@ -516,12 +3441,226 @@ def authenticate(accounts):
             return account_id 
         else:
             print(colored('Incorrect PIN!', 'light_red'))
+            count('bank_failed_authentications_total', method='pin')
             attempts -= 1
     
     else:
         print(colored('Authentication failed.', 'light_red'))
         return None
 
+#JSON service over HTTP, run as 'python Bank_Management_Project.py serve [host] [port]'.
+#Every call is a POST to /<method> with a JSON object body and answers with a JSON object, GET /metrics gives the metrics. Calls on an existing
+#account carry its 'account_id' and either its 'pin' or the 'session' token that 'login' returns and 'logout' ends. Connections are served by asyncio, the banking functions run on a
+#thread pool (account_transaction keeps them apart) so storage I/O never blocks the event loop.
+#A forgotten PIN is replaced with 'send_otp', then 'verify_otp', which trades the OTP for a 'reset_token', then 'reset_pin'.
+SERVICE_HOST='127.0.0.1'
+SERVICE_PORT=8080
+SERVICE_WORKERS=32
+SERVICE_CONFLICT_RETRIES=3
+
+HTTP_REASONS={200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict', 500: 'Internal Server Error'}
+
+#Non-interactive authenticate, returns the account ID.
+def verify_pin(accounts, account_id, pin):
+    account_id=str(account_id)
+    refresh_accounts(accounts, [account_id])
+    account=accounts.get(account_id)
+    if account is None or not account['Active']:
+        raise AuthenticationError('Account not found!')
+    if str(pin)!=account['PIN']:
+        count('bank_failed_authentications_total', method='pin')
+        raise AuthenticationError('Incorrect PIN!')
+    return account_id
+
+#A session token stands in for the PIN until it expires or the PIN changes.
+def authorize(accounts, params):
+    if 'session' not in params:
+        return verify_pin(accounts, params['account_id'], params.get('pin'))
+    session=session_cache.get(str(params['session']))
+    account_id=None
+    if session is not None:
+        refresh_accounts(accounts, [session[0]])
+        account_id=session_account(accounts, str(params['session']))
+    if account_id is None or account_id!=str(params.get('account_id', account_id)):
+        count('bank_failed_authentications_total', method='session')
+        raise AuthenticationError('Session expired, log in again.')
+    return account_id
+
+def account_summary(accounts, account_id):
+    account=accounts[account_id]
+    return {'account_id': account_id, 'balance': account['Balance'], 'currency': account['Currency'], 'loans': account['Loans']}
+
+def service_create_account(accounts, params):
+    account_id=open_account(accounts, str(params['name']), str(params['currency']), str(params.get('account_type', 'savings')), float(params['initial_balance']),
+                            str(params['pin']), str(params.get('security_question', '')), str(params.get('security_answer', '')))
+    return dict(account_summary(accounts, account_id), account_number=accounts[account_id]['Account number'])
+
+def service_login(accounts, params):
+    account_id=verify_pin(accounts, params['account_id'], params.get('pin'))
+    session=uuid.uuid4().hex
+    open_session(session, account_id, accounts[account_id]['PIN'])
+    return {'account_id': account_id, 'session': session, 'expires_in': SESSION_TTL}
+
+#Ends a session before it expires.
+def service_logout(accounts, params):
+    account_id=authorize(accounts, params)
+    if 'session' in params:
+        session_cache.pop(str(params['session']))
+    return {'account_id': account_id, 'logged_out': True}
+
+#With 'at' (epoch seconds) the balance the account had at that moment is added as 'balance_at'.
+def service_balance(accounts, params):
+    account_id=authorize(accounts, params)
+    summary=dict(account_summary(accounts, account_id), low_balance=accounts[account_id]['Balance']<LOW_BALANCE)
+    if 'at' in params:
+        with account_lock(account_id):
+            summary['balance_at']=balance_at(accounts[account_id], int(params['at']))
+    return summary
+
+def service_transactions(accounts, params):
+    account_id=authorize(accounts, params)
+    page=iter_transactions(accounts[account_id], int(params.get('offset', 0)), int(params.get('limit', TRANSACTIONS_PAGE_SIZE)), params.get('start'), params.get('end'))
+    return {'account_id': account_id, 'transactions': list(page)}
+
+#Wraps a post_* function into a call: authenticate, then apply and save under the account lock(s).
+def service_posting(post, *fields):
+    def call(accounts, params):
+        account_id=authorize(accounts, params)
+        args=[field(params[name]) for name, field in fields]
+        with account_transaction(accounts, account_id):
+            save_accounts(accounts, *post(accounts, account_id, *args))
+        return account_summary(accounts, account_id)
+    return call
+
+def service_transfer(accounts, params):
+    account_id=authorize(accounts, params)
+    recipient_account_id=resolve_account(accounts, str(params['recipient']))
+    if recipient_account_id is None or not accounts[recipient_account_id]['Active']:
+        raise BankingError('Recipient account not found.')
+    with account_transaction(accounts, account_id, recipient_account_id):
+        save_accounts(accounts, *post_transfer(accounts, account_id, recipient_account_id, float(params['amount'])))
+    return account_summary(accounts, account_id)
+
+def service_send_otp(accounts, params):
+    account_id=str(params['account_id'])
+    if account_id not in accounts:
+        raise AuthenticationError('Account not found!')
+    issue_otp(accounts, account_id)
+    return {'account_id': account_id, 'sent': True}
+
+def service_verify_otp(accounts, params):
+    account_id=str(params['account_id'])
+    if account_id not in accounts:
+        raise AuthenticationError('Account not found!')
+    redeem_otp(accounts, account_id, int(params['otp']))
+    return {'account_id': account_id, 'reset_token': issue_reset_token(account_id), 'expires_in': OTP_TTL}
+
+def service_reset_pin(accounts, params):
+    account_id=reset_pin(accounts, str(params['reset_token']), str(params['new_pin']))
+    return {'account_id': account_id, 'reset': True}
+
+SERVICE_METHODS={
+    'create_account': service_create_account,
+    'login': service_login,
+    'logout': service_logout,
+    'balance': service_balance,
+    'transactions': service_transactions,
+    'deposit': service_posting(post_deposit, ('amount', float)),
+    'withdraw': service_posting(post_withdrawal, ('amount', float)),
+    'transfer': service_transfer,
+    'apply_loan': service_posting(post_loan, ('amount', float), ('duration_years', int)),
+    'loan_payment': service_posting(post_loan_payment, ('amount', float)),
+    'send_otp': service_send_otp,
+    'verify_otp': service_verify_otp,
+    'reset_pin': service_reset_pin
+}
+
+#Runs one call on the thread pool and maps the outcome to an HTTP status. Conflicts with other clients are retried.
+async def dispatch(accounts, http_method, path, body):
+    if path.strip('/')=='metrics' and http_method=='GET':
+        return 200, metrics_text()
+    function=SERVICE_METHODS.get(path.strip('/'))
+    if function is None:
+        return 404, {'error': f"Unknown method '{path.strip('/')}'."}
+    if http_method!='POST':
+        return 405, {'error': 'Use POST.'}
+    try:
+        params=json.loads(body or b'{}')
+    except ValueError:
+        params=None
+    if not isinstance(params, dict):
+        return 400, {'error': 'The request body must be a JSON object.'}
+    for attempt in range(SERVICE_CONFLICT_RETRIES+1):
+        try:
+            return 200, await asyncio.to_thread(function, accounts, params)
+        except ConflictError as e:
+            if attempt==SERVICE_CONFLICT_RETRIES:
+                return 409, {'error': str(e)}
+        except AuthenticationError as e:
+            return 403, {'error': str(e)}
+        except BankingError as e:
+            return 400, {'error': str(e)}
+        except KeyError as e:
+            return 400, {'error': f'Missing parameter {e}.'}
+        except (TypeError, ValueError) as e:
+            return 400, {'error': f'Invalid parameter: {e}'}
+
+#HTTP/1.1 with keep-alive, one request at a time per connection.
+async def handle_connection(reader, writer, accounts):
+    try:
+        while True:
+            request_line=await reader.readline()
+            if not request_line:
+                break
+            http_method, path, version=request_line.decode('latin-1').split()
+            headers={}
+            while True:
+                line=await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value=line.decode('latin-1').partition(':')
+                headers[name.strip().lower()]=value.strip()
+            body=await reader.readexactly(int(headers.get('content-length', 0)))
+            started=time.perf_counter()
+            try:
+                status, result=await dispatch(accounts, http_method, path, body)
+            except Exception as e:
+                status, result=500, {'error': str(e)}
+            method=path.strip('/') if path.strip('/') in SERVICE_METHODS or path.strip('/')=='metrics' else 'unknown'
+            observe(metric_key('bank_service_request_seconds', {'method': method}), time.perf_counter()-started)
+            count('bank_service_requests_total', method=method, status=status)
+            keep_alive=version=='HTTP/1.1' and headers.get('connection', '').lower()!='close'
+            content_type='text/plain; version=0.0.4' if isinstance(result, str) else 'application/json'
+            payload=result.encode() if isinstance(result, str) else json.dumps(result).encode()
+            writer.write(f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()+payload)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(accounts, host, port):
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(SERVICE_WORKERS))
+    server=await asyncio.start_server(lambda reader, writer: handle_connection(reader, writer, accounts), host, port)
+    print(colored(f'Serving the Bank Management System on http://{host}:{port}/', 'light_green'), flush=True)
+    async with server:
+        await server.serve_forever()
+
+#'serve [host] [port]' command
+def serve_command(host=SERVICE_HOST, port=SERVICE_PORT):
+    accounts=load_data()
+    try:
+        asyncio.run(serve(accounts, host, int(port)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        compact_storage(accounts)
+
+MENU_OPTIONS={'1': 'create account', '2': 'deposit money', '3': 'withdraw money', '4': 'check balance', '5': 'view transactions', '6': 'ai assistant',
+              '7': 'annual interest and loans', '8': '2fa and account pin recovery', '9': 'deactivate account', '10': 'exit'}
+
 #Main program, executes when the program runs. 
 def main():
     accounts=load_data()
@@ -541,91 +3680,124 @@ def main():
     10. Exit''')
         
         choice=input('\nChoose an option: ').strip().lower()
+        count('bank_menu_selections_total', option=MENU_OPTIONS.get(choice, choice if choice in MENU_OPTIONS.values() else 'invalid'))
 
-        if choice=='1' or choice=='create account':
-            create_account(accounts)
-        elif choice in ['2', '3', '4', '5', '6', '7', '9', 'deposit money', 'withdraw money', 'check balance', 'view transactions', 'ai assistant', 'annual interest and loans', 'deactivate account']:
-            account_id=authenticate(accounts)
+        try:
+            if choice=='1' or choice=='create account':
+                create_account(accounts)
+            elif choice in ['2', '3', '4', '5', '6', '7', '9', 'deposit money', 'withdraw money', 'check balance', 'view transactions', 'ai assistant', 'annual interest and loans', 'deactivate account']:
+                account_id=authenticate(accounts)
             
-            if account_id:
-                if choice =='2' or choice=='deposit money':
-                    deposit(account_id, accounts)
-                elif choice =='3' or choice=='withdraw money':
-                    withdraw(account_id, accounts)
-                elif choice =='4' or choice=='check balance':
-                    print(colored("\n----- Check Balance and Money Transfer -----", "blue"))
-                    print('''\n
-    1. Check account balance
-    2. Transfer money''')
-                    ch=input("\nEnter your choice: ").lower()
+                if account_id:
+                    if choice =='2' or choice=='deposit money':
+                        deposit(account_id, accounts)
+                    elif choice =='3' or choice=='withdraw money':
+                        withdraw(account_id, accounts)
+                    elif choice =='4' or choice=='check balance':
+                        print(colored("\n----- Check Balance and Money Transfer -----", "blue"))
+                        print('''\n
+        1. Check account balance
+        2. Transfer money''')
+                        ch=input("\nEnter your choice: ").lower()
                     
-                    if ch=='1'or ch=='check account balance':
-                        check_balance(account_id, accounts)
-                    elif ch=='2'or ch=='transfer money':
-                        recipient_account_id = input("Enter the recipient's account ID: ")
-                        if not recipient_account_id in accounts:
-                            print(colored("Recipient account not found.", "light_red"))
+                        if ch=='1'or ch=='check account balance':
+                            check_balance(account_id, accounts)
+                        elif ch=='2'or ch=='transfer money':
+                            recipient_account_id = resolve_account(accounts, input("Enter the recipient's account ID or account number: "))
+                            if recipient_account_id is None:
+                                print(colored("Recipient account not found.", "light_red"))
+                            else:
+                                transfer_money(account_id, accounts, recipient_account_id)
                         else:
-                            transfer_money(account_id, accounts, recipient_account_id)
-                    else:
-                        print(colored("Invalid choice.", "light_red"))
-                elif choice =='5' or choice=='view transactions':
-                    print(colored('\n----- View Transaction History -----', 'light_yellow'))
-                    view_transactions(account_id, accounts)
-                    plot_transaction_history(account_id, accounts)
-                elif choice =='6' or choice=='ai assistant':
-                    ai_assistant(account_id, accounts)
-                elif choice =='7' or choice=='annual interest and loans':
-                    print(colored('\n----- Interest Calculation and Loan Approval -----', 'green'))
-                    print('''\n
-    1. Apply annual interest
-    2. Apply for loan
-    3. Make loan payment
-                    ''')
-                    ch=input("\nEnter your choice: ").lower()
+                            print(colored("Invalid choice.", "light_red"))
+                    elif choice =='5' or choice=='view transactions':
+                        print(colored('\n----- View Transaction History -----', 'light_yellow'))
+                        view_transactions(account_id, accounts)
+                        plot_transaction_history(account_id, accounts)
+                    elif choice =='6' or choice=='ai assistant':
+                        ai_assistant(account_id, accounts)
+                    elif choice =='7' or choice=='annual interest and loans':
+                        print(colored('\n----- Interest Calculation and Loan Approval -----', 'green'))
+                        print('''\n
+        1. Apply annual interest
+        2. Apply for loan
+        3. Make loan payment
+        4. View loan schedule
+                        ''')
+                        ch=input("\nEnter your choice: ").lower()
                     
-                    if ch=='1'or ch=='apply annual interest':
-                        calculate_annual_interest(account_id, accounts)
-                    elif ch=='2' or ch=='apply for loan':
-                        apply_for_loan(account_id, accounts)
-                    elif ch=='3' or ch=='make loan payment':
-                        make_loan_payment(account_id, accounts)
-                    else:
-                        print("Invalid choice.", "light_red")
-                elif choice =='9' or choice=='deactivate account':
-                    deactivate_account(account_id, accounts)
+                        if ch=='1'or ch=='apply annual interest':
+                            calculate_annual_interest(account_id, accounts)
+                        elif ch=='2' or ch=='apply for loan':
+                            apply_for_loan(account_id, accounts)
+                        elif ch=='3' or ch=='make loan payment':
+                            make_loan_payment(account_id, accounts)
+                        elif ch=='4' or ch=='view loan schedule':
+                            view_loan_schedule(account_id, accounts)
+                        else:
+                            print("Invalid choice.", "light_red")
+                    elif choice =='9' or choice=='deactivate account':
+                        deactivate_account(account_id, accounts)
         
-        elif choice =='8' or choice=='2fa and account pin recovery':
-            account_id=input('Enter your account ID: ')
+            elif choice =='8' or choice=='2fa and account pin recovery':
+                account_id=input('Enter your account ID: ')
+                refresh_accounts(accounts, [account_id])
             
-            if account_id in accounts:
-                print(colored('\n----- PIN Recovery and 2FA -----', 'light_magenta'))
-                print('''\n
-    1. Recover account PIN
-    2. Send OTP for 2FA
-    3. Verify OTP''')
-                ch=input('\nEnter your choice: ').lower()
-                if ch=='1' or ch=='recover account pin':
-                    recover_pin(account_id, accounts)
-                elif ch=='2' or ch=='send otp for 2fa':
-                    send_otp(account_id, accounts)
-                elif ch=='3' or ch=='verify otp':
-                    verify_otp(account_id, accounts)
+                if account_id in accounts:
+                    print(colored('\n----- PIN Recovery and 2FA -----', 'light_magenta'))
+                    print('''\n
+        1. Recover account PIN
+        2. Send OTP for 2FA
+        3. Verify OTP''')
+                    ch=input('\nEnter your choice: ').lower()
+                    if ch=='1' or ch=='recover account pin':
+                        recover_pin(account_id, accounts)
+                    elif ch=='2' or ch=='send otp for 2fa':
+                        send_otp(account_id, accounts)
+                    elif ch=='3' or ch=='verify otp':
+                        verify_otp(account_id, accounts)
+                    else:
+                        print("Invalid choice.", "light_red")
                 else:
-                    print("Invalid choice.", "light_red")
-            else:
-                print('Account not found.')
+                    print('Account not found.')
         
-        elif choice =='10' or choice=='exit':
-            accounts_table()
-            print(colored('\nThank you for using the Bank Management System!', 'light_blue'))
-            print(colored("\n....Exiting....", 'yellow'))
-            input()
-            break
+            elif choice =='10' or choice=='exit':
+                compact_storage(accounts)
+                accounts_table(accounts)
+                print(colored('\nThank you for using the Bank Management System!', 'light_blue'))
+                print(colored("\n....Exiting....", 'yellow'))
+                input()
+                break
         
-        else:
-            print(colored('\nInvalid choice. Please try again.', "light_red"))
+            else:
+                print(colored('\nInvalid choice. Please try again.', "light_red"))
+        except BankingError as e:
+            print(colored(str(e), 'light_red'))
+
+#Maintenance commands, run as 'python Bank_Management_Project.py <command>'
+COMMANDS={
+    'migrate-sqlite': migrate_json_to_sqlite,
+    'convert-snapshot': convert_snapshot,
+    'reshard': reshard_command,
+    'export-csv': export_csv,
+    'export-analytics': export_analytics_command,
+    'rebuild-stats': rebuild_all_stats,
+    'rebuild-balances': rebuild_all_balances,
+    'migrate-timestamps': migrate_timestamps,
+    'apply-interest': apply_interest_command,
+    'post-installments': post_installments_command,
+    'archive': archive_command,
+    'report': report_command,
+    'statements': statements_command,
+    'events': events_command,
+    'ingest': ingest_command,
+    'serve': serve_command
+}
 
 # Run the main function if this script is run directly
 if __name__ == "__main__":
-    main() 
+    with profiling():
+        if len(sys.argv)>1 and sys.argv[1] in COMMANDS:
+            COMMANDS[sys.argv[1]](*sys.argv[2:])
+        else:
+            main() 
@@ -0,0 +1,617 @@
+#Benchmarks for the Bank Management System, run as 'python benchmark.py <benchmark> [arguments]'
+#Data files are written to a temporary directory unless BANK_DATA_DIR is set.
+import os, sys, gc, time, json, random, socket, asyncio, platform, tempfile, threading, subprocess, tracemalloc, multiprocessing
+from datetime import datetime, timedelta
+try:
+    import resource
+except ImportError:
+    resource=None
+
+os.environ.setdefault('BANK_DATA_DIR', tempfile.mkdtemp(prefix='bank-benchmark-'))
+import Bank_Management_Project as bank
+
+#Builds n accounts shaped like the ones create_account makes, each with a few transactions.
+#With currency set every account uses it, otherwise currencies are mixed.
+def synthetic_accounts(n, transactions=3, seed=42, currency=None):
+    rng=random.Random(seed)
+    start=datetime(2024, 1, 1)
+    accounts={}
+    for i in range(1, n+1):
+        account_currency=currency or rng.choice(list(bank.CURRENCY_RATES))
+        history=[]
+        balance=0
+        for j in range(transactions):
+            amount=round(rng.uniform(10, 1000), 2)
+            ttype='Deposit' if j==0 or rng.random()<0.6 else 'Withdrawal'
+            balance+=amount if ttype=='Deposit' else -min(amount, balance)
+            history.append({'type': ttype, 'amount': amount, 'timestamp': int((start+timedelta(minutes=i*transactions+j)).timestamp())})
+        accounts[str(i).zfill(4)]={
+            'Account number': str(10000000000+i),
+            'Name': f'Customer {i}',
+            'Currency': account_currency,
+            'Account type': rng.choice(['savings', 'checking']),
+            'Balance': round(balance, 2),
+            'PIN': '1234',
+            'USD amount': bank.currency_converter(round(balance, 2), account_currency, 'USD'),
+            'Transactions': history,
+            'Loans': 0,
+            'Created at': start.strftime('%A, %B %d, %Y at %I:%M %p'),
+            'Security question': 'q',
+            'Security answer': 'a',
+            'Active': True
+        }
+    return accounts
+
+def timed(label, function, *args, count=None):
+    started=time.perf_counter()
+    result=function(*args)
+    elapsed=time.perf_counter()-started
+    rate=f', {count/elapsed:,.0f}/s' if count else ''
+    print(f'{label:<28}{elapsed:10.3f} s{rate}')
+    return result
+
+#Month-end interest: the vectorized pass, posting the Interest transactions, and the single commit.
+def bench_interest(n=1000000):
+    accounts=synthetic_accounts(n, transactions=1)
+    print(f'Interest accrual over {n:,} accounts')
+    ids, interest, currencies=timed('interest_batch', bank.interest_batch, accounts, count=n)
+    timed('interest_totals', bank.interest_totals, interest, currencies, count=n)
+    changes=timed('post_interest', bank.post_interest, accounts, ids, interest, count=n)
+    timed('save_accounts', bank.save_accounts, accounts, *changes)
+
+#Bulk ingestion of a mixed operations file against a book of n accounts.
+def bench_ingest(n=100000, operations=100000):
+    accounts=synthetic_accounts(n)
+    rng=random.Random(7)
+    kinds=['deposit', 'withdraw', 'transfer']
+    filename=os.path.join(bank.directory, 'operations.jsonl')
+    with open(filename, 'w') as f:
+        for _ in range(operations):
+            f.write(bank.json.dumps({'operation': rng.choice(kinds), 'account': str(rng.randint(1, n)).zfill(4), 'amount': round(rng.uniform(1, 500), 2), 'recipient': str(rng.randint(1, n)).zfill(4)})+'\n')
+    bank.index_accounts(accounts)
+    print(f'Ingesting {operations:,} operations into {n:,} accounts')
+    results=timed('process_batch', bank.process_batch, accounts, bank.read_operations(filename), count=operations)
+    print(f"{sum(1 for result in results if result['status']=='ok'):,} applied, {sum(1 for result in results if result['status']!='ok'):,} rejected")
+
+#One client process of the stress test: several threads making random transfers, retrying on conflicts.
+def stress_client(seed, threads, transfers):
+    accounts=bank.load_data()
+    ids=sorted(accounts)
+    counts={'ok': 0, 'conflicts': 0, 'rejected': 0}
+    counts_lock=threading.Lock()
+    
+    def run(thread_seed):
+        rng=random.Random(thread_seed)
+        for _ in range(transfers):
+            sender, recipient=rng.sample(ids, 2)
+            amount=rng.randint(1, 50)
+            while True:
+                try:
+                    with bank.account_transaction(accounts, sender, recipient):
+                        bank.save_accounts(accounts, *bank.post_transfer(accounts, sender, recipient, amount))
+                    outcome='ok'
+                except bank.ConflictError:
+                    with counts_lock:
+                        counts['conflicts']+=1
+                    continue
+                except bank.BankingError:
+                    outcome='rejected'
+                break
+            with counts_lock:
+                counts[outcome]+=1
+    
+    workers=[threading.Thread(target=run, args=(seed*1000+i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    bank.close_journal()
+    return counts
+
+def total_balance(accounts):
+    return round(sum(account['Balance'] for account in accounts.values()), 2)
+
+#Parallel transfers from several processes, each with several threads, against one store.
+#Money only moves between accounts, so the total balance must come out unchanged.
+def bench_stress(n=100, processes=4, threads=4, transfers=200):
+    accounts=synthetic_accounts(n, currency='USD')
+    bank.save_accounts(accounts)
+    before=total_balance(accounts)
+    print(f'Stress test: {processes} processes x {threads} threads x {transfers} transfers over {n} accounts ({bank.STORAGE_BACKEND} store)')
+    
+    started=time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        results=pool.starmap(stress_client, [(seed, threads, transfers) for seed in range(processes)])
+    elapsed=time.perf_counter()-started
+    
+    counts={key: sum(result[key] for result in results) for key in results[0]}
+    after_accounts=bank.load_data()
+    after=total_balance(after_accounts)
+    transfers_out=sum(t['amount'] for account in after_accounts.values() for t in account['Transactions'] if t['type']=='Transfer Out')
+    transfers_in=sum(t['amount'] for account in after_accounts.values() for t in account['Transactions'] if t['type']=='Transfer In')
+    print(f"{counts['ok']:,} transfers, {counts['rejected']:,} rejected, {counts['conflicts']:,} conflicts retried, {counts['ok']/elapsed:,.0f} transfers/s")
+    print(f'Total balance before {before}, after {after}, transferred out {transfers_out}, in {transfers_in}')
+    if before!=after or transfers_out!=transfers_in or sum(1 for account in after_accounts.values() for t in account['Transactions'] if t['type']=='Transfer Out')!=counts['ok']:
+        print('FAILED: balances not conserved')
+        sys.exit(1)
+    print('Balances conserved')
+
+def traced_memory(function, *args):
+    gc.collect()
+    tracemalloc.start()
+    result=function(*args)
+    gc.collect()
+    size=tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+def to_columns(accounts):
+    for account in accounts.values():
+        account['Transactions']=bank.TransactionColumns(account['Transactions'])
+    return accounts
+
+#Memory per transaction with one dict per transaction versus TransactionColumns, measured with tracemalloc
+#over n accounts of t transactions each (the accounts themselves are measured separately and taken off).
+#Also times a full pass over every history (rebuild_stats) in both layouts.
+def bench_memory(n=100000, transactions=10):
+    count=n*transactions
+    _, base=traced_memory(synthetic_accounts, n, 0)
+    accounts, as_dicts=traced_memory(synthetic_accounts, n, transactions)
+    print(f'Memory for {count:,} transactions over {n:,} accounts')
+    print(f"{'dict per transaction':<28}{(as_dicts-base)/count:10.1f} bytes/transaction")
+    timed('rebuild_stats (dicts)', lambda: [bank.rebuild_stats(account) for account in accounts.values()], count=count)
+    del accounts
+    accounts, as_columns=traced_memory(lambda: to_columns(synthetic_accounts(n, transactions)))
+    print(f"{'TransactionColumns':<28}{(as_columns-base)/count:10.1f} bytes/transaction")
+    timed('rebuild_stats (columns)', lambda: [bank.rebuild_stats(account) for account in accounts.values()], count=count)
+
+#currency_converter as it was before the conversion matrix: two rate lookups, a multiply, a divide and a round.
+def legacy_currency_converter(amount, from_currency, to_currency):
+    if from_currency==to_currency:
+        return amount
+    return round(amount*bank.CURRENCY_RATES[to_currency]/bank.CURRENCY_RATES[from_currency], 2)
+
+#Conversion throughput: the old per-call function and the matrix-backed currency_converter.
+#Also shows the drift of adding 0.01 a million times as floats versus in minor units.
+def bench_money(n=1000000):
+    rng=random.Random(12)
+    codes=list(bank.CURRENCY_RATES)
+    amounts=[round(rng.uniform(1, 10000), 2) for _ in range(n)]
+    pairs=[(rng.choice(codes), rng.choice(codes)) for _ in range(n)]
+    print(f'Converting {n:,} amounts between random currency pairs')
+    timed('legacy converter', lambda: [legacy_currency_converter(a, f, t) for a, (f, t) in zip(amounts, pairs)], count=n)
+    timed('currency_converter', lambda: [bank.currency_converter(a, f, t) for a, (f, t) in zip(amounts, pairs)], count=n)
+    
+    balance=0.0
+    for _ in range(n):
+        balance+=0.01
+    units=0.0
+    for _ in range(n):
+        units=bank.add_money(units, 0.01, 'USD')
+    print(f'Adding 0.01 {n:,} times: float {balance!r}, minor units {units!r}, exact {n/100!r}')
+
+#Minimal keep-alive HTTP client for the service benchmark.
+async def service_call(reader, writer, method, params):
+    body=json.dumps(params).encode()
+    writer.write(f'POST /{method} HTTP/1.1\r\nHost: bank\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n'.encode()+body)
+    await writer.drain()
+    status=int((await reader.readline()).split()[1])
+    length=0
+    while True:
+        line=await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        if line.lower().startswith(b'content-length:'):
+            length=int(line.split(b':')[1])
+    return status, json.loads(await reader.readexactly(length))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+async def wait_for_port(port, timeout=30):
+    deadline=time.monotonic()+timeout
+    while True:
+        try:
+            reader, writer=await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic()>deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+def percentile(values, p):
+    return values[min(len(values)-1, int(len(values)*p/100))]
+
+#Load generator: clients each keep one connection open and send a mix of balance checks, deposits,
+#withdrawals and transfers until the requests are used up. Reports latency percentiles and throughput.
+async def service_load(port, n, clients, requests):
+    rng=random.Random(11)
+    latencies=[]
+    statuses={}
+    remaining=[requests]
+    
+    async def client():
+        reader, writer=await asyncio.open_connection('127.0.0.1', port)
+        while remaining[0]>0:
+            remaining[0]-=1
+            account_id=str(rng.randint(1, n)).zfill(4)
+            method=rng.choices(['balance', 'deposit', 'withdraw', 'transfer'], [4, 2, 2, 2])[0]
+            params={'account_id': account_id, 'pin': '1234', 'amount': rng.randint(1, 100), 'recipient': str(rng.randint(1, n)).zfill(4)}
+            started=time.perf_counter()
+            status, _=await service_call(reader, writer, method, params)
+            latencies.append(time.perf_counter()-started)
+            statuses[status]=statuses.get(status, 0)+1
+        writer.close()
+    
+    started=time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return time.perf_counter()-started, sorted(latencies), statuses
+
+#Starts 'serve' in its own process over a book of n accounts and drives it with the load generator.
+def bench_service(n=1000, clients=64, requests=20000):
+    bank.save_accounts(synthetic_accounts(n))
+    bank.close_journal()
+    port=free_port()
+    server=subprocess.Popen([sys.executable, os.path.abspath(bank.__file__), 'serve', '127.0.0.1', str(port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=os.environ)
+    try:
+        asyncio.run(wait_for_port(port))
+        print(f'Service load: {clients} clients, {requests:,} requests over {n:,} accounts ({bank.STORAGE_BACKEND} store)')
+        elapsed, latencies, statuses=asyncio.run(service_load(port, n, clients, requests))
+    finally:
+        server.terminate()
+        server.wait()
+    print(f'{len(latencies):,} requests in {elapsed:.2f} s, {len(latencies)/elapsed:,.0f} req/s')
+    print(f'Latency p50 {percentile(latencies, 50)*1000:.2f} ms, p99 {percentile(latencies, 99)*1000:.2f} ms, max {latencies[-1]*1000:.2f} ms')
+    print('Status codes: '+', '.join(f'{status}: {count:,}' for status, count in sorted(statuses.items())))
+
+#Core suite: times the banking operations against books of growing size, each size in a fresh process
+#so its peak RSS is its own. deposit, withdraw and transfer_money are timed through their non-interactive
+#cores (post_deposit etc. under account_transaction, one save per operation), plot data is transaction_flow.
+CORE_SIZES=[1000, 10000, 100000, 1000000]
+
+#Peak resident set size of this process in bytes, None where the resource module is missing (Windows).
+def peak_rss():
+    if resource is None:
+        return None
+    peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform=='darwin' else peak*1024
+
+def reset_store():
+    bank.close_journal()
+    bank.close_events()
+    for path in (*(store[key] for store in bank.SHARDS for key in ('file_path', 'journal_path')), bank.db_path, bank.db_path+'-wal', bank.db_path+'-shm', bank.events_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+def store_size():
+    paths=[bank.db_path, bank.db_path+'-wal'] if bank.STORAGE_BACKEND=='sqlite' else [store[key] for store in bank.SHARDS for key in ('file_path', 'journal_path')]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+def core_run(n, transactions, operations):
+    reset_store()
+    accounts=synthetic_accounts(n, transactions)
+    results={}
+    
+    def measure(name, function, count):
+        started=time.perf_counter()
+        function()
+        elapsed=time.perf_counter()-started
+        results[name]={'count': count, 'seconds': round(elapsed, 6), 'ops_per_sec': round(count/elapsed, 1)}
+        print(f'  {name:<20}{elapsed:10.3f} s {count/elapsed:14,.0f}/s', flush=True)
+    
+    def post_all(post, pairs):
+        for account_id, recipient in pairs:
+            try:
+                with bank.account_transaction(accounts, account_id, recipient):
+                    args=(account_id, recipient, 1) if post is bank.post_transfer else (account_id, 10)
+                    bank.save_accounts(accounts, *post(accounts, *args))
+            except bank.BankingError:
+                pass
+    
+    print(f'{n:,} accounts x {transactions} transactions ({bank.STORAGE_BACKEND} store)', flush=True)
+    measure('save_accounts', lambda: bank.save_accounts(accounts), n)
+    bank.close_journal()
+    file_size=store_size()
+    del accounts
+    gc.collect()
+    loaded={}
+    measure('load_data', lambda: loaded.update(accounts=bank.load_data()), n)
+    accounts=loaded['accounts']
+    
+    rng=random.Random(15)
+    ids=sorted(accounts)
+    pairs=[(rng.choice(ids), rng.choice(ids)) for _ in range(operations)]
+    sample=[account_id for account_id, _ in pairs]
+    measure('deposit', lambda: post_all(bank.post_deposit, pairs), operations)
+    measure('withdraw', lambda: post_all(bank.post_withdrawal, pairs), operations)
+    measure('transfer_money', lambda: post_all(bank.post_transfer, pairs), operations)
+    measure('predict_balance', lambda: [bank.predicted_balance(accounts[account_id]) for account_id in sample], operations)
+    measure('plot data', lambda: [bank.transaction_flow(accounts[account_id]) for account_id in sample], operations)
+    measure('accounts_table', lambda: bank.accounts_table(accounts), n)
+    bank.close_journal()
+    return {'accounts': n, 'transactions': n*transactions, 'file_size': file_size, 'peak_rss': peak_rss(), 'operations': results}
+
+#'core [max accounts] [transactions per account] [operations] [results file]'
+def bench_core(max_accounts=100000, transactions=5, operations=2000, output='benchmark-core.json'):
+    report={
+        'benchmark': 'core',
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'backend': bank.STORAGE_BACKEND,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'transactions_per_account': transactions,
+        'runs': []
+    }
+    for n in [size for size in CORE_SIZES if size<=max_accounts] or [max_accounts]:
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            run=pool.apply(core_run, (n, transactions, min(operations, n)))
+        print(f"  file size {run['file_size']/2**20:,.1f} MiB, peak RSS {run['peak_rss']/2**20:,.0f} MiB" if run['peak_rss'] else f"  file size {run['file_size']/2**20:,.1f} MiB")
+        report['runs'].append(run)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
+
+#'compare <old results> <new results>': ops/sec ratios per size and operation, flagging drops of more than 10%.
+def bench_compare(old_path, new_path):
+    with open(old_path) as f:
+        old={run['accounts']: run for run in json.load(f)['runs']}
+    with open(new_path) as f:
+        new={run['accounts']: run for run in json.load(f)['runs']}
+    for n in sorted(old.keys() & new.keys()):
+        print(f'{n:,} accounts')
+        for name, result in new[n]['operations'].items():
+            before=old[n]['operations'].get(name)
+            if before is None:
+                continue
+            ratio=result['ops_per_sec']/before['ops_per_sec']
+            print(f"  {name:<20}{before['ops_per_sec']:14,.0f}/s -> {result['ops_per_sec']:14,.0f}/s  x{ratio:.2f}{'  SLOWER' if ratio<0.9 else ''}")
+        for key in ('file_size', 'peak_rss'):
+            if old[n].get(key) and new[n].get(key):
+                print(f"  {key:<20}{old[n][key]/2**20:12,.1f} MiB -> {new[n][key]/2**20:12,.1f} MiB")
+
+#Cold start in a fresh interpreter: importing the module, load_data, and reading the one account a user signs in to.
+#Runs with the snapshot index and again without it (the full parse every start used to do), best of a few runs each.
+STARTUP_SCRIPT='''
+import json, time
+started=time.perf_counter()
+import Bank_Management_Project as bank
+imported=time.perf_counter()
+accounts=bank.load_data()
+loaded=time.perf_counter()
+balance=accounts['0001']['Balance']
+print(json.dumps({'import': imported-started, 'load_data': loaded-imported, 'first_account': time.perf_counter()-loaded}))
+'''
+
+def startup_run(repeat):
+    best=None
+    for _ in range(repeat):
+        started=time.perf_counter()
+        output=subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        run=json.loads(output.strip().splitlines()[-1])
+        run['total']=time.perf_counter()-started
+        if best is None or run['total']<best['total']:
+            best=run
+    return best
+
+def bench_startup(n=100000, transactions=5, repeat=3):
+    bank.save_accounts(synthetic_accounts(n, transactions))
+    print(f'Startup with {n:,} accounts of {transactions} transactions ({bank.STORAGE_BACKEND} store, {os.path.getsize(bank.file_path)/2**20:,.1f} MiB snapshot)' if bank.STORAGE_BACKEND=='json' else f'Startup with {n:,} accounts ({bank.STORAGE_BACKEND} store)')
+    runs=[('indexed', startup_run(repeat))]
+    if os.path.exists(bank.index_path):
+        os.rename(bank.index_path, bank.index_path+'.off')
+        try:
+            runs.append(('full parse', startup_run(repeat)))
+        finally:
+            os.rename(bank.index_path+'.off', bank.index_path)
+    for label, run in runs:
+        print(f"{label:<12} import {run['import']*1000:7.1f} ms, load_data {run['load_data']*1000:8.1f} ms, first account {run['first_account']*1000:6.2f} ms, process {run['total']*1000:8.1f} ms")
+    started=time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import matplotlib.pyplot'], check=True)
+    print(f'matplotlib.pyplot, now imported only by plot_transaction_history: {(time.perf_counter()-started)*1000:,.0f} ms')
+
+#JSON against binary snapshots of the same book: writing, size, a cold start, random reads and decoding everything.
+def bench_snapshot(n=100000, transactions=5, reads=10000):
+    accounts=to_columns(synthetic_accounts(n, transactions))
+    sample=random.Random(1).sample(list(accounts), min(reads, n))
+    print(f'Snapshots of {n:,} accounts with {transactions} transactions each')
+    for snapshot_format in ('json', 'binary'):
+        timed(f'write {snapshot_format}', bank.write_snapshot, accounts, snapshot_format, count=n)
+        path=bank.binary_path if snapshot_format=='binary' else bank.file_path
+        run=startup_run(3)
+        print(f"  {os.path.getsize(path)/2**20:,.1f} MiB, cold start {run['total']*1000:,.0f} ms (load_data {run['load_data']*1000:,.0f} ms)")
+        opened=bank.load_data()
+        timed('random reads', lambda: [opened.peek(account_id) for account_id in sample], count=len(sample))
+        timed('decode all', lambda: [opened.peek(account_id) for account_id in opened], count=n)
+        if snapshot_format=='binary':
+            timed('record reads', lambda: [opened.record(account_id) for account_id in sample], count=len(sample))
+
+#The portfolio report from a freshly opened store, with a growing number of worker processes.
+#Every run has to give the same rows as the single-process one.
+def bench_report(n=200000, transactions=5, max_workers=None):
+    bank.save_accounts(synthetic_accounts(n, transactions))
+    max_workers=max_workers or os.cpu_count() or 1
+    print(f'Portfolio report over {n:,} accounts ({bank.STORAGE_BACKEND} store, {os.cpu_count()} CPUs)')
+    expected=None
+    workers=1
+    while True:
+        rows=timed(f'{workers} worker(s)', lambda: bank.portfolio_report(bank.load_data(), workers), count=n)
+        expected=expected or rows
+        if rows!=expected:
+            print('FAILED: the report differs from the single-process one')
+            sys.exit(1)
+        if workers>=max_workers:
+            break
+        workers=min(workers*2, max_workers)
+    print(bank.report_summary(expected))
+
+#Monthly loan servicing over a large book where only some accounts have loans: opening the store and
+#posting the installments that fell due should cost about the same whatever the total number of accounts.
+def bench_loans(n=200000, borrowers=2000, transactions=5):
+    accounts=synthetic_accounts(n, transactions)
+    start=int(datetime(2024, 1, 1).timestamp())
+    for account_id in random.Random(7).sample(list(accounts), min(borrowers, n)):
+        account=accounts[account_id]
+        schedule=bank.amortization_schedule(1000, 5, account['Currency'], start)
+        account['Balance']+=1000
+        account['Loan records']=[{'id': 1, 'principal': 1000, 'rate': bank.LOAN_INTEREST_RATE, 'years': 5, 'start': start,
+                                  'payment': schedule[0][1], 'schedule': schedule, 'next': 0, 'credit': 0}]
+        account['Loans']=bank.loan_outstanding(account['Loan records'][0], account['Currency'])
+    bank.write_snapshot(accounts)
+    now=schedule[2][0]
+    print(f'Loan installments over {n:,} accounts, {min(borrowers, n):,} with loans')
+    opened=timed('load_data', bank.load_data)
+    totals, posted, unpaid=timed('post_due_installments', bank.post_due_installments, opened, now, count=min(borrowers, n)*3)
+    print(f'  {posted:,} installments posted, {unpaid:,} unpaid, {len(bank.loan_due_index):,} loans still running')
+
+#The store split into shards: compacting after a change only rewrites the shard it touched, and transfers between
+#accounts of different shards pay for the two-phase commit that same-shard ones do not need.
+def bench_shards(n=100000, shards=4, transfers=2000, transactions=5):
+    reset_store()
+    bank.save_accounts(synthetic_accounts(n, transactions, currency='USD'))
+    print(f'Shards over {n:,} accounts with {transactions} transactions each')
+    for count in (1, shards):
+        if count>1:
+            bank.reshard_command(count)
+        accounts=bank.load_data()
+        ids=list(accounts)
+        timed(f'{count} shard(s): compact one', bank.compact_store, accounts, bank.SHARDS[bank.shard_number(ids[0])])
+        rng=random.Random(count)
+        pairs={True: [], False: []}
+        while min(len(pairs[True]), len(pairs[False]) if count>1 else transfers)<transfers:
+            sender, recipient=rng.sample(ids, 2)
+            pairs[bank.shard_number(sender)==bank.shard_number(recipient)].append((sender, recipient))
+        for same in (True, False) if count>1 else (True,):
+            def run():
+                for sender, recipient in pairs[same][:transfers]:
+                    try:
+                        with bank.account_transaction(accounts, sender, recipient):
+                            bank.save_accounts(accounts, *bank.post_transfer(accounts, sender, recipient, 1))
+                    except bank.BankingError:
+                        pass
+            timed(f"  {'same-shard' if same else 'cross-shard'} transfers", run, count=transfers)
+        bank.close_journal()
+    bank.reshard_command(1)
+
+#A book with years of history before and after 'archive': the size of what every load and compaction goes
+#through, against the cost of reaching back into the archive when a query asks for it.
+def bench_archive(n=20000, transactions=200, years=3):
+    reset_store()
+    rng=random.Random(5)
+    now=bank.now_timestamp()
+    step=years*365*86400//transactions
+    accounts=synthetic_accounts(n, 0, currency='USD')
+    for account in accounts.values():
+        account['Transactions']=bank.TransactionColumns({'type': rng.choice(['Deposit', 'Withdrawal']), 'amount': round(rng.uniform(10, 1000), 2), 'timestamp': now-(transactions-j)*step} for j in range(transactions))
+    bank.save_accounts(accounts)
+    sample=random.Random(1).sample(list(accounts), min(1000, n))
+    print(f'Archive of {n:,} accounts with {transactions} transactions over {years} years (older than {bank.ARCHIVE_AFTER_DAYS} days archived)')
+    for label in ('live', 'archived'):
+        if label=='archived':
+            moved, changed=timed('archive', lambda: bank.archive_transactions(bank.load_data(), now-bank.ARCHIVE_AFTER_DAYS*86400))
+            print(f'  {moved:,} transactions moved from {changed:,} accounts')
+        opened=bank.load_data()
+        print(f'{label}: {store_size()/2**20:,.1f} MiB store')
+        timed('  decode all', lambda: [opened[account_id] for account_id in opened], count=n)
+        timed('  compact', bank.compact_journal, opened)
+        timed('  first page', lambda: [list(bank.iter_transactions(opened[account_id], 0, bank.TRANSACTIONS_PAGE_SIZE)) for account_id in sample], count=len(sample))
+        timed('  whole history', lambda: [sum(1 for txn in bank.transactions_from(opened[account_id], 0)) for account_id in sample], count=len(sample))
+
+#The balance at moment worked out from the whole history, as it had to be done before checkpoints.
+def replayed_balance(account, moment):
+    currency=account['Currency']
+    txns=list(bank.transactions_from(account, 0))
+    units=bank.to_minor(account['Balance'], currency)-sum(bank.signed_minor(txn, currency) for txn in txns)
+    for txn in txns:
+        if bank.transaction_timestamp(txn)>moment:
+            break
+        units+=bank.signed_minor(txn, currency)
+    return bank.from_minor(units, currency)
+
+#Point-in-time balances and month-end statements from the checkpoints, against replaying the history.
+def bench_balances(n=20000, transactions=200, years=3, lookups=10000):
+    reset_store()
+    rng=random.Random(5)
+    now=bank.now_timestamp()
+    step=years*365*86400//transactions
+    accounts=synthetic_accounts(n, 0, currency='USD')
+    for account in accounts.values():
+        account['Transactions']=bank.TransactionColumns({'type': rng.choice(['Deposit', 'Withdrawal']), 'amount': round(rng.uniform(10, 1000), 2), 'timestamp': now-(transactions-j)*step} for j in range(transactions))
+    bank.save_accounts(accounts)
+    before=store_size()
+    print(f'Balance checkpoints for {n:,} accounts with {transactions} transactions over {years} years')
+    timed('rebuild-balances', bank.rebuild_all_balances)
+    print(f'  store {before/2**20:,.1f} -> {store_size()/2**20:,.1f} MiB')
+    opened=bank.load_data()
+    ids=list(opened)
+    queries=[(rng.choice(ids), now-rng.randrange(years*365*86400)) for i in range(lookups)]
+    sample=queries[:max(1, lookups//100)]
+    timed('decode all', lambda: [opened[account_id] for account_id in ids], count=n)
+    timed('balance at, replayed', lambda: [replayed_balance(opened[account_id], moment) for account_id, moment in sample], count=len(sample))
+    timed('balance at, checkpoints', lambda: [bank.balance_at(opened[account_id], moment) for account_id, moment in queries], count=lookups)
+    month=bank.timestamp_month(now//86400-40)
+    timed(f'statements {month}', bank.statements_command, month, os.path.join(bank.directory, 'statements.csv'), count=n)
+    timed('deposits', lambda: [bank.post_deposit(opened, account_id, 10) for account_id, moment in queries], count=lookups)
+
+#OTP round trips and authenticated service calls.
+def bench_sessions(n=1000, requests=20000):
+    reset_store()
+    accounts=synthetic_accounts(n, currency='USD')
+    bank.save_accounts(accounts)
+    accounts=bank.load_data()
+    rng=random.Random(3)
+    ids=[rng.choice(list(accounts)) for i in range(requests)]
+    print(f'OTPs and sessions over {n:,} accounts, {requests:,} requests')
+    before=store_size()
+    timed('otp send and verify', lambda: [bank.redeem_otp(accounts, account_id, bank.issue_otp(accounts, account_id)) for account_id in ids], count=requests)
+    print(f'  {store_size()-before:,} bytes stored')
+    sessions={account_id: bank.service_login(accounts, {'account_id': account_id, 'pin': '1234'})['session'] for account_id in set(ids)}
+    timed('balance with pin', lambda: [bank.service_balance(accounts, {'account_id': account_id, 'pin': '1234'}) for account_id in ids], count=requests)
+    timed('balance with session', lambda: [bank.service_balance(accounts, {'session': sessions[account_id]}) for account_id in ids], count=requests)
+
+#Deposits with the account event stream on and off, and how fast a consumer reads the stream back.
+def bench_events(n=10000, operations=20000):
+    rng=random.Random(9)
+    print(f'Event stream over {n:,} accounts, {operations:,} deposits each way ({bank.STORAGE_BACKEND} store)')
+    for enabled in (False, True):
+        reset_store()
+        accounts=synthetic_accounts(n, currency='USD')
+        bank.save_accounts(accounts)
+        accounts=bank.load_data()
+        ids=[rng.choice(list(accounts)) for i in range(operations)]
+        bank.EVENTS_ENABLED=enabled
+        def deposits():
+            for account_id in ids:
+                with bank.account_transaction(accounts, account_id):
+                    bank.save_accounts(accounts, *bank.post_deposit(accounts, account_id, 10))
+        timed(f"deposits, events {'on' if enabled else 'off'}", deposits, count=operations)
+    print(f'  {os.path.getsize(bank.events_path):,} bytes of events')
+    timed('read events', lambda: sum(1 for event in bank.read_events()), count=operations)
+
+BENCHMARKS={
+    'interest': bench_interest,
+    'ingest': bench_ingest,
+    'stress': bench_stress,
+    'service': bench_service,
+    'money': bench_money,
+    'memory': bench_memory,
+    'core': bench_core,
+    'startup': bench_startup,
+    'snapshot': bench_snapshot,
+    'report': bench_report,
+    'loans': bench_loans,
+    'shards': bench_shards,
+    'archive': bench_archive,
+    'balances': bench_balances,
+    'sessions': bench_sessions,
+    'events': bench_events,
+    'compare': bench_compare
+}
+
+if __name__ == "__main__":
+    if len(sys.argv)<2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Usage: python benchmark.py <{'|'.join(BENCHMARKS)}> [arguments]")
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](*(int(arg) if arg.isdigit() else arg for arg in sys.argv[2:]))
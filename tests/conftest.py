@@ -0,0 +1,57 @@
+import os, sys, tempfile
+import pytest
+
+#The module picks its data directory at import time, so point it somewhere harmless before any test imports it.
+os.environ.setdefault('BANK_DATA_DIR', tempfile.mkdtemp(prefix='bank-tests-'))
+os.environ['BANK_STORAGE_BACKEND']='json'
+os.environ['BANK_SNAPSHOT_FORMAT']='json'
+os.environ['BANK_EVENTS']='0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Bank_Management_Project as bank
+
+#Each test gets its own unsharded json store, with every other file the module writes in the same directory.
+#restart() stands in for a new process opening the same files.
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(bank, 'ids_path', str(tmp_path/'accounts.ids'))
+    monkeypatch.setattr(bank, 'transfers_path', str(tmp_path/'transfers.log'))
+    monkeypatch.setattr(bank, 'events_path', str(tmp_path/'events.log'))
+    monkeypatch.setattr(bank, 'archive_directory', str(tmp_path/'archive'))
+    monkeypatch.setattr(bank, 'OTP_OUTBOX', str(tmp_path/'otp.outbox'))
+    monkeypatch.setattr(bank, 'JOURNAL_COMPACT_AT', 10**9)
+    shards=list(bank.SHARDS)
+    bank.SHARDS[:]=[bank.json_store(str(tmp_path))]
+    yield bank.SHARDS[0]
+    bank.close_journal()
+    bank.SHARDS[:]=shards
+
+#The same, with the accounts in a SQLite database of their own. The json store stays in place for the migrator.
+@pytest.fixture
+def sqlite_store(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(bank, 'db_path', str(tmp_path/'accounts.db'))
+    monkeypatch.setattr(bank, 'STORAGE_BACKEND', 'sqlite')
+    bank._sqlite.conn=None
+    yield bank.db_path
+    if bank._sqlite.conn is not None:
+        bank._sqlite.conn.close()
+    bank._sqlite.conn=None
+
+def restart():
+    bank.close_journal()
+    bank.SHARDS[:]=[bank.json_store(os.path.dirname(store['file_path']), store['number']) for store in bank.SHARDS]
+    return bank.load_data()
+
+def open_accounts(n=2, currency='USD', balance=100):
+    accounts=bank.load_data()
+    ids=[bank.open_account(accounts, f'Holder {i}', currency, 'savings', balance, '1234', 'q', 'a') for i in range(n)]
+    return accounts, ids
+
+#Runs one of the post_* functions on the given accounts and stores its changes, as the menu and the service do.
+def post(accounts, account_ids, function, *args):
+    with bank.account_transaction(accounts, *account_ids):
+        bank.save_accounts(accounts, *function(accounts, *account_ids, *args))
+
+def deposit(accounts, account_id, amount):
+    with bank.account_transaction(accounts, account_id):
+        bank.save_accounts(accounts, *bank.post_deposit(accounts, account_id, amount))
@@ -0,0 +1,68 @@
+import os
+import Bank_Management_Project as bank
+from conftest import restart, open_accounts, deposit
+
+DAY=86400
+
+#Two accounts opened 410 days ago and compacted into the snapshot, then deposits to the first 400, 390 and 300 days
+#ago in the journal: four transactions are past ARCHIVE_AFTER_DAYS, three of the first account's and the second's
+#opening deposit.
+def old_accounts(monkeypatch):
+    now=bank.now_timestamp()
+    with monkeypatch.context() as m:
+        m.setattr(bank, 'now_timestamp', lambda: now-410*DAY)
+        accounts, ids=open_accounts()
+        bank.compact_journal(accounts)
+        for age in (400, 390, 300):
+            m.setattr(bank, 'now_timestamp', lambda: now-age*DAY)
+            deposit(accounts, ids[0], 10)
+    return accounts, ids
+
+def history(account):
+    return list(bank.transactions_from(account, 0))
+
+def test_archive_moves_old_transactions_and_reads_them_back(store, monkeypatch):
+    accounts, (first, second)=old_accounts(monkeypatch)
+    deposit(accounts, first, 5)
+    before=history(accounts[first])
+    moved, changed=bank.archive_transactions(accounts, bank.now_timestamp()-bank.ARCHIVE_AFTER_DAYS*DAY)
+    assert (moved, changed)==(4, 2)
+    assert len(accounts[first]['Transactions'])==len(before)-3
+    assert accounts[first]['Archived']['Count']==3
+    assert os.listdir(bank.archive_directory)
+    accounts=restart()
+    assert bank.transaction_count(accounts[first])==len(before)
+    assert history(accounts[first])==before
+    assert list(bank.newest_transactions(accounts[first]))==before[::-1]
+    assert accounts[first]['Balance']==135
+
+def test_journal_after_archive_appends_at_logical_positions(store, monkeypatch):
+    accounts, (first, second)=old_accounts(monkeypatch)
+    bank.archive_transactions(accounts, bank.now_timestamp()-bank.ARCHIVE_AFTER_DAYS*DAY)
+    deposit(accounts, first, 7)
+    before=history(accounts[first])
+    accounts=restart()
+    assert history(accounts[first])==before
+    assert accounts[first]['Balance']==137
+
+#The archive's full save writes the snapshot and then starts a new journal. A process that stops in between leaves
+#the old journal next to the archived snapshot, and replaying it must not add the transactions a second time.
+def test_crash_between_archived_snapshot_and_new_journal(store, monkeypatch):
+    accounts, (first, second)=old_accounts(monkeypatch)
+    deposit(accounts, first, 5)
+    deposit(accounts, second, 1)
+    before={account_id: history(accounts[account_id]) for account_id in (first, second)}
+    class Crash(Exception):
+        pass
+    def crash(store):
+        raise Crash()
+    with monkeypatch.context() as m:
+        m.setattr(bank, 'sync_journal', crash)
+        try:
+            bank.archive_transactions(accounts, bank.now_timestamp()-bank.ARCHIVE_AFTER_DAYS*DAY)
+        except Crash:
+            pass
+    accounts=restart()
+    assert accounts[first]['Archived']['Count']==3
+    assert {account_id: history(accounts[account_id]) for account_id in (first, second)}==before
+    assert accounts[first]['Balance']==135 and accounts[second]['Balance']==101
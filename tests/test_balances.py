@@ -0,0 +1,62 @@
+import calendar
+import pytest
+import Bank_Management_Project as bank
+from conftest import restart, open_accounts, post
+
+HOUR=3600
+MARCH=calendar.timegm((2025, 3, 1, 0, 0, 0))
+
+#One account opened with 100 at the start of March 2025, then: +50 on March 1st 10:00, -30 at 15:00,
+#+20 on March 3rd 09:00 and -5 on April 2nd 12:00.
+@pytest.fixture
+def history(store, monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(bank, 'now_timestamp', lambda: MARCH)
+        accounts, (account_id, other)=open_accounts()
+        for when, function, amount in ((MARCH+10*HOUR, bank.post_deposit, 50), (MARCH+15*HOUR, bank.post_withdrawal, 30),
+                                       (MARCH+57*HOUR, bank.post_deposit, 20), (MARCH+32*24*HOUR+12*HOUR, bank.post_withdrawal, 5)):
+            m.setattr(bank, 'now_timestamp', lambda: when)
+            post(accounts, [account_id], function, amount)
+    return accounts, account_id
+
+EXPECTED=[(MARCH-1, 0), (MARCH, 100), (MARCH+10*HOUR-1, 100), (MARCH+10*HOUR, 150), (MARCH+20*HOUR, 120),
+          (MARCH+48*HOUR, 120), (MARCH+60*HOUR, 140), (MARCH+40*24*HOUR, 135)]
+
+def test_balance_at_any_moment(history):
+    accounts, account_id=history
+    assert [bank.balance_at(accounts[account_id], moment) for moment, balance in EXPECTED]==[balance for moment, balance in EXPECTED]
+
+def test_checkpoints_are_one_per_day(history):
+    accounts, account_id=history
+    index=bank.balance_checkpoints(accounts[account_id])
+    assert index['Days']==[MARCH//86400, MARCH//86400+2, MARCH//86400+32]
+    assert index['Through']==[3, 4, 5]
+
+def test_checkpoints_are_rebuilt_after_a_restart(history):
+    accounts, account_id=history
+    accounts=restart()
+    assert [bank.balance_at(accounts[account_id], moment) for moment, balance in EXPECTED]==[balance for moment, balance in EXPECTED]
+
+def test_undone_transaction_drops_its_checkpoint(history):
+    accounts, account_id=history
+    with pytest.raises(bank.BankingError):
+        with bank.account_transaction(accounts, account_id):
+            bank.post_deposit(accounts, account_id, 1000)
+            raise bank.BankingError('undone')
+    assert accounts[account_id]['Balance']==135
+    assert bank.balance_at(accounts[account_id], bank.now_timestamp())==135
+
+def test_balance_at_reaches_into_the_archive(history):
+    accounts, account_id=history
+    bank.archive_transactions(accounts, MARCH+30*24*HOUR)
+    assert accounts[account_id]['Archived']['Count']==4
+    accounts=restart()
+    assert [bank.balance_at(accounts[account_id], moment) for moment, balance in EXPECTED]==[balance for moment, balance in EXPECTED]
+
+def test_monthly_statement(history):
+    accounts, account_id=history
+    rows={row['Account ID']: row for row in bank.statement_rows(accounts, '2025-03')}
+    assert rows[account_id]['Opening balance']==0 and rows[account_id]['Closing balance']==140
+    assert rows[account_id]['Transactions']==4
+    april=next(row for row in bank.statement_rows(accounts, '2025-04') if row['Account ID']==account_id)
+    assert (april['Opening balance'], april['Closing balance'], april['Net change'])==(140, 135, -5)
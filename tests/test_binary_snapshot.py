@@ -0,0 +1,61 @@
+import os
+import Bank_Management_Project as bank
+from conftest import restart, open_accounts, post, deposit
+
+def plain(accounts):
+    return {account_id: {k: list(v) if k=='Transactions' else v for k, v in accounts[account_id].items()} for account_id in accounts}
+
+def test_binary_snapshot_round_trip(store, monkeypatch):
+    accounts, (first, second, third)=open_accounts(3)
+    deposit(accounts, first, 25.5)
+    post(accounts, [second], bank.post_withdrawal, 12)
+    post(accounts, [first, second], bank.post_transfer, 40)
+    post(accounts, [third], bank.post_loan, 500, 2)
+    with bank.account_transaction(accounts, third):
+        accounts[third]['Active']=False
+        bank.save_accounts(accounts, bank.journal_entry(accounts, third, 'Active'))
+    expected=plain(accounts)
+    bank.compact_journal(accounts, 'binary')
+    assert os.path.exists(store['binary_path']) and not os.path.exists(store['file_path'])
+    monkeypatch.setattr(bank, 'SNAPSHOT_FORMAT', 'binary')
+    accounts=restart()
+    assert isinstance(accounts, bank.BinaryAccounts)
+    assert plain(accounts)==expected
+    assert bank.account_index.get(expected[third]['Account number']) is None
+
+def test_records_are_read_without_decoding(store, monkeypatch):
+    accounts, (first, second)=open_accounts()
+    deposit(accounts, first, 25)
+    bank.compact_journal(accounts, 'binary')
+    monkeypatch.setattr(bank, 'SNAPSHOT_FORMAT', 'binary')
+    accounts=restart()
+    record=accounts.record(first)
+    assert record['Balance']==125 and record['Active'] is True
+    assert first not in accounts.loaded
+
+def test_journal_replays_over_binary_snapshot(store, monkeypatch):
+    monkeypatch.setattr(bank, 'SNAPSHOT_FORMAT', 'binary')
+    accounts, (first, second)=open_accounts()
+    bank.compact_journal(accounts)
+    deposit(accounts, first, 25)
+    deposit(accounts, first, 5)
+    accounts=restart()
+    assert accounts[first]['Balance']==130
+    assert [txn['amount'] for txn in accounts[first]['Transactions']]==[100, 25, 5]
+
+def test_converting_back_to_json_removes_binary_snapshot(store, monkeypatch):
+    accounts, (first, second)=open_accounts()
+    bank.compact_journal(accounts, 'binary')
+    monkeypatch.setattr(bank, 'SNAPSHOT_FORMAT', 'binary')
+    accounts=restart()
+    bank.compact_journal(accounts, 'json')
+    assert os.path.exists(store['file_path']) and not os.path.exists(store['binary_path'])
+    monkeypatch.setattr(bank, 'SNAPSHOT_FORMAT', 'json')
+    assert restart()[second]['Balance']==100
+
+def test_file_that_is_not_a_snapshot_is_refused(store, monkeypatch, capsys):
+    monkeypatch.setattr(bank, 'SNAPSHOT_FORMAT', 'binary')
+    with open(store['binary_path'], 'wb') as f:
+        f.write(bytes(bank.BINARY_HEADER.size))
+    assert restart()=={}
+    assert 'not a binary accounts snapshot' in capsys.readouterr().out
@@ -0,0 +1,84 @@
+import json, os
+import pytest
+import Bank_Management_Project as bank
+from conftest import open_accounts, post, deposit
+
+#The event stream is off for the other tests; here it is on, with the stream's state reset around each test.
+@pytest.fixture
+def events(store, monkeypatch):
+    bank.close_events()
+    monkeypatch.setattr(bank, 'EVENTS_ENABLED', True)
+    yield lambda offset=0: [event for event, next_offset in bank.read_events(offset)]
+    bank.close_events()
+
+def test_every_stored_change_is_published_in_order(events):
+    accounts, (first, second)=open_accounts()
+    deposit(accounts, first, 25)
+    post(accounts, [first, second], bank.post_transfer, 10)
+    with bank.account_transaction(accounts, second):
+        accounts[second]['Active']=False
+        bank.save_accounts(accounts, bank.journal_entry(accounts, second, 'Active'))
+    stream=events()
+    assert [event['seq'] for event in stream]==list(range(1, 7))
+    assert [(event['account'], event['event']) for event in stream]==[(first, 'opened'), (second, 'opened'), (first, 'transactions'),
+                                                                      (first, 'transactions'), (second, 'transactions'), (second, 'deactivated')]
+    assert [event['version'] for event in stream if event['account']==first]==[accounts[first]['Version']-2, accounts[first]['Version']-1, accounts[first]['Version']]
+    assert stream[2]['position']==1 and stream[2]['transactions'][0]['amount']==25 and stream[2]['fields']=={'Balance': 125, 'USD amount': 125}
+    assert stream[0]['position']==0 and len(stream[0]['transactions'])==1
+
+def test_secrets_are_never_published(events):
+    accounts, (first, second)=open_accounts()
+    bank.issue_otp(accounts, first)
+    token=bank.issue_reset_token(first)
+    with open(bank.OTP_OUTBOX) as f:
+        bank.redeem_otp(accounts, first, json.loads(f.readlines()[-1])['otp'])
+    bank.reset_pin(accounts, token, '9876')
+    with open(bank.events_path) as f:
+        data=f.read()
+    assert '1234' not in data and '9876' not in data and 'Security' not in data
+    assert events()[-1]['changed']==['PIN'] and events()[-1]['fields']=={}
+
+def test_refused_changes_are_not_published(events):
+    accounts, (first, second)=open_accounts()
+    with pytest.raises(bank.BankingError):
+        post(accounts, [first], bank.post_withdrawal, 1000)
+    assert len(events())==2
+
+def test_sequence_carries_on_after_a_torn_line(events):
+    accounts, (first, second)=open_accounts()
+    bank.close_events()
+    with open(bank.events_path, 'ab') as f:
+        f.write(b'{"seq": 3, "acc')
+    deposit(accounts, first, 5)
+    assert [event['seq'] for event in events()]==[1, 2, 3]
+
+def test_reading_resumes_from_an_offset(events):
+    accounts, (first, second)=open_accounts()
+    deposit(accounts, first, 5)
+    offsets=[offset for event, offset in bank.read_events()]
+    assert [event['seq'] for event in events(offsets[0])]==[2, 3]
+    assert events(offsets[-1])==[]
+    with pytest.raises(ValueError):
+        events(offsets[0]+1)
+
+def test_named_consumer_starts_where_it_stopped(events, monkeypatch, capsys, tmp_path):
+    monkeypatch.setattr(bank, 'directory', str(tmp_path))
+    accounts, (first, second)=open_accounts()
+    capsys.readouterr()
+    bank.events_command('--consumer', 'audit')
+    assert [json.loads(line)['seq'] for line in capsys.readouterr().out.splitlines()]==[1, 2]
+    deposit(accounts, first, 5)
+    bank.events_command('--consumer', 'audit')
+    printed=[json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [event['seq'] for event in printed]==[3]
+    assert printed[0]['next']==os.path.getsize(bank.events_path)
+
+def test_positions_count_archived_transactions(events, monkeypatch):
+    now=bank.now_timestamp()
+    with monkeypatch.context() as m:
+        m.setattr(bank, 'now_timestamp', lambda: now-400*86400)
+        accounts, (first, second)=open_accounts()
+        deposit(accounts, first, 5)
+    bank.archive_transactions(accounts, now-365*86400)
+    deposit(accounts, first, 7)
+    assert events()[-1]['position']==2==bank.transaction_count(accounts[first])-1
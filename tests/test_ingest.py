@@ -0,0 +1,57 @@
+import csv, json
+import pytest
+import Bank_Management_Project as bank
+from conftest import restart, open_accounts, post
+
+@pytest.fixture
+def book(store):
+    accounts, (first, second)=open_accounts()
+    post(accounts, [second], bank.post_loan, 1000, 1)
+    bank.compact_journal(accounts)
+    return accounts, first, second
+
+def results(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+def test_csv_batch_is_applied_in_one_save(book, tmp_path, capsys):
+    accounts, first, second=book
+    path=tmp_path/'operations.csv'
+    with open(path, 'w', newline='') as f:
+        writer=csv.writer(f)
+        writer.writerows([['operation', 'account', 'amount', 'currency', 'recipient'],
+                          ['deposit', first, '50', '', ''],
+                          ['withdraw', accounts[first]['Account number'], '20', '', ''],
+                          ['transfer', first, '30', '', accounts[second]['Account number']],
+                          ['Loan Payment', second, '100', '', ''],
+                          ['deposit', first, '95', 'EUR', ''],
+                          ['withdraw', first, '10000', '', ''],
+                          ['refund', first, '5', '', ''],
+                          ['deposit', '9999', '5', '', ''],
+                          ['deposit', first, 'lots', '', '']])
+    bank.ingest_command(str(path))
+    assert 'Applied 5 of 9 operations' in capsys.readouterr().out
+    rows=results(str(path)+'.results.csv')
+    assert [row['status'] for row in rows]==['ok']*5+['rejected']*4
+    assert [row['balance'] for row in rows[:5]]==['150.0', '130.0', '100.0', '1030.0', '200.0']
+    assert rows[6]['message']=="Unknown operation 'refund'."
+    assert rows[7]['message']=='Account not found.'
+    with open(bank.SHARDS[0]['journal_path'], 'rb') as f:
+        assert len(f.read().splitlines())==2
+    accounts=restart()
+    assert accounts[first]['Balance']==200 and accounts[second]['Balance']==1030
+    assert [txn['type'] for txn in accounts[first]['Transactions']][1:]==['Deposit', 'Withdrawal', 'Transfer Out', 'Deposit']
+    assert accounts[second]['Loan records'][0]['credit']==100
+    assert accounts[second]['Loans']==bank.loan_outstanding(accounts[second]['Loan records'][0], 'USD')
+
+def test_jsonl_batch_with_custom_results_file(book, tmp_path):
+    accounts, first, second=book
+    path=tmp_path/'operations.jsonl'
+    with open(path, 'w') as f:
+        for operation in ({'operation': 'deposit', 'account': first, 'amount': 5}, {'operation': 'transfer', 'account': second, 'amount': 1, 'recipient': 'nobody'}):
+            f.write(json.dumps(operation)+'\n')
+        f.write('\n')
+    bank.ingest_command(str(path), str(tmp_path/'out.csv'))
+    rows=results(str(tmp_path/'out.csv'))
+    assert [(row['status'], row['message']) for row in rows]==[('ok', ''), ('rejected', 'Recipient account not found.')]
+    assert restart()[first]['Balance']==105
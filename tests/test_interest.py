@@ -0,0 +1,53 @@
+import pytest
+import Bank_Management_Project as bank
+from conftest import restart
+
+pytest.importorskip('numpy')
+
+#A savings and a checking account in USD, and a savings account in yen, each opened with 1200.
+@pytest.fixture
+def book(store):
+    accounts=bank.load_data()
+    ids=[bank.open_account(accounts, name, currency, kind, 1200, '1234', 'q', 'a')
+         for name, currency, kind in (('Saver', 'USD', 'savings'), ('Spender', 'USD', 'checking'), ('Yen saver', 'JPY', 'savings'))]
+    return accounts, ids
+
+def test_monthly_share_of_the_annual_rate(book):
+    accounts, (saver, spender, yen)=book
+    assert bank.apply_interest_to_all(accounts)=={'JPY': 4, 'USD': 6}
+    assert [accounts[account_id]['Balance'] for account_id in (saver, spender, yen)]==[1204, 1202, 1204]
+    assert accounts[saver]['Transactions'][-1]['type']=='Interest'
+    assert all(accounts[account_id]['Interest period']==bank.interest_period() for account_id in (saver, spender, yen))
+
+def test_credited_once_per_period(book, monkeypatch):
+    accounts, (saver, spender, yen)=book
+    bank.apply_interest_to_all(accounts)
+    accounts=restart()
+    assert bank.apply_interest_to_all(accounts)=={}
+    assert accounts[saver]['Balance']==1204
+    monkeypatch.setattr(bank, 'interest_period', lambda moment=None: '2099-01')
+    bank.apply_interest_to_all(accounts)
+    assert restart()[saver]['Balance']==round(1204+1204*0.04/12, 2)
+
+def test_dry_run_changes_nothing(book):
+    accounts, (saver, spender, yen)=book
+    assert bank.apply_interest_to_all(accounts, dry_run=True)=={'JPY': 4, 'USD': 6}
+    assert accounts[saver]['Balance']==1200 and 'Interest period' not in accounts[saver]
+    assert restart()[saver]['Balance']==1200
+
+def test_inactive_accounts_earn_nothing(book):
+    accounts, (saver, spender, yen)=book
+    with bank.account_transaction(accounts, spender):
+        accounts[spender]['Active']=False
+        bank.save_accounts(accounts, bank.journal_entry(accounts, spender, 'Active'))
+    assert bank.apply_interest_to_all(accounts)=={'JPY': 4, 'USD': 4}
+    assert accounts[spender]['Balance']==1200
+
+#The menu's interest option and the batch job share the period, so the account is credited once between them.
+def test_menu_and_batch_job_credit_once(book):
+    accounts, (saver, spender, yen)=book
+    bank.calculate_annual_interest(saver, accounts)
+    bank.calculate_annual_interest(saver, accounts)
+    assert accounts[saver]['Balance']==1204
+    assert bank.apply_interest_to_all(accounts)=={'JPY': 4, 'USD': 2}
+    assert restart()[saver]['Balance']==1204
@@ -0,0 +1,86 @@
+import json, os
+import pytest
+import Bank_Management_Project as bank
+from conftest import restart, open_accounts, deposit
+
+def journal_lines(store):
+    bank.sync_journal(store)
+    with open(store['journal_path'], 'rb') as f:
+        return f.read().splitlines()
+
+def test_replay_restores_journaled_changes(store):
+    accounts, (first, second)=open_accounts()
+    deposit(accounts, first, 25)
+    deposit(accounts, second, 5.5)
+    assert not os.path.exists(store['file_path'])
+    accounts=restart()
+    assert accounts[first]['Balance']==125
+    assert accounts[second]['Balance']==105.5
+    assert len(accounts[first]['Transactions'])==2
+
+def test_replay_over_snapshot_is_idempotent(store):
+    accounts, (first, second)=open_accounts()
+    deposit(accounts, first, 25)
+    bank.write_snapshot(accounts, store=store)
+    deposit(accounts, first, 10)
+    accounts=restart()
+    assert accounts[first]['Balance']==135
+    assert len(accounts[first]['Transactions'])==3
+
+def test_torn_trailing_record_is_cut_off(store, capsys):
+    accounts, (first, second)=open_accounts()
+    deposit(accounts, first, 25)
+    good_size=len(b''.join(line+b'\n' for line in journal_lines(store)))
+    bank.close_journal()
+    with open(store['journal_path'], 'ab') as f:
+        f.write(b'{"changes": [{"id": "')
+    accounts=restart()
+    assert 'incomplete journal record' in capsys.readouterr().out
+    assert accounts[first]['Balance']==125
+    assert os.path.getsize(store['journal_path'])==good_size
+    deposit(accounts, first, 1)
+    assert restart()[first]['Balance']==126
+
+def test_compaction_folds_journal_into_snapshot(store):
+    accounts, (first, second)=open_accounts()
+    deposit(accounts, first, 25)
+    generation=store['journal']['generation']
+    bank.compact_journal(accounts)
+    lines=journal_lines(store)
+    assert len(lines)==1 and json.loads(lines[0])['generation']!=generation
+    assert store['journal']['records']==0
+    with open(store['file_path']) as f:
+        assert json.load(f)[first]['Balance']==125
+    assert restart()[first]['Balance']==125
+
+def test_catch_up_reloads_after_another_process_compacts(store):
+    accounts, (first, second)=open_accounts()
+    other_store=bank.json_store(os.path.dirname(store['file_path']))
+    other=bank.load_store(other_store)
+    bank.SHARDS[:]=[other_store]
+    deposit(other, first, 40)
+    bank.compact_store(other, other_store)
+    deposit(other, first, 2)
+    bank.SHARDS[:]=[store]
+    with bank.store_lock(store):
+        bank.catch_up(accounts, store)
+    assert store['journal']['generation']==other_store['journal']['generation']
+    assert accounts[first]['Balance']==142
+    assert len(accounts[first]['Transactions'])==3
+
+def test_prepared_change_without_decision_is_rolled_back(store):
+    accounts, (first, second)=open_accounts()
+    change={'id': first, 'set': {'Balance': 1000}}
+    bank.append_journal({'prepare': 'tx1', 'shards': [0, 1], 'changes': [change]}, store)
+    accounts=restart()
+    assert accounts[first]['Balance']==100
+    assert json.loads(journal_lines(store)[-1])=={'abort': 'tx1'}
+
+def test_prepared_change_with_decision_is_committed(store):
+    accounts, (first, second)=open_accounts()
+    change={'id': first, 'set': {'Balance': 1000}}
+    bank.append_journal({'prepare': 'tx2', 'shards': [0, 1], 'changes': [change]}, store)
+    bank.record_decision('tx2')
+    accounts=restart()
+    assert accounts[first]['Balance']==1000
+    assert json.loads(journal_lines(store)[-1])=={'commit': 'tx2'}
@@ -0,0 +1,86 @@
+import calendar
+import pytest
+import Bank_Management_Project as bank
+from conftest import restart, open_accounts, post
+
+START=calendar.timegm((2025, 1, 15, 12, 0, 0))
+MONTH=31*86400
+
+def test_schedule_pays_off_the_principal():
+    schedule=bank.amortization_schedule(12000, 1, 'USD', START, rate=0.06)
+    assert len(schedule)==12
+    assert schedule[0][1:3]==[1032.8, 60]
+    assert all(row[1]==1032.8 for row in schedule[:-1])
+    assert round(sum(row[3] for row in schedule), 2)==12000
+    assert schedule[-1][4]==0
+    assert [row[0] for row in schedule]==sorted(row[0] for row in schedule)
+
+def test_schedule_without_interest_splits_evenly():
+    schedule=bank.amortization_schedule(1000, 1, 'USD', START, rate=0)
+    assert [row[1] for row in schedule]==[83.34]*11+[83.26]
+    assert schedule[-1][4]==0
+
+@pytest.fixture
+def loan(store, monkeypatch):
+    monkeypatch.setattr(bank, 'now_timestamp', lambda: START)
+    accounts, (account_id, other)=open_accounts(balance=5000)
+    post(accounts, [account_id], bank.post_loan, 12000, 1)
+    return accounts, account_id
+
+def test_loan_is_credited_with_its_schedule(loan):
+    accounts, account_id=loan
+    account=accounts[account_id]
+    record=account['Loan records'][0]
+    assert account['Balance']==17000
+    assert account['Loans']==bank.loan_outstanding(record, 'USD')==round(sum(row[1] for row in record['schedule']), 2)
+    assert bank.next_loan_due(account)==record['schedule'][0][0]
+    assert restart()[account_id]['Loan records']==account['Loan records']
+
+def test_due_installments_are_taken_from_the_balance(loan):
+    accounts, account_id=loan
+    record=accounts[account_id]['Loan records'][0]
+    totals, posted, unpaid=bank.post_due_installments(accounts, START+3*MONTH)
+    assert (posted, unpaid)==(3, 0)
+    assert totals=={'USD': round(3*record['payment'], 2)}
+    assert record['next']==3
+    accounts=restart()
+    assert accounts[account_id]['Loan records'][0]['next']==3
+    assert accounts[account_id]['Balance']==round(17000-3*record['payment'], 2)
+    assert bank.loan_due_index[account_id]==record['schedule'][3][0]
+
+def test_early_payment_covers_the_next_installments(loan):
+    accounts, account_id=loan
+    record=accounts[account_id]['Loan records'][0]
+    post(accounts, [account_id], bank.post_loan_payment, record['payment'])
+    balance=accounts[account_id]['Balance']
+    totals, posted, unpaid=bank.post_due_installments(accounts, START+MONTH)
+    assert (totals, posted)==({}, 1)
+    assert accounts[account_id]['Balance']==balance
+    assert restart()[account_id]['Loan records'][0]['credit']==0
+
+def test_installment_without_balance_stays_due(loan):
+    accounts, account_id=loan
+    post(accounts, [account_id], bank.post_withdrawal, 16500)
+    totals, posted, unpaid=bank.post_due_installments(accounts, START+MONTH)
+    assert (posted, unpaid)==(0, 1)
+    assert accounts[account_id]['Loan records'][0]['next']==0
+
+def test_paying_off_closes_the_loan(loan):
+    accounts, account_id=loan
+    post(accounts, [account_id], bank.post_loan_payment, accounts[account_id]['Loans'])
+    assert accounts[account_id]['Loans']==0
+    assert bank.next_loan_due(accounts[account_id]) is None
+    assert account_id not in bank.loan_due_index
+
+@pytest.mark.parametrize('amount, years, message', [(12000, bank.MAX_LOAN_YEARS+1, 'duration'), (12000, 0, 'duration'), (0, 1, 'greater than zero'), (10**7, 1, 'credit limit')])
+def test_loan_requests_outside_the_rules_are_refused(store, amount, years, message):
+    accounts, (account_id, other)=open_accounts()
+    with pytest.raises(bank.BankingError, match=message):
+        post(accounts, [account_id], bank.post_loan, amount, years)
+    assert accounts[account_id]['Balance']==100 and 'Loan records' not in accounts[account_id]
+
+def test_payment_above_the_balance_is_refused(loan):
+    accounts, account_id=loan
+    post(accounts, [account_id], bank.post_withdrawal, 16000)
+    with pytest.raises(bank.BankingError, match='Insufficient balance'):
+        post(accounts, [account_id], bank.post_loan_payment, 2000)
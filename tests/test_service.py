@@ -0,0 +1,95 @@
+import asyncio, http.client, json, threading
+import pytest
+import Bank_Management_Project as bank
+
+#The service on a free port, run by its own event loop in a background thread. call() posts one request over a
+#kept-alive connection and returns the status and decoded body.
+@pytest.fixture
+def call(store):
+    for cache in (bank.otp_cache, bank.otp_failures, bank.reset_cache, bank.session_cache):
+        cache.entries.clear()
+    accounts=bank.load_data()
+    loop=asyncio.new_event_loop()
+    server=loop.run_until_complete(asyncio.start_server(lambda reader, writer: bank.handle_connection(reader, writer, accounts), '127.0.0.1', 0))
+    thread=threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    conn=http.client.HTTPConnection('127.0.0.1', server.sockets[0].getsockname()[1], timeout=10)
+    def call(method, params=None, http_method='POST', body=None):
+        conn.request(http_method, f'/{method}', body if body is not None else json.dumps(params or {}), {'Content-Type': 'application/json'})
+        response=conn.getresponse()
+        data=response.read()
+        return response.status, json.loads(data) if response.getheader('Content-Type')=='application/json' else data.decode()
+    yield call
+    conn.close()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.close()
+
+def create(call, name='Holder', pin='1234', balance=100):
+    status, result=call('create_account', {'name': name, 'currency': 'USD', 'initial_balance': balance, 'pin': pin})
+    assert status==200
+    return result['account_id']
+
+def outbox():
+    with open(bank.OTP_OUTBOX) as f:
+        return [json.loads(line) for line in f]
+
+def test_session_calls(call):
+    first, second=create(call), create(call, 'Other')
+    status, login=call('login', {'account_id': first, 'pin': '1234'})
+    assert status==200
+    session={'session': login['session']}
+    assert call('deposit', dict(session, amount=50))==(200, {'account_id': first, 'balance': 150, 'currency': 'USD', 'loans': 0})
+    status, result=call('transfer', dict(session, amount=30, recipient=second))
+    assert status==200 and result['balance']==120
+    status, result=call('balance', {'account_id': second, 'pin': '1234'})
+    assert (status, result['balance'], result['low_balance'])==(200, 130, 130<bank.LOW_BALANCE)
+    status, result=call('transactions', session)
+    assert [txn['type'] for txn in result['transactions']]==['Transfer Out', 'Deposit', 'Deposit']
+    assert call('logout', session)==(200, {'account_id': first, 'logged_out': True})
+    assert call('balance', session)[0]==403
+
+@pytest.mark.parametrize('method, params, http_method, body, status', [
+    ('balance', {'pin': '1234'}, 'POST', None, 400),
+    ('balance', {'account_id': '0001', 'pin': '0000'}, 'POST', None, 403),
+    ('balance', None, 'GET', None, 405),
+    ('nothing', {}, 'POST', None, 404),
+    ('deposit', None, 'POST', b'[1, 2]', 400),
+    ('deposit', {'account_id': '0001', 'pin': '1234', 'amount': -5}, 'POST', None, 400),
+    ('withdraw', {'account_id': '0001', 'pin': '1234', 'amount': 'all'}, 'POST', None, 400)])
+def test_bad_requests_are_refused(call, method, params, http_method, body, status):
+    create(call)
+    assert call(method, params, http_method, body)[0]==status
+    assert call('balance', {'account_id': '0001', 'pin': '1234'})[1]['balance']==100
+
+def test_metrics(call):
+    create(call)
+    status, text=call('metrics', http_method='GET', body='')
+    assert status==200 and 'bank_service_requests_total' in text
+
+#The OTP only leaves through the outbox, and a verified one buys a single PIN reset.
+def test_pin_reset_through_the_outbox(call):
+    account_id=create(call)
+    status, login=call('login', {'account_id': account_id, 'pin': '1234'})
+    assert call('send_otp', {'account_id': account_id})==(200, {'account_id': account_id, 'sent': True})
+    message=outbox()[-1]
+    assert message['account_id']==account_id
+    status, verified=call('verify_otp', {'account_id': account_id, 'otp': message['otp']})
+    assert status==200 and 'PIN' not in json.dumps(verified)
+    assert call('reset_pin', {'reset_token': verified['reset_token'], 'new_pin': '12'})[0]==400
+    assert call('reset_pin', {'reset_token': verified['reset_token'], 'new_pin': '4321'})[0]==200
+    assert call('reset_pin', {'reset_token': verified['reset_token'], 'new_pin': '5555'})[0]==403
+    assert call('balance', {'account_id': account_id, 'pin': '1234'})[0]==403
+    assert call('balance', {'session': login['session']})[0]==403
+    assert call('balance', {'account_id': account_id, 'pin': '4321'})[0]==200
+
+def test_wrong_otps_lock_the_account_out(call):
+    account_id=create(call)
+    for attempt in range(bank.OTP_MAX_FAILURES):
+        call('send_otp', {'account_id': account_id})
+        otp=outbox()[-1]['otp']
+        assert call('verify_otp', {'account_id': account_id, 'otp': otp+1 if otp<999999 else otp-1})[0]==403
+    assert call('send_otp', {'account_id': account_id})[0]==403
+    assert len(outbox())==bank.OTP_MAX_FAILURES
@@ -0,0 +1,83 @@
+import json, os
+import pytest
+import Bank_Management_Project as bank
+from conftest import restart, open_accounts, post
+
+#Two shards under the test's directory, and an account on each.
+@pytest.fixture
+def shards(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(bank, 'shards_path', str(tmp_path/'shards.json'))
+    bank.SHARDS[:]=[bank.json_store(str(tmp_path/f'{number:02}'), number) for number in range(2)]
+    accounts, ids=open_accounts(6)
+    first=next(account_id for account_id in ids if bank.shard_number(account_id)==0)
+    second=next(account_id for account_id in ids if bank.shard_number(account_id)==1)
+    return accounts, first, second
+
+def records(store):
+    bank.sync_journal(store)
+    with open(store['journal_path'], 'rb') as f:
+        return [json.loads(line) for line in f.read().splitlines()[1:]]
+
+def test_accounts_are_spread_over_the_shards(shards):
+    accounts, first, second=shards
+    assert isinstance(accounts, bank.ShardedAccounts)
+    assert first in accounts.parts[0] and second in accounts.parts[1]
+    assert set(restart())==set(accounts)
+
+def test_transfer_across_shards_is_prepared_then_committed(shards):
+    accounts, first, second=shards
+    post(accounts, [first, second], bank.post_transfer, 40)
+    for store in bank.SHARDS:
+        prepare, commit=records(store)[-2:]
+        assert commit=={'commit': prepare['prepare']} and prepare['shards']==[0, 1]
+    assert bank.transfer_decisions()=={prepare['prepare']}
+    accounts=restart()
+    assert accounts[first]['Balance']==60 and accounts[second]['Balance']==140
+
+def test_transfer_that_cannot_be_decided_is_aborted(shards, monkeypatch):
+    accounts, first, second=shards
+    def fail(txid):
+        raise OSError('disk full')
+    monkeypatch.setattr(bank, 'record_decision', fail)
+    with pytest.raises(bank.BankingError):
+        post(accounts, [first, second], bank.post_transfer, 40)
+    assert accounts[first]['Balance']==100 and accounts[second]['Balance']==100
+    assert all(records(store)[-1]=={'abort': records(store)[-2]['prepare']} for store in bank.SHARDS)
+    accounts=restart()
+    assert accounts[first]['Balance']==100 and accounts[second]['Balance']==100
+
+#A process that stops after the decision but before the commit records is rolled forward by the next reader.
+def test_decided_transfer_is_rolled_forward_after_a_crash(shards, monkeypatch):
+    accounts, first, second=shards
+    class Crash(Exception):
+        pass
+    append_journal=bank.append_journal
+    def crash_on_commit(record, store):
+        if 'commit' in record:
+            raise Crash()
+        append_journal(record, store)
+    monkeypatch.setattr(bank, 'append_journal', crash_on_commit)
+    with pytest.raises(Crash):
+        post(accounts, [first, second], bank.post_transfer, 40)
+    monkeypatch.setattr(bank, 'append_journal', append_journal)
+    accounts=restart()
+    assert accounts[first]['Balance']==60 and accounts[second]['Balance']==140
+    assert all('commit' in records(store)[-1] for store in bank.SHARDS)
+
+def test_compaction_clears_the_decisions(shards):
+    accounts, first, second=shards
+    post(accounts, [first, second], bank.post_transfer, 40)
+    bank.compact_journal(accounts)
+    assert os.path.getsize(bank.transfers_path)==0
+    accounts=restart()
+    assert accounts[first]['Balance']==60 and accounts[second]['Balance']==140
+
+def test_reshard_moves_every_account(shards, tmp_path):
+    accounts, first, second=shards
+    post(accounts, [first, second], bank.post_transfer, 40)
+    bank.reshard_command('3', *(str(tmp_path/f'new-{number}') for number in range(3)))
+    with open(bank.shards_path) as f:
+        assert len(json.load(f)['shards'])==3
+    resharded=restart()
+    assert len(bank.SHARDS)==3 and set(resharded)==set(accounts)
+    assert resharded[first]['Balance']==60 and resharded[second]['Balance']==140
@@ -0,0 +1,45 @@
+import sqlite3
+import Bank_Management_Project as bank
+from conftest import open_accounts, deposit
+
+def test_changes_are_stored_in_the_database(sqlite_store):
+    accounts, (first, second)=open_accounts()
+    deposit(accounts, first, 25)
+    with bank.account_transaction(accounts, first, second):
+        bank.save_accounts(accounts, *bank.post_transfer(accounts, first, second, 40))
+    accounts=bank.load_data()
+    assert accounts[first]['Balance']==85 and accounts[second]['Balance']==140
+    assert [txn['amount'] for txn in bank.transactions_from(accounts[first], 0)]==[100, 25, 40]
+    conn=sqlite3.connect(sqlite_store)
+    assert conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]==5
+    assert conn.execute('SELECT version FROM accounts WHERE account_id=?', (first,)).fetchone()[0]==accounts[first]['Version']
+
+def test_transactions_start_from_the_stored_version(sqlite_store):
+    accounts, (first, second)=open_accounts()
+    other=bank.load_data()
+    deposit(other, first, 10)
+    deposit(accounts, first, 5)
+    assert accounts[first]['Balance']==115
+    assert bank.load_data()[first]['Balance']==115
+    assert len(bank.load_data()[first]['Transactions'])==3
+
+def test_refresh_and_lookups_see_other_clients(sqlite_store):
+    accounts=bank.load_data()
+    other, (first, second)=open_accounts()
+    assert first not in accounts
+    assert bank.resolve_account(accounts, other[second]['Account number'])==second
+    bank.refresh_accounts(accounts, [first])
+    assert accounts[first]['Name']=='Holder 0'
+
+def test_migrate_json_to_sqlite(sqlite_store, monkeypatch):
+    monkeypatch.setattr(bank, 'STORAGE_BACKEND', 'json')
+    accounts, (first, second)=open_accounts()
+    bank.compact_journal(accounts)
+    deposit(accounts, first, 25)
+    bank.migrate_json_to_sqlite()
+    monkeypatch.setattr(bank, 'STORAGE_BACKEND', 'sqlite')
+    migrated=bank.load_data()
+    assert set(migrated)=={first, second}
+    assert migrated[first]['Balance']==125
+    assert [txn['amount'] for txn in migrated[first]['Transactions']]==[100, 25]
+    assert migrated[second]['PIN']=='1234'
@@ -0,0 +1,41 @@
+import json, multiprocessing
+import pytest
+import Bank_Management_Project as bank
+from benchmark import synthetic_accounts, stress_client, total_balance
+from conftest import restart
+
+PROCESSES, THREADS, TRANSFERS=3, 3, 30
+TIMEOUT=120  # seconds, so clients that keep conflicting fail the test instead of hanging it
+
+#The clients are separate processes that pick up the store from the environment, so it is set to the test's
+#directory before they start. 'json-sharded' spreads the accounts over two shards, so transfers also go through
+#the two-phase commit.
+@pytest.fixture(params=['json', 'json-sharded', 'sqlite'])
+def backend(request, store, tmp_path, monkeypatch):
+    monkeypatch.setenv('BANK_DATA_DIR', str(tmp_path))
+    monkeypatch.setenv('BANK_STORAGE_BACKEND', request.param.split('-')[0])
+    if request.param=='sqlite':
+        request.getfixturevalue('sqlite_store')
+    if request.param=='json-sharded':
+        monkeypatch.setattr(bank, 'directory', str(tmp_path))
+        monkeypatch.setattr(bank, 'shards_path', str(tmp_path/'shards.json'))
+        with open(tmp_path/'shards.json', 'w') as f:
+            json.dump({'shards': ['00', '01']}, f)
+        bank.SHARDS[:]=bank.open_shards()
+    return request.param
+
+#Money only moves between accounts, so however the clients interleave, the total balance must come out unchanged
+#and every transfer must show up once on each side.
+def test_concurrent_clients_conserve_balances(backend):
+    accounts=synthetic_accounts(20, currency='USD')
+    bank.save_accounts(accounts)
+    before=total_balance(accounts)
+    with multiprocessing.get_context('spawn').Pool(PROCESSES) as pool:
+        results=pool.starmap_async(stress_client, [(seed, THREADS, TRANSFERS) for seed in range(PROCESSES)]).get(TIMEOUT)
+    assert sum(result['ok']+result['rejected'] for result in results)==PROCESSES*THREADS*TRANSFERS
+    after=restart()
+    transfers={kind: [txn['amount'] for account in after.values() for txn in account['Transactions'] if txn['type']==kind] for kind in ('Transfer Out', 'Transfer In')}
+    assert total_balance(after)==before
+    assert len(transfers['Transfer Out'])==len(transfers['Transfer In'])==sum(result['ok'] for result in results)
+    assert sum(transfers['Transfer Out'])==sum(transfers['Transfer In'])
+    assert all(account['Balance']>=0 for account in after.values())